@@ -0,0 +1,239 @@
+# 原始页面归档
+#
+# 抓取到的页面压缩后追加写入分段文件（segment-00001.dat ...），按内容哈希去重；
+# SQLite 索引记录 URL、book_id 到 (分段, 偏移) 的映射。读取时用 mmap 直接定位记录，
+# 供 `scrapy reparse` 在解析逻辑修改后重放归档页面，而不必重新抓取。
+#
+# 记录格式：RECORD_HEADER(魔数, 编码, 元数据长度, 正文长度) + 元数据 JSON + 压缩正文
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import queue
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+from urllib.parse import urlparse
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from douban.urls import DETAIL_PATTERN
+
+RECORD_MAGIC = b'DBPA'
+RECORD_HEADER = struct.Struct('<4sBII')
+
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    url TEXT NOT NULL,
+    book_id TEXT,
+    callback TEXT,
+    status INTEGER,
+    content_hash TEXT NOT NULL,
+    segment INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    fetched_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_pages_url ON pages (url, fetched_at);
+CREATE INDEX IF NOT EXISTS idx_pages_book_id ON pages (book_id);
+CREATE INDEX IF NOT EXISTS idx_pages_hash ON pages (content_hash);
+"""
+
+
+def _compress(body, codec):
+    if codec == CODEC_ZSTD:
+        return zstandard.ZstdCompressor(level=6).compress(body)
+    return zlib.compress(body, 6)
+
+
+def _decompress(data, codec):
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError('归档使用了 zstd 压缩，需要安装 zstandard')
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def segment_name(segment):
+    return f'segment-{segment:05d}.dat'
+
+
+class PageArchive:
+    """追加写入的压缩页面归档，写入方和读取方都通过这个类访问"""
+
+    def __init__(self, directory, segment_max_bytes=256 * 1024 * 1024, codec='zlib', readonly=False):
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.codec = CODEC_ZSTD if codec == 'zstd' and zstandard is not None else CODEC_ZLIB
+        self.readonly = readonly
+        self.logger = logging.getLogger('archive')
+        self._maps = {}  # 分段号 -> (文件, mmap)
+
+        if not readonly:
+            os.makedirs(directory, exist_ok=True)
+        # 写入由 ArchiveWriter 的后台线程独占，允许跨线程使用连接
+        index_path = os.path.join(directory, 'index.db')
+        if readonly:
+            self.db = sqlite3.connect(f'file:{index_path}?mode=ro', uri=True, check_same_thread=False)
+        else:
+            self.db = sqlite3.connect(index_path, check_same_thread=False)
+            self.db.executescript(INDEX_SCHEMA)
+        segments = [int(name[8:13]) for name in os.listdir(directory)
+                    if name.startswith('segment-') and name.endswith('.dat')]
+        self.segment = max(segments) if segments else 1
+        self._file = None
+
+    # ------------------------------------------------------------------
+    # 写入
+    # ------------------------------------------------------------------
+
+    def _segment_file(self):
+        """当前可写的分段文件，超过大小上限时切换到新分段"""
+        if self._file is not None and self._file.tell() < self.segment_max_bytes:
+            return self._file
+        if self._file is not None:
+            self._file.close()
+            self.segment += 1
+        self._file = open(os.path.join(self.directory, segment_name(self.segment)), 'ab')
+        if self._file.tell() >= self.segment_max_bytes:
+            return self._segment_file()
+        return self._file
+
+    def append(self, url, body, status=200, callback=None, meta=None, fetched_at=None):
+        """写入一个页面，正文相同的页面只保存一份，返回 (分段, 偏移)"""
+        fetched_at = fetched_at or time.time()
+        digest = hashlib.sha1(body).hexdigest()
+        match = DETAIL_PATTERN.match(urlparse(url).path or '/')
+        book_id = match.group(1) if match else None
+
+        row = self.db.execute('SELECT segment, offset, length FROM pages WHERE content_hash = ? LIMIT 1',
+                              (digest,)).fetchone()
+        if row is None:
+            f = self._segment_file()
+            header = json.dumps({'url': url, 'status': status, 'callback': callback,
+                                 'meta': meta or {}}, ensure_ascii=False).encode('utf-8')
+            data = _compress(body, self.codec)
+            offset = f.tell()
+            f.write(RECORD_HEADER.pack(RECORD_MAGIC, self.codec, len(header), len(data)))
+            f.write(header)
+            f.write(data)
+            row = (self.segment, offset, RECORD_HEADER.size + len(header) + len(data))
+
+        self.db.execute('INSERT INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (url, book_id, callback, status, digest) + tuple(row) + (fetched_at,))
+        return row[0], row[1]
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+        self.db.commit()
+
+    # ------------------------------------------------------------------
+    # 读取
+    # ------------------------------------------------------------------
+
+    def _map(self, segment):
+        if segment not in self._maps:
+            f = open(os.path.join(self.directory, segment_name(segment)), 'rb')
+            self._maps[segment] = (f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        return self._maps[segment][1]
+
+    def read(self, segment, offset):
+        """读取一条记录，返回 (元数据, 正文)"""
+        buf = self._map(segment)
+        magic, codec, header_len, data_len = RECORD_HEADER.unpack_from(buf, offset)
+        if magic != RECORD_MAGIC:
+            raise ValueError(f'归档记录损坏: 分段 {segment} 偏移 {offset}')
+        start = offset + RECORD_HEADER.size
+        header = json.loads(buf[start:start + header_len].decode('utf-8'))
+        start += header_len
+        return header, _decompress(buf[start:start + data_len], codec)
+
+    def latest(self, callback=None, limit=None):
+        """每个 URL 最近一次抓取的 (url, 回调, 抓取时间, 分段, 偏移)"""
+        sql = ('SELECT url, callback, MAX(fetched_at), segment, offset FROM pages '
+               + ('WHERE callback = ? ' if callback else '')
+               + 'GROUP BY url ORDER BY segment, offset')
+        params = (callback,) if callback else ()
+        if limit:
+            sql += ' LIMIT ?'
+            params += (int(limit),)
+        return self.db.execute(sql, params).fetchall()
+
+    def lookup(self, url=None, book_id=None):
+        """按 URL 或 book_id 查找最近一次抓取的记录位置"""
+        column, value = ('url', url) if url else ('book_id', book_id)
+        return self.db.execute(f'SELECT segment, offset, fetched_at FROM pages WHERE {column} = ? '
+                               'ORDER BY fetched_at DESC LIMIT 1', (value,)).fetchone()
+
+    def close(self):
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        for f, buf in self._maps.values():
+            buf.close()
+            f.close()
+        self._maps = {}
+        self.db.close()
+
+
+class ArchiveWriter:
+    """后台线程写入归档，抓取线程只做一次入队"""
+
+    def __init__(self, archive, queue_size=1000, commit_every=200, stats=None):
+        self.archive = archive
+        self.commit_every = commit_every
+        self.stats = stats
+        self.logger = logging.getLogger('archive')
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, name='PageArchive', daemon=True)
+        self._thread.start()
+
+    def put(self, url, body, status, callback, meta):
+        try:
+            self._queue.put_nowait((url, body, status, callback, meta, time.time()))
+        except queue.Full:
+            if self.stats is not None:
+                self.stats.inc_value('archive/dropped')
+            return False
+        return True
+
+    def _run(self):
+        pending = 0
+        while True:
+            try:
+                record = self._queue.get(timeout=5)
+            except queue.Empty:
+                record = False
+            if record is None:
+                break
+            if record:
+                url, body, status, callback, meta, fetched_at = record
+                try:
+                    self.archive.append(url, body, status, callback, meta, fetched_at)
+                    pending += 1
+                    if self.stats is not None:
+                        self.stats.inc_value('archive/pages')
+                        self.stats.inc_value('archive/bytes', len(body))
+                except Exception as e:
+                    self.logger.error(f"归档页面失败: {url}, {str(e)}")
+            # 攒够一批或空闲时提交索引
+            if pending and (pending >= self.commit_every or record is False):
+                self.archive.flush()
+                pending = 0
+        self.archive.close()
+
+    def close(self, timeout=30):
+        self._queue.put(None)
+        self._thread.join(timeout)
@@ -0,0 +1,398 @@
+# 浏览器资源管理
+#
+# DrissionPageMiddleware 使用的浏览器标签页池和生命周期管理组件。
+# 这里的对象只在下载线程中被使用，不涉及 Twisted reactor。
+
+import logging
+import queue
+import threading
+import time
+
+import psutil
+
+from douban.throttle import ANONYMOUS_IDENTITY
+
+
+def identity_cookies(entry, domain='.douban.com'):
+    """把 Cookie 池中的一项转换为 CDP Storage.setCookies 使用的 Cookie 列表
+
+    支持两种写法：{'cookie': 'k1=v1; k2=v2', 'user_id': ...} 或 {'bid': 'xxx', 'dbcl2': 'xxx'}。
+    """
+    if 'cookie' in entry:
+        pairs = [item.split('=', 1) for item in str(entry['cookie']).split(';') if '=' in item]
+    else:
+        pairs = list(entry.items())
+    return [
+        {'name': str(name).strip(), 'value': str(value).strip(), 'domain': domain, 'path': '/'}
+        for name, value in pairs
+    ]
+
+
+class TabPool:
+    """浏览器标签页池
+
+    在同一个浏览器进程中预先打开 N 个标签页，每次抓取从池中取出一个，
+    用完后归还。标签页各自持有独立的 CDP 连接，可以在不同线程中并行使用。
+
+    传入 contexts 时，标签页轮流分配到各个浏览器上下文（每个上下文对应一个
+    Cookie 身份），同一浏览器进程可以同时为多个身份抓取。空闲标签页按身份分开排队，
+    取标签页时指定身份，只会拿到该身份上下文中的标签页；身份为 None 表示默认上下文。
+    """
+
+    def __init__(self, browser, size=1, contexts=None):
+        self.browser = browser
+        self.size = max(1, int(size))
+        self.logger = logging.getLogger('DrissionPage')
+        self._tabs = {}  # 身份名 -> 空闲标签页队列
+        self._all_tabs = []
+        self._identities = {}  # 标签页ID -> 身份名
+        self._lock = threading.Lock()
+        self._closed = False
+
+        if contexts:
+            # 每个身份至少一个标签页
+            for i in range(max(self.size, len(contexts))):
+                identity, context_id = contexts[i % len(contexts)]
+                self._add_tab(self._new_context_tab(context_id), identity)
+        else:
+            # 第一个标签页直接复用浏览器自带的页面
+            self._add_tab(browser)
+            for _ in range(self.size - 1):
+                self._add_tab(browser.new_tab())
+        self.logger.info(f"标签页池初始化完成，共 {len(self._all_tabs)} 个标签页")
+
+    def _new_context_tab(self, context_id):
+        """在指定浏览器上下文中新建标签页，context_id 为 None 时在默认上下文中新建"""
+        if context_id is None:
+            return self.browser.new_tab()
+        target_id = self.browser.run_cdp('Target.createTarget', url='about:blank',
+                                         browserContextId=context_id)['targetId']
+        return self.browser.get_tab(target_id)
+
+    def _add_tab(self, tab, identity=None):
+        with self._lock:
+            self._all_tabs.append(tab)
+            self._identities[tab.tab_id] = identity
+            self._tabs.setdefault(identity, queue.Queue()).put(tab)
+
+    def has_identity(self, identity):
+        """池中是否有该身份的标签页"""
+        return identity in self._tabs
+
+    def add_identity_tab(self, identity, context_id, setup_tab=None):
+        """为新身份在其浏览器上下文中新建一个标签页，初始化完成后才放入池中"""
+        if self._closed:
+            raise RuntimeError('标签页池已关闭')
+        tab = self._new_context_tab(context_id)
+        if setup_tab:
+            setup_tab(tab)
+        self._add_tab(tab, identity)
+        self.logger.info(f"为身份[{identity or '默认'}]新建标签页")
+        return tab
+
+    def identity_of(self, tab):
+        """标签页所属的身份名，默认上下文返回 None"""
+        return self._identities.get(tab.tab_id)
+
+    @property
+    def tabs(self):
+        """池中所有标签页（包括正在使用的）"""
+        return list(self._all_tabs)
+
+    def acquire(self, identity=None, timeout=None):
+        """取出一个该身份的空闲标签页，超时抛出 queue.Empty"""
+        if self._closed:
+            raise RuntimeError('标签页池已关闭')
+        tabs = self._tabs.get(identity)
+        if tabs is None:
+            raise KeyError(identity)
+        return tabs.get(timeout=timeout)
+
+    def release(self, tab):
+        """归还标签页到其所属身份的队列"""
+        if not self._closed:
+            self._tabs[self._identities.get(tab.tab_id)].put(tab)
+
+    def close(self):
+        """关闭标签页池，浏览器本身由调用方负责退出"""
+        with self._lock:
+            self._closed = True
+            self._all_tabs = []
+
+
+class BrowserInstance:
+    """一个浏览器进程及其标签页池，记录已服务页数和内存占用"""
+
+    def __init__(self, page, pool_size, setup_tab=None, identities=None):
+        self.page = page
+        self.identities = dict(identities or [])  # 身份名 -> Cookie 列表
+        self.contexts = {}  # 身份名 -> 浏览器上下文ID
+        for identity, cookies in self.identities.items():
+            context_id = page.run_cdp('Target.createBrowserContext')['browserContextId']
+            self.contexts[identity] = context_id
+            self.set_cookies(identity)
+        self.tab_pool = TabPool(page, pool_size, contexts=list(self.contexts.items()))
+        self.setup_tab = setup_tab
+        if setup_tab:
+            for tab in self.tab_pool.tabs:
+                setup_tab(tab)
+        self._lock = threading.Lock()
+        self.pages_served = 0
+        self.in_flight = 0
+        self.retiring = False
+        self.blocked_urls = {}  # 标签页ID -> 当前生效的资源屏蔽规则
+        self.created_at = time.time()
+        self.closed = False
+
+    def ensure_identity(self, identity, cookies=None):
+        """确保标签页池中有该身份的标签页，返回取标签页时使用的身份名
+
+        没有身份或匿名身份使用默认上下文（没有 Cookie）；其他身份没有对应的上下文时，
+        用请求的 Cookie 新建一个上下文和标签页。
+        """
+        if not identity or identity == ANONYMOUS_IDENTITY:
+            identity, context_id = None, None
+        elif identity in self.contexts:
+            return identity
+        if self.tab_pool.has_identity(identity):
+            return identity
+        with self._lock:
+            if self.tab_pool.has_identity(identity):
+                return identity
+            if identity is not None:
+                context_id = self.page.run_cdp('Target.createBrowserContext')['browserContextId']
+                self.contexts[identity] = context_id
+                self.identities[identity] = identity_cookies(cookies) if cookies else []
+                self.set_cookies(identity)
+            self.tab_pool.add_identity_tab(identity, context_id, setup_tab=self.setup_tab)
+        return identity
+
+    def set_cookies(self, identity):
+        """一次 CDP 调用写入某个身份上下文的全部 Cookie"""
+        cookies = self.identities.get(identity)
+        if not cookies:
+            return
+        self.page.run_cdp('Storage.setCookies', cookies=cookies,
+                          browserContextId=self.contexts[identity])
+
+    @property
+    def pid(self):
+        try:
+            return self.page.process_id
+        except Exception:
+            return None
+
+    def is_alive(self):
+        """浏览器进程是否仍然存活"""
+        pid = self.pid
+        if pid is not None and not psutil.pid_exists(pid):
+            return False
+        try:
+            return self.page.browser.states.is_alive
+        except Exception:
+            return False
+
+    def rss_mb(self):
+        """浏览器主进程及所有子进程（渲染、GPU等）的 RSS 总和，单位 MB"""
+        pid = self.pid
+        if pid is None:
+            return 0
+        try:
+            proc = psutil.Process(pid)
+            procs = [proc] + proc.children(recursive=True)
+        except psutil.Error:
+            return 0
+        total = 0
+        for p in procs:
+            try:
+                total += p.memory_info().rss
+            except psutil.Error:
+                continue
+        return total / 1024 / 1024
+
+    def quit(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.tab_pool.close()
+        try:
+            self.page.quit()
+        except Exception:
+            pass
+
+
+class BrowserManager:
+    """浏览器生命周期管理
+
+    - 按已服务页数或 RSS 阈值回收浏览器，避免内存持续上涨导致容器 OOM
+    - 预先启动一个备用浏览器，回收时直接切换，不占用抓取时间
+    - 检测到浏览器崩溃时自动替换
+    - 被回收的浏览器等其上正在进行的抓取全部结束后再退出
+    """
+
+    def __init__(self, launcher, pool_size=1, setup_tab=None, identities=None, max_pages=500,
+                 max_rss_mb=600, rss_check_interval=20, prewarm_spare=True, stats=None):
+        self.launcher = launcher
+        self.pool_size = pool_size
+        self.setup_tab = setup_tab
+        self.identities = identities
+        self.max_pages = max_pages
+        self.max_rss_mb = max_rss_mb
+        self.rss_check_interval = max(1, rss_check_interval)
+        self.prewarm_spare = prewarm_spare
+        self.stats = stats
+        self.logger = logging.getLogger('DrissionPage')
+
+        self.current = None
+        self.spare = None
+        self._launching_spare = False
+        self._closed = False
+        self._lock = threading.RLock()
+
+    def start(self):
+        """启动当前浏览器，并在后台预热备用浏览器"""
+        with self._lock:
+            try:
+                self.current = self._launch()
+            except Exception as e:
+                self.logger.error(f"浏览器启动失败: {str(e)}")
+                self.logger.exception(e)
+        self._ensure_spare()
+
+    def _launch(self):
+        instance = BrowserInstance(self.launcher(), self.pool_size, self.setup_tab,
+                                   identities=self.identities)
+        self._inc_stat('browser/launched')
+        self.logger.info(f"浏览器已启动, pid: {instance.pid}")
+        return instance
+
+    def _ensure_spare(self):
+        """后台启动备用浏览器"""
+        with self._lock:
+            if (not self.prewarm_spare or self._closed or self.spare is not None
+                    or self._launching_spare):
+                return
+            self._launching_spare = True
+        threading.Thread(target=self._launch_spare, name='BrowserSpare', daemon=True).start()
+
+    def _launch_spare(self):
+        try:
+            spare = self._launch()
+        except Exception as e:
+            self.logger.error(f"备用浏览器启动失败: {str(e)}")
+            spare = None
+        with self._lock:
+            self._launching_spare = False
+            if self._closed and spare is not None:
+                spare.quit()
+            else:
+                self.spare = spare
+
+    def _promote(self):
+        """用备用浏览器（没有则同步启动新浏览器）替换当前浏览器，调用方需持有锁"""
+        spare, self.spare = self.spare, None
+        self.current = None
+        try:
+            if spare is not None and spare.is_alive():
+                self.current = spare
+            else:
+                if spare is not None:
+                    spare.quit()
+                self.current = self._launch()
+        finally:
+            self._ensure_spare()
+
+    def acquire(self, timeout=60, identity=None, cookies=None):
+        """取出一个该身份的空闲标签页，返回 (浏览器实例, 标签页)，超时抛出 queue.Empty
+
+        标签页所在的浏览器上下文与请求的 Cookie 身份一致，延迟、AIMD 和升级记忆
+        记到哪个身份上，实际抓取就使用哪个身份。
+        """
+        deadline = time.time() + timeout
+        while True:
+            with self._lock:
+                if self._closed:
+                    raise RuntimeError('浏览器管理器已关闭')
+                if self.current is None or self.current.retiring:
+                    self._promote()
+                elif not self.current.is_alive():
+                    self._replace_crashed()
+                instance = self.current
+
+            try:
+                # 短超时轮询，当前浏览器被替换后可以及时切换到新实例
+                key = instance.ensure_identity(identity, cookies)
+                tab = instance.tab_pool.acquire(key, timeout=min(1, max(0.01, deadline - time.time())))
+            except (queue.Empty, RuntimeError):
+                if time.time() >= deadline:
+                    raise queue.Empty()
+                continue
+
+            with self._lock:
+                if instance.retiring:
+                    # 取到标签页时浏览器已被回收，换到新的浏览器上重试
+                    continue
+                instance.in_flight += 1
+            return instance, tab
+
+    def release(self, instance, tab, failed=False):
+        """归还标签页，并按需回收或替换浏览器"""
+        with self._lock:
+            instance.in_flight -= 1
+            instance.pages_served += 1
+            instance.tab_pool.release(tab)
+
+            try:
+                if failed and instance is self.current and not instance.is_alive():
+                    self._replace_crashed()
+                elif instance is self.current and self._should_recycle(instance):
+                    self._retire(instance)
+                    self._inc_stat('browser/recycled')
+                    self._promote()
+            except Exception as e:
+                # 新浏览器启动失败时，下次 acquire 会再次尝试
+                self.logger.error(f"替换浏览器失败: {str(e)}")
+
+            if instance.retiring and instance.in_flight <= 0:
+                instance.quit()
+
+    def _should_recycle(self, instance):
+        if self.max_pages and instance.pages_served >= self.max_pages:
+            self.logger.info(f"浏览器已服务 {instance.pages_served} 个页面，准备回收")
+            return True
+        if self.max_rss_mb and instance.pages_served % self.rss_check_interval == 0:
+            rss = instance.rss_mb()
+            if self.stats is not None:
+                self.stats.max_value('browser/rss_mb', int(rss))
+            if rss >= self.max_rss_mb:
+                self.logger.info(f"浏览器内存占用 {rss:.0f}MB 超过阈值，准备回收")
+                return True
+        return False
+
+    def _retire(self, instance):
+        instance.retiring = True
+        instance.tab_pool.close()
+        if instance.in_flight <= 0:
+            instance.quit()
+
+    def _replace_crashed(self):
+        """当前浏览器不存在或已崩溃时替换，调用方需持有锁"""
+        if self.current is not None:
+            self.logger.warning(f"检测到浏览器崩溃, pid: {self.current.pid}，正在替换")
+            self._inc_stat('browser/crashed')
+            self._retire(self.current)
+        self._promote()
+
+    def close(self):
+        """退出所有浏览器"""
+        with self._lock:
+            self._closed = True
+            for instance in (self.current, self.spare):
+                if instance is not None:
+                    instance.quit()
+            self.current = None
+            self.spare = None
+
+    def _inc_stat(self, key, value=1):
+        if self.stats is not None:
+            self.stats.inc_value(key, value)
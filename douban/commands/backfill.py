@@ -0,0 +1,94 @@
+"""scrapy backfill：把已有图书的文本字段转换为数值/日期
+
+BatchMongoPipeline 只规范化新写入的数据。该命令按 _id 顺序分块读取仍含文本值的文档，
+用 douban.normalize 转换后按块无序 bulk_write 写回，原文保存在 raw 中，并创建查询索引。
+已转换的文档不再匹配查询条件，中断后重新执行会从剩余的文档继续。
+
+用法：
+    scrapy backfill [--batch-size 1000] [--limit 0] [--dry-run]
+"""
+import logging
+import time
+
+import pymongo
+from pymongo.errors import BulkWriteError
+from scrapy.commands import ScrapyCommand
+
+from douban.normalize import PARSERS, ensure_indexes, normalize_item
+
+logger = logging.getLogger('backfill')
+
+
+class Command(ScrapyCommand):
+    requires_project = True
+    default_settings = {'LOG_LEVEL': 'INFO'}
+
+    def syntax(self):
+        return '[options]'
+
+    def short_desc(self):
+        return '把已有图书的评分、页数、定价、出版年、抓取时间转换为数值/日期'
+
+    def add_options(self, parser):
+        ScrapyCommand.add_options(self, parser)
+        parser.add_argument('--batch-size', dest='batch_size', type=int, default=1000,
+                            help='每块读取和写回的文档数')
+        parser.add_argument('--limit', dest='limit', type=int, default=0,
+                            help='最多转换的文档数，默认全部')
+        parser.add_argument('--dry-run', dest='dry_run', action='store_true',
+                            help='只统计需要转换的文档，不写回')
+        parser.add_argument('--no-index', dest='no_index', action='store_true',
+                            help='不创建查询索引')
+
+    def run(self, args, opts):
+        client = pymongo.MongoClient(self.settings.get('MONGO_URI'), **self.settings.getdict('MONGODB_PARAMS'))
+        collection = client[self.settings.get('MONGO_DATABASE', 'douban')][self.settings.get('MONGO_COLLECTION', 'books')]
+        try:
+            self._backfill(collection, opts)
+            if not opts.dry_run and not opts.no_index:
+                logger.info('创建查询索引...')
+                ensure_indexes(collection)
+        finally:
+            client.close()
+
+    def _backfill(self, collection, opts):
+        # 任一字段仍是字符串的文档
+        pending = {'$or': [{field: {'$type': 'string'}} for field in PARSERS]}
+        projection = dict.fromkeys(list(PARSERS) + ['book_id', 'raw'], 1)
+        last_id = None
+        scanned = modified = 0
+        started = time.monotonic()
+
+        while not opts.limit or scanned < opts.limit:
+            size = opts.batch_size if not opts.limit else min(opts.batch_size, opts.limit - scanned)
+            query = dict(pending, _id={'$gt': last_id}) if last_id is not None else pending
+            docs = list(collection.find(query, projection).sort('_id', pymongo.ASCENDING).limit(size))
+            if not docs:
+                break
+            last_id = docs[-1]['_id']
+            scanned += len(docs)
+
+            operations = []
+            for doc in docs:
+                doc_id = doc.pop('_id')
+                book_id = doc.get('book_id')
+                changes = normalize_item(doc)
+                changes.pop('book_id', None)
+                # 带上分片键，经 mongos 时只路由到所在的分片
+                selector = {'_id': doc_id} if book_id is None else {'_id': doc_id, 'book_id': book_id}
+                operations.append(pymongo.UpdateOne(selector, {'$set': changes}))
+
+            if not opts.dry_run:
+                try:
+                    result = collection.bulk_write(operations, ordered=False)
+                    modified += result.modified_count
+                except BulkWriteError as e:
+                    # 个别失败的文档仍是文本，下次执行时会再次匹配
+                    modified += e.details.get('nModified', 0)
+                    logger.warning(f"部分文档写回失败: {len(e.details.get('writeErrors', []))} 条")
+
+            elapsed = time.monotonic() - started
+            logger.info(f"已处理 {scanned} 条, 已更新 {modified} 条, 速度 {scanned / max(elapsed, 1e-6):.0f} 条/秒")
+
+        action = '需要转换' if opts.dry_run else '已转换'
+        logger.info(f"完成: {action} {scanned if opts.dry_run else modified} 条文档, 耗时 {time.monotonic() - started:.1f} 秒")
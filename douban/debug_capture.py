@@ -0,0 +1,116 @@
+# 调试页面采集
+#
+# 正常页面按采样率保存，异常页面（内容过小、缺少关键元素、验证码等）必定保存。
+# 页面 gzip 压缩后由后台线程写入环形目录，目录中文件数超过上限时删除最旧的文件，
+# 回调所在的 reactor 线程只做一次入队操作。
+
+import gzip
+import hashlib
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+
+# 与 check_anti_spider 一致的验证码标记
+CAPTCHA_MARKERS = ('验证码'.encode('utf-8'), '人机验证'.encode('utf-8'))
+
+
+class DebugCaptureStore:
+    """采样 + 异常必采的调试页面存储"""
+
+    def __init__(self, directory, sample_rate=0.01, max_files=500, min_body=1000,
+                 queue_size=100, stats=None):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.max_files = max(1, max_files)
+        self.min_body = min_body
+        self.stats = stats
+        self.logger = logging.getLogger('debug_capture')
+
+        os.makedirs(directory, exist_ok=True)
+        # 文件名以毫秒时间戳开头，按名称排序即按时间排序
+        self._files = deque(sorted(name for name in os.listdir(directory)
+                                   if name.endswith('.html.gz')))
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._writer, name='DebugCapture', daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('DEBUG_CAPTURE_ENABLED', True):
+            return None
+        return cls(
+            settings.get('DEBUG_CAPTURE_DIR') or os.path.join(os.getcwd(), 'logs', 'captures'),
+            sample_rate=settings.getfloat('DEBUG_CAPTURE_SAMPLE_RATE', 0.01),
+            max_files=settings.getint('DEBUG_CAPTURE_MAX_FILES', 500),
+            min_body=settings.getint('DEBUG_CAPTURE_MIN_BODY', 1000),
+            queue_size=settings.getint('DEBUG_CAPTURE_QUEUE_SIZE', 100),
+            stats=crawler.stats,
+        )
+
+    def anomaly(self, response):
+        """检查通用异常，返回原因或 None"""
+        if len(response.body) < self.min_body:
+            return 'small_body'
+        if response.status != 200:
+            return f'http_{response.status}'
+        if any(marker in response.body for marker in CAPTCHA_MARKERS):
+            return 'captcha'
+        return None
+
+    def capture(self, response, reason=None):
+        """保存页面：传入 reason 或检测到通用异常时必定保存，否则按采样率保存"""
+        reason = reason or self.anomaly(response)
+        if reason is None:
+            if random.random() >= self.sample_rate:
+                return False
+            reason = 'sample'
+
+        record = (time.time(), response.url, response.status, reason, response.body)
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            # 写入跟不上时直接丢弃，不影响抓取
+            self._inc_stat('debug_capture/dropped')
+            return False
+        self._inc_stat(f'debug_capture/{reason}')
+        return True
+
+    def _writer(self):
+        while True:
+            record = self._queue.get()
+            if record is None:
+                break
+            try:
+                self._write(*record)
+            except Exception as e:
+                self.logger.error(f"保存调试页面失败: {str(e)}")
+
+    def _write(self, ts, url, status, reason, body):
+        url_hash = hashlib.sha1(url.encode('utf-8')).hexdigest()[:12]
+        name = f'{int(ts * 1000)}_{url_hash}_{reason}.html.gz'
+        header = f'<!-- url: {url} status: {status} reason: {reason} time: {ts:.3f} -->\n'
+        with gzip.open(os.path.join(self.directory, name), 'wb', compresslevel=6) as f:
+            f.write(header.encode('utf-8'))
+            f.write(body)
+
+        self._files.append(name)
+        while len(self._files) > self.max_files:
+            oldest = self._files.popleft()
+            try:
+                os.remove(os.path.join(self.directory, oldest))
+            except OSError:
+                pass
+
+    def close(self, timeout=10):
+        """等待已入队的页面写完"""
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _inc_stat(self, key, value=1):
+        if self.stats is not None:
+            self.stats.inc_value(key, value)
@@ -0,0 +1,204 @@
+# 基于 Redis 位图的可扩展布隆过滤器去重
+#
+# scrapy_redis 的 RFPDupeFilter 把每个请求 40 字节的十六进制指纹存进 Redis 集合，
+# SCHEDULER_PERSIST 开启后永不清理，URL 数量到百万级时占用大量内存。
+# 这里改用普通的 SETBIT/GETBIT + Lua 脚本实现可扩展布隆过滤器，不依赖任何 Redis 模块：
+#
+# - 第 i 层容量为 capacity * growth^i，误判率为 p0 * tightening^i，
+#   其中 p0 = error_rate * (1 - tightening)，各层叠加后总误判率不超过 error_rate
+# - 当前层写满后自动新建下一层
+# - 每个指纹取 sha1 的两段 32 位整数 h1、h2，第 j 个位置为 (h1 + j * h2) mod m
+#
+# 指纹按 douban.urls.canonical_key 规范化：详情页只看 book_id，标签列表页只看
+# (标签, start, 排序方式)。已确认见过的键缓存在本地 LRU 中，重复请求不必再访问 Redis。
+#
+# Redis 中的结构：<key>:meta 哈希记录各层参数和计数，<key>:<层号> 为位图。
+# 脚本内按层号拼接键名，只适用于单机 Redis（与现有部署一致）。
+
+import hashlib
+import logging
+import math
+from collections import OrderedDict
+
+from scrapy import signals
+from scrapy_redis import defaults
+from scrapy_redis.connection import get_redis_from_settings
+from scrapy_redis.dupefilter import RFPDupeFilter
+
+from douban.urls import canonical_key
+
+logger = logging.getLogger(__name__)
+
+# 检查并添加：任一层命中全部位即视为已见过，否则写入最后一层（写满时新建一层）
+# KEYS[1] = 过滤器键前缀
+# ARGV = h1, h2, 初始容量, 初始误判率, 容量增长倍数, 误判率收紧系数
+BLOOM_ADD_SCRIPT = """
+local prefix = KEYS[1]
+local meta = prefix .. ':meta'
+local h1 = tonumber(ARGV[1])
+local h2 = tonumber(ARGV[2])
+
+local layers = tonumber(redis.call('HGET', meta, 'layers') or '0')
+
+for i = 0, layers - 1 do
+    local m = tonumber(redis.call('HGET', meta, 'm:' .. i))
+    local k = tonumber(redis.call('HGET', meta, 'k:' .. i))
+    local key = prefix .. ':' .. i
+    local found = true
+    for j = 0, k - 1 do
+        if redis.call('GETBIT', key, (h1 + j * h2) % m) == 0 then
+            found = false
+            break
+        end
+    end
+    if found then
+        return 1
+    end
+end
+
+local last = layers - 1
+if layers == 0 or tonumber(redis.call('HGET', meta, 'n:' .. last)) >=
+        tonumber(redis.call('HGET', meta, 'cap:' .. last)) then
+    last = layers
+    local capacity = math.floor(tonumber(ARGV[3]) * tonumber(ARGV[5]) ^ last)
+    local error_rate = tonumber(ARGV[4]) * tonumber(ARGV[6]) ^ last
+    local ln2 = math.log(2)
+    local m = math.ceil(-capacity * math.log(error_rate) / (ln2 * ln2))
+    -- 单个位图最大 2^32 位
+    if m > 4294967295 then
+        m = 4294967295
+    end
+    local k = math.max(1, math.ceil(m / capacity * ln2))
+    redis.call('HSET', meta, 'layers', last + 1, 'm:' .. last, m, 'k:' .. last, k,
+               'cap:' .. last, capacity, 'n:' .. last, 0)
+end
+
+local m = tonumber(redis.call('HGET', meta, 'm:' .. last))
+local k = tonumber(redis.call('HGET', meta, 'k:' .. last))
+local key = prefix .. ':' .. last
+for j = 0, k - 1 do
+    redis.call('SETBIT', key, (h1 + j * h2) % m, 1)
+end
+redis.call('HINCRBY', meta, 'n:' .. last, 1)
+return 0
+"""
+
+
+def fingerprint_hashes(fp):
+    """把十六进制指纹拆成两段 32 位整数，h2 取奇数保证各位置不重合"""
+    return int(fp[:8], 16), int(fp[8:16], 16) | 1
+
+
+class BloomDupeFilter(RFPDupeFilter):
+    """可扩展布隆过滤器去重，可直接替换 scrapy_redis.dupefilter.RFPDupeFilter"""
+
+    def __init__(self, server, key, debug=False, capacity=1000000, error_rate=0.001,
+                 growth=2, tightening=0.5, lru_size=100000, stats=None):
+        super().__init__(server, key, debug)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.growth = growth
+        self.tightening = tightening
+        self.stats = stats
+        self.lru_size = lru_size
+        self._lru = OrderedDict()  # 已确认见过的指纹
+        self.script = server.register_script(BLOOM_ADD_SCRIPT)
+
+    @classmethod
+    def _bloom_kwargs(cls, settings):
+        return {
+            'debug': settings.getbool('DUPEFILTER_DEBUG'),
+            'capacity': settings.getint('BLOOM_INITIAL_CAPACITY', 1000000),
+            'error_rate': settings.getfloat('BLOOM_ERROR_RATE', 0.001),
+            'growth': settings.getint('BLOOM_GROWTH', 2),
+            'tightening': settings.getfloat('BLOOM_TIGHTENING', 0.5),
+            'lru_size': settings.getint('DUPEFILTER_LRU_SIZE', 100000),
+        }
+
+    @classmethod
+    def from_settings(cls, settings):
+        server = get_redis_from_settings(settings)
+        key = settings.get('SCHEDULER_DUPEFILTER_KEY', defaults.SCHEDULER_DUPEFILTER_KEY) % {'spider': 'default'}
+        return cls(server, key=key + ':bloom', **cls._bloom_kwargs(settings))
+
+    @classmethod
+    def from_spider(cls, spider):
+        settings = spider.settings
+        server = get_redis_from_settings(settings)
+        key = settings.get('SCHEDULER_DUPEFILTER_KEY', defaults.SCHEDULER_DUPEFILTER_KEY) % {'spider': spider.name}
+        crawler = getattr(spider, 'crawler', None)
+        df = cls(server, key=key + ':bloom', stats=crawler.stats if crawler else None,
+                 **cls._bloom_kwargs(settings))
+        if crawler is not None:
+            crawler.signals.connect(df.spider_closed, signal=signals.spider_closed)
+        return df
+
+    def request_fingerprint(self, request):
+        """规范化 URL 的指纹，无法规范化的请求使用 Scrapy 默认指纹"""
+        key = canonical_key(request.url)
+        if key is None:
+            return super().request_fingerprint(request)
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def request_seen(self, request):
+        fp = self.request_fingerprint(request)
+        if fp in self._lru:
+            self._lru.move_to_end(fp)
+            if self.stats is not None:
+                self.stats.inc_value('dupefilter/lru_hit')
+            return True
+
+        h1, h2 = fingerprint_hashes(fp)
+        seen = self.script(keys=[self.key], args=[h1, h2, self.capacity,
+                                                  self.error_rate * (1 - self.tightening),
+                                                  self.growth, self.tightening]) == 1
+        # 脚本执行后该指纹一定已在过滤器中，之后的同一请求直接命中本地缓存
+        self._lru[fp] = True
+        if len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+        return seen
+
+    def layers(self):
+        """各层参数：[{'m': 位数, 'k': 哈希数, 'capacity': 容量, 'count': 已写入数}]"""
+        meta = {k.decode() if isinstance(k, bytes) else k: int(v)
+                for k, v in self.server.hgetall(f'{self.key}:meta').items()}
+        return [
+            {'m': meta[f'm:{i}'], 'k': meta[f'k:{i}'], 'capacity': meta[f'cap:{i}'],
+             'count': meta[f'n:{i}']}
+            for i in range(meta.get('layers', 0))
+        ]
+
+    def report(self):
+        """内存占用和按当前填充量估算的误判率"""
+        layers = self.layers()
+        not_false_positive = 1.0
+        for layer in layers:
+            # 单层误判率 (1 - e^(-kn/m))^k
+            rate = (1 - math.exp(-layer['k'] * layer['count'] / layer['m'])) ** layer['k']
+            layer['fpr'] = rate
+            not_false_positive *= 1 - rate
+        return {
+            'layers': layers,
+            'count': sum(layer['count'] for layer in layers),
+            'memory_bytes': sum(math.ceil(layer['m'] / 8) for layer in layers),
+            'fpr': 1 - not_false_positive,
+        }
+
+    def spider_closed(self, spider):
+        try:
+            report = self.report()
+        except Exception as e:
+            logger.warning(f"读取布隆过滤器状态失败: {str(e)}")
+            return
+        logger.info(f"布隆过滤器: {len(report['layers'])} 层, 指纹 {report['count']} 个, "
+                    f"内存 {report['memory_bytes'] / 1024 / 1024:.1f}MB, 估计误判率 {report['fpr']:.6f}")
+        if self.stats is not None:
+            self.stats.set_value('dupefilter/bloom_layers', len(report['layers']))
+            self.stats.set_value('dupefilter/bloom_count', report['count'])
+            self.stats.set_value('dupefilter/bloom_memory_bytes', report['memory_bytes'])
+            self.stats.set_value('dupefilter/bloom_fpr', round(report['fpr'], 8))
+
+    def clear(self):
+        self._lru.clear()
+        layers = len(self.layers())
+        self.server.delete(f'{self.key}:meta', *[f'{self.key}:{i}' for i in range(layers)])
@@ -0,0 +1,80 @@
+# 页面字段提取
+#
+# 详情页 div#info 的结构是一串 "<span class="pl">标签:</span> 值 <br>"，
+# 作者、译者等多值字段外面还会再包一层 <span>。这里只遍历一次 #info，
+# 把每个 span.pl 标签和它后面的值节点配对，一次得到所有字段。
+
+# span.pl 标签文本 -> BookItem 字段
+INFO_FIELDS = {
+    '作者': 'author',
+    '译者': 'translator',
+    '出版社': 'publisher',
+    '出版年': 'publish_date',
+    '页数': 'pages',
+    '定价': 'price',
+    '装帧': 'binding',
+    'ISBN': 'isbn',
+    '副标题': 'subtitle',
+    '原作名': 'original_title',
+    '丛书': 'series',
+}
+
+# 取链接文本列表的多值字段
+LIST_FIELDS = {'author', 'translator'}
+
+
+def _is_label(node):
+    return node.tag == 'span' and 'pl' in (node.get('class') or '').split()
+
+
+def _clean_name(name):
+    """作者/译者名去掉换行和空格"""
+    return name.replace('\n', '').replace(' ', '').strip()
+
+
+def _pair_value(label):
+    """收集标签后面直到 <br> 或下一个标签为止的值，返回 (文本, 链接文本列表)"""
+    parts = [label.tail or '']
+    links = []
+    for sibling in label.itersiblings():
+        if not isinstance(sibling.tag, str):
+            # 注释等节点
+            parts.append(sibling.tail or '')
+            continue
+        if sibling.tag == 'br' or _is_label(sibling):
+            break
+        if sibling.tag == 'a':
+            links.append(sibling.text or '')
+        else:
+            links.extend(a.text or '' for a in sibling.iter('a'))
+        parts.append(sibling.text_content())
+        parts.append(sibling.tail or '')
+    return ''.join(parts), links
+
+
+def extract_info(info):
+    """单次遍历 div#info 节点（lxml 元素），返回 {BookItem 字段: 值}
+
+    作者、译者返回清理后的名字列表，其余字段返回去掉首尾空白的文本。
+    同一字段出现多次时以第一次为准。
+    """
+    result = {}
+    for node in info.iter('span'):
+        if not _is_label(node):
+            continue
+        label = node.text_content().strip().rstrip(':：').strip()
+        field = INFO_FIELDS.get(label)
+        if field is None or field in result:
+            continue
+
+        text, links = _pair_value(node)
+        if field in LIST_FIELDS:
+            names = links
+            if not names:
+                # 没有链接时取纯文本，去掉标签后的冒号
+                names = [text.strip().lstrip(':：')]
+            names = [_clean_name(n) for n in names if n.strip()]
+            result[field] = [n for n in names if n]
+        else:
+            result[field] = text.strip()
+    return result
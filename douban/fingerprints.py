@@ -0,0 +1,89 @@
+# 按字段的内容指纹缓存
+#
+# 重新抓取的图书大多只有 crawl_time 变化，整文档 $set 仍会让分片重写文档、写 journal 和 oplog。
+# 这里为每个 book_id 缓存各字段的 64 位指纹（LRU 淘汰），写入前逐字段比较：
+#
+# - 缓存和库中都没有：完整 upsert
+# - 部分字段变化：只 $set 变化的字段
+# - 没有变化：只更新 last_seen
+#
+# 缓存未命中的 book_id 按批从 MongoDB 读出已有文档计算指纹（一次 $in 查询），
+# 写入成功后再用本次的指纹更新缓存；写入失败的 book_id 从缓存中删除，下次重新读取。
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+# 不参与比较的字段
+VOLATILE_FIELDS = {'_id', 'crawl_time', 'last_seen'}
+
+WRITE_FULL = 'full'
+WRITE_PARTIAL = 'partial'
+WRITE_SKIPPED = 'skipped'
+
+
+def field_fingerprint(value):
+    """单个字段值的 64 位指纹"""
+    raw = json.dumps(value, sort_keys=True, ensure_ascii=False, default=str)
+    return int.from_bytes(hashlib.md5(raw.encode('utf-8')).digest()[:8], 'little')
+
+
+def document_fingerprint(doc):
+    """文档各字段的指纹 {字段: 指纹}"""
+    return {field: field_fingerprint(value) for field, value in doc.items() if field not in VOLATILE_FIELDS}
+
+
+class FieldFingerprintCache:
+    """book_id -> {字段: 指纹} 的 LRU 缓存，可在写入线程中使用"""
+
+    def __init__(self, max_size=200000):
+        self.max_size = max_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def _put(self, book_id, fingerprint):
+        self._cache[book_id] = fingerprint
+        self._cache.move_to_end(book_id)
+        if len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    def load_missing(self, collection, book_ids, key='book_id'):
+        """从 MongoDB 读取缓存中没有的文档并计算指纹，返回读取的文档数"""
+        with self._lock:
+            missing = [b for b in book_ids if b not in self._cache]
+        if not missing:
+            return 0
+        loaded = 0
+        for doc in collection.find({key: {'$in': missing}}, {'_id': 0}):
+            with self._lock:
+                self._put(doc[key], document_fingerprint(doc))
+            loaded += 1
+        return loaded
+
+    def diff(self, item, key='book_id'):
+        """比较 item 与缓存的指纹，返回 (写入方式, 变化的字段, 新指纹)"""
+        fingerprint = document_fingerprint(item)
+        with self._lock:
+            old = self._cache.get(item.get(key))
+            if old is not None:
+                self._cache.move_to_end(item.get(key))
+        if old is None:
+            return WRITE_FULL, list(fingerprint), fingerprint
+        changed = [field for field, value in fingerprint.items() if old.get(field) != value]
+        return (WRITE_PARTIAL if changed else WRITE_SKIPPED), changed, fingerprint
+
+    def update(self, book_id, fingerprint):
+        """写入成功后合并新指纹（item 中缺少的字段在库中保持不变）"""
+        with self._lock:
+            merged = dict(self._cache.get(book_id) or {})
+            merged.update(fingerprint)
+            self._put(book_id, merged)
+
+    def invalidate(self, book_ids):
+        with self._lock:
+            for book_id in book_ids:
+                self._cache.pop(book_id, None)
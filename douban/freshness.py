@@ -0,0 +1,201 @@
+# 图书新鲜度索引
+#
+# Redis 哈希 book_id -> "最近抓取时间戳,评分人数,内容哈希,内容最近变化时间戳"，由
+# BatchMongoPipeline 在写入 MongoDB 后同步更新，所有工作节点共享。写入时比较内容哈希，
+# 内容没有变化则保留原来的变化时间，重访策略据此放宽长期不变的图书的重访间隔。
+#
+# 爬虫启动时（spider_opened，在线程中）把索引一次性读入本地，每本书在本地只保存
+# 一个整数键和一个打包的整数值。解析列表页时先查本地，本地判断为过期的再批量 HMGET 一次，
+# 得到其他节点之后写入的结果，按重访策略决定是否需要重新抓取详情页。
+#
+# 解析层的工作进程各自构建爬虫，收不到 spider_opened，不做全量加载，只按需 HMGET。
+
+import hashlib
+import json
+import logging
+import time
+
+from scrapy import signals
+from scrapy_redis.connection import get_redis_from_settings
+from twisted.internet import threads
+
+# 默认重访策略：(评分人数下限, 内容未变化时长下限, 最长重访间隔)，单位秒，取第一条满足的。
+# 评分人数越多的书变化越快；冷门书内容长期不变时放宽重访间隔
+DEFAULT_REVISIT_POLICY = [
+    (10000, 0, 3 * 86400),
+    (1000, 0, 7 * 86400),
+    (0, 180 * 86400, 60 * 86400),
+    (0, 0, 30 * 86400),
+]
+
+# 计算内容哈希时忽略的字段
+VOLATILE_FIELDS = {'crawl_time'}
+
+
+def content_hash(item):
+    """图书内容哈希（忽略抓取时间），用于判断内容是否变化"""
+    data = {k: v for k, v in item.items() if k not in VOLATILE_FIELDS}
+    raw = json.dumps(data, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.md5(raw.encode('utf-8')).hexdigest()[:16]
+
+
+def _pack(crawled_at, rating_people, changed_at):
+    """本地条目打包为一个整数：抓取时间、评分人数、内容变化时间各占 32 位"""
+    return crawled_at | min(rating_people, 0xFFFFFFFF) << 32 | changed_at << 64
+
+
+def _unpack(value):
+    return value & 0xFFFFFFFF, value >> 32 & 0xFFFFFFFF, value >> 64
+
+
+def _normalize_policy(policy):
+    """兼容 (评分人数下限, 重访间隔) 的两项写法，按条件从严到宽排序"""
+    rules = [(p[0], 0, p[1]) if len(p) == 2 else tuple(p) for p in policy]
+    return sorted(rules, key=lambda p: (p[0], p[1]), reverse=True)
+
+
+class FreshnessIndex:
+    """按 book_id 记录最近抓取时间和内容哈希，判断详情页是否需要重新抓取"""
+
+    def __init__(self, server, key='book:freshness', policy=None, stats=None):
+        self.server = server
+        self.key = key
+        self.policy = _normalize_policy(policy or DEFAULT_REVISIT_POLICY)
+        self.stats = stats
+        self.logger = logging.getLogger('freshness')
+        self.entries = {}  # int(book_id) -> _pack(抓取时间戳, 评分人数, 内容变化时间戳)
+        self.loaded = False
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('FRESHNESS_ENABLED', True):
+            return None
+        index = cls(
+            get_redis_from_settings(settings),
+            key=settings.get('FRESHNESS_KEY', 'book:freshness'),
+            policy=[tuple(p) for p in settings.getlist('FRESHNESS_REVISIT_POLICY')] or None,
+            stats=crawler.stats,
+        )
+        crawler.signals.connect(index.spider_opened, signal=signals.spider_opened)
+        return index
+
+    def spider_opened(self, spider):
+        # 在线程中加载，不阻塞 reactor；引擎等加载完成后才开始调度
+        return threads.deferToThread(self.load)
+
+    @staticmethod
+    def _decode(value):
+        """解析 Redis 中的记录，返回打包的本地条目"""
+        if isinstance(value, bytes):
+            value = value.decode('utf-8')
+        parts = value.split(',')
+        crawled_at = int(parts[0])
+        # 旧格式没有内容变化时间，按最近一次抓取时变化处理
+        changed_at = int(parts[3]) if len(parts) > 3 else crawled_at
+        return _pack(crawled_at, int(parts[1]), changed_at)
+
+    @staticmethod
+    def _key(book_id):
+        if isinstance(book_id, bytes):
+            book_id = book_id.decode('utf-8')
+        book_id = str(book_id)
+        return int(book_id) if book_id.isdigit() else book_id
+
+    def __contains__(self, book_id):
+        return self._key(book_id) in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def load(self):
+        """把整个索引读入本地，每本书只保留打包后的时间戳和评分人数"""
+        if self.loaded:
+            return
+        self.loaded = True
+        entries = {}
+        try:
+            for book_id, value in self.server.hscan_iter(self.key, count=5000):
+                try:
+                    entries[self._key(book_id)] = self._decode(value)
+                except (ValueError, IndexError):
+                    continue
+        except Exception as e:
+            self.logger.error(f"加载新鲜度索引失败: {str(e)}")
+        # 加载期间 record 写入的条目更新
+        entries.update(self.entries)
+        self.entries = entries
+        self.logger.info(f"新鲜度索引加载完成，共 {len(self.entries)} 本图书")
+
+    def max_age(self, rating_people, unchanged_for=0):
+        """按评分人数和内容未变化的时长取重访间隔"""
+        for min_rating, min_unchanged, age in self.policy:
+            if rating_people >= min_rating and unchanged_for >= min_unchanged:
+                return age
+        return self.policy[-1][2]
+
+    def _is_fresh(self, entry, now):
+        if entry is None:
+            return False
+        crawled_at, rating_people, changed_at = _unpack(entry)
+        return now - crawled_at < self.max_age(rating_people, crawled_at - changed_at)
+
+    def stale(self, book_ids):
+        """返回需要重新抓取的 book_id 集合
+
+        未加载（没有收到 spider_opened）时不在这里全量加载，只查询本批图书
+        """
+        now = time.time()
+        candidates = [b for b in book_ids if not self._is_fresh(self.entries.get(self._key(b)), now)]
+        if candidates:
+            # 本地过期的再查一次 Redis，其他节点启动后写入的结果也能命中
+            try:
+                values = self.server.hmget(self.key, candidates)
+            except Exception as e:
+                self.logger.warning(f"查询新鲜度索引失败: {str(e)}")
+                values = [None] * len(candidates)
+            for book_id, value in zip(candidates, values):
+                if value is not None:
+                    try:
+                        self.entries[self._key(book_id)] = self._decode(value)
+                    except (ValueError, IndexError):
+                        continue
+        result = {b for b in candidates if not self._is_fresh(self.entries.get(self._key(b)), now)}
+        if self.stats is not None:
+            self.stats.inc_value('freshness/skipped', len(book_ids) - len(result))
+        return result
+
+    def record(self, items):
+        """写入 MongoDB 成功后记录本批图书的抓取时间和内容哈希
+
+        与索引中已有的内容哈希比较，内容没有变化时保留原来的变化时间
+        """
+        now = int(time.time())
+        books = {}
+        for item in items:
+            book_id = item.get('book_id')
+            # 出错或请求失败的记录不算抓取成功
+            if not book_id or item.get('error_info'):
+                continue
+            books[str(book_id)] = (int(item.get('rating_people') or 0), content_hash(item))
+        if not books:
+            return
+        try:
+            previous = self.server.hmget(self.key, list(books))
+        except Exception as e:
+            self.logger.warning(f"查询新鲜度索引失败: {str(e)}")
+            previous = [None] * len(books)
+
+        mapping = {}
+        for (book_id, (rating_people, digest)), old in zip(books.items(), previous):
+            changed_at = now
+            if old is not None:
+                parts = (old.decode('utf-8') if isinstance(old, bytes) else old).split(',')
+                if len(parts) > 2 and parts[2] == digest:
+                    changed_at = int(parts[3]) if len(parts) > 3 else int(parts[0])
+            mapping[book_id] = f'{now},{rating_people},{digest},{changed_at}'
+            self.entries[self._key(book_id)] = _pack(now, rating_people, changed_at)
+        try:
+            self.server.hset(self.key, mapping=mapping)
+        except Exception as e:
+            self.logger.warning(f"更新新鲜度索引失败: {str(e)}")
@@ -9,6 +9,7 @@ import sys
 from fake_useragent import UserAgent
 import time
 import os
+import queue
 import string  
 import logging 
 from DrissionPage import ChromiumPage
@@ -18,126 +19,593 @@ from douban.config import DOUBAN_COOKIES_POOL, NODE_CONFIGS  # 修改这行，
 from selenium import webdriver
 from scrapy.http import HtmlResponse
 from scrapy.utils.project import get_project_settings
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.threadpool import ThreadPool
+from douban.browser import BrowserManager, identity_cookies
+from douban.throttle import (AIMDController, GlobalRateLimiter, SlotDelayScheduler, challenge_reason,
+                             cookie_identity, request_slot)
+from douban.urls import PAGE_TAG_LIST, page_type, tag_list_start
+from douban.parse_tier import _exported, encode_page, export_meta
+from douban.archive import ArchiveWriter, PageArchive
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy_redis.connection import get_redis_from_settings
+
+
+def retry_later(request, spider, reason):
+    """本次无法抓取的请求写入爬虫的延迟重试队列，并以 IgnoreRequest 结束本次下载
+
+    不能交给下一个下载器：普通 HTTP 会绕过并发上限，需要浏览器的请求会再次碰到挑战。
+    """
+    retry_queue = getattr(spider, 'retry_queue', None)
+    if retry_queue is None:
+        spider.logger.warning(f"未启用重试队列，放弃请求({reason}): {request.url}")
+    else:
+        try:
+            retry_queue.schedule(request, reason, spider=spider)
+        except Exception as e:
+            spider.logger.error(f"写入重试队列失败: {request.url}, 错误: {str(e)}")
+    raise IgnoreRequest(f'{reason}: {request.url}')
 
 
 class RandomDelayMiddleware:
-    def __init__(self, delay_min=1, delay_max=3):
+    """按槽位随机延迟中间件
+
+    同一域名 + 代理 + Cookie身份 的请求之间保持随机间隔，
+    等待通过 reactor 定时器完成，不会阻塞其他请求。
+    启用 AIMD_ENABLED 时改为按代理、会话分别保持 AIMDController 调节的间隔，
+    请求需同时满足两者，在其上下浮动一半作为随机抖动。
+    """
+
+    def __init__(self, delay_min=1, delay_max=3, stats=None, controller=None):
         self.delay_min = delay_min
         self.delay_max = delay_max
+        self.controller = controller
+        self.scheduler = SlotDelayScheduler(stats=stats)
 
     @classmethod
     def from_crawler(cls, crawler):
         delay_min = crawler.settings.getfloat('RANDOM_DELAY_MIN', 1)
         delay_max = crawler.settings.getfloat('RANDOM_DELAY_MAX', 3)
-        return cls(delay_min, delay_max)
+        controller = AIMDController.from_crawler(crawler) if crawler.settings.getbool('AIMD_ENABLED') else None
+        return cls(delay_min, delay_max, stats=crawler.stats, controller=controller)
 
     def process_request(self, request, spider):
+        slot = request_slot(request)
         # 生成随机延迟
-        delay = random.uniform(self.delay_min, self.delay_max)
-        spider.logger.debug(f'随机延迟: {delay}秒')
-        time.sleep(delay)
+        if self.controller is not None:
+            jitter = random.uniform(0.5, 1.5)
+            delays = [(key, self.controller.key_delay(key) * jitter) for key in self.controller.slot_keys(slot)]
+        else:
+            delays = [(slot, random.uniform(self.delay_min, self.delay_max))]
+        spider.logger.debug(f'随机延迟: {delays}, 槽位: {slot}')
+        return self.scheduler.wait_all(delays)
+
+class BlockRateMiddleware:
+    """统计反爬挑战并反馈给 AIMD 控制器，并限制普通 HTTP 请求的代理、会话并发
+
+    放在 DrissionPageMiddleware 之内（数字更大）、HttpCompressionMiddleware 之外：
+    看到的是解压后的响应，并且在浏览器升级之前，普通 HTTP 与浏览器抓取的响应都会经过这里。
+    只有普通 HTTP 请求会走到这里的 process_request，在这里占用代理和会话的并发名额，
+    响应或异常返回时释放；等待超时的请求写入延迟重试队列。
+    """
+
+    PERMIT_META_KEY = '_aimd_permit'
+
+    def __init__(self, crawler, controller, export_every=100, clock=None):
+        self.crawler = crawler
+        self.controller = controller
+        self.export_every = export_every
+        self.responses = 0
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.clock = clock
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('AIMD_ENABLED'):
+            raise NotConfigured
+        middleware = cls(crawler, AIMDController.from_crawler(crawler))
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def process_request(self, request, spider):
+        slot = request_slot(request)
+        request.meta['download_slot'] = self.controller.downloader_slot(slot)
+        keys = self.controller.slot_keys(slot)
+        d = self.controller.limiter.acquire_later(keys, self.controller.key_concurrency,
+                                                  self.controller.concurrency_timeout, self.clock)
+        d.addCallback(self._permit_acquired, request, spider, keys)
+        return d
+
+    def _permit_acquired(self, acquired, request, spider, keys):
+        if not acquired:
+            self._inc_stat('aimd/concurrency_timeout')
+            spider.logger.warning(f"等待代理/会话并发名额超时: {request.url}")
+            retry_later(request, spider, 'concurrency_timeout')
+        request.meta[self.PERMIT_META_KEY] = keys
+        return None
+
+    def _release(self, request):
+        keys = request.meta.pop(self.PERMIT_META_KEY, None)
+        if keys is not None:
+            self.controller.limiter.release(keys)
+
+    def process_response(self, request, response, spider):
+        self._release(request)
+        reason = challenge_reason(response)
+        slot = request_slot(request)
+        self.controller.record(slot, reason)
+
+        # 普通 HTTP 请求的并发数作用于其下载器槽位；浏览器请求由 DrissionPageMiddleware 限制
+        slot_key = request.meta.get('download_slot')
+        downloader = getattr(self.crawler.engine, 'downloader', None)
+        download_slot = downloader.slots.get(slot_key) if downloader is not None and slot_key else None
+        if download_slot is not None:
+            download_slot.concurrency = self.controller.concurrency_for(slot)
+
+        self.responses += 1
+        if self.responses % self.export_every == 0:
+            self.controller.export_stats()
+        return response
+
+    def process_exception(self, request, exception, spider):
+        self._release(request)
+        return None
+
+    def _inc_stat(self, key, value=1):
+        if self.crawler.stats is not None:
+            self.crawler.stats.inc_value(key, value)
+
+    def spider_closed(self, spider):
+        self.controller.export_stats()
+
+class GlobalRateLimitMiddleware:
+    """跨节点全局限速中间件
+
+    在本地随机延迟之后、真正发出请求之前，从 Redis 共享令牌桶领取令牌，
+    所有工作节点合计不超过 GLOBAL_RATE_LIMIT 的请求速率。
+    """
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        rate = settings.getfloat('GLOBAL_RATE_LIMIT', 1.0)
+        # 速率不大于 0 视为不限速
+        if not settings.getbool('GLOBAL_RATE_LIMIT_ENABLED') or rate <= 0:
+            raise NotConfigured
+        limiter = GlobalRateLimiter(
+            get_redis_from_settings(settings),
+            rate=rate,
+            burst=settings.getint('GLOBAL_RATE_LIMIT_BURST', 1),
+            scope=settings.getlist('GLOBAL_RATE_LIMIT_SCOPE', ['domain']),
+            key_prefix=settings.get('GLOBAL_RATE_LIMIT_KEY', 'throttle'),
+            max_wait=settings.getfloat('GLOBAL_RATE_LIMIT_MAX_WAIT', 30),
+            stats=crawler.stats,
+        )
+        return cls(limiter)
+
+    def process_request(self, request, spider):
+        return self.limiter.acquire(request_slot(request))
 
 class DrissionPageMiddleware:
-    def __init__(self):
-        self.browser = None
+    """分级抓取中间件
+
+    请求默认先走 Scrapy 的普通 HTTP 下载器；只有响应看起来是反爬挑战
+    （403、跳转登录/验证页、内容过小或命中 check_anti_spider）时，
+    才升级到浏览器重新抓取。升级决定按 (页面类型, 代理, Cookie身份) 记忆一段时间，
+    期间同类请求直接走浏览器。meta['use_drissionpage'] 为 True 的请求始终走浏览器。
+    浏览器请求不经过 Scrapy 下载器槽位，启用 AIMD 时在取标签页前占用代理和会话的并发名额。
+    走浏览器的请求抓取失败（等待名额或标签页超时、浏览器不可用、跳转登录页等）时
+    写入延迟重试队列，不回落到普通 HTTP 下载器。
+    """
+
+    def __init__(self, settings=None, stats=None, controller=None):
+        self.stats = stats
+        self.controller = controller
         self.logger = logging.getLogger('DrissionPage')
-        self.settings = get_project_settings()
+        self.settings = settings or get_project_settings()
         self.node_name = os.environ.get('SPIDER_NODE', 'master')
-        self.init_browser()
+
+        dp_settings = self.settings.getdict('DRISSIONPAGE_SETTINGS')
+        self.tab_pool_size = int(dp_settings.get('tab_pool_size', 1))
+        self.acquire_timeout = dp_settings.get('tab_acquire_timeout', 60)
+        self.tiered_fetch = dp_settings.get('tiered_fetch', True)
+        self.escalation_ttl = dp_settings.get('escalation_ttl', 1800)
+        self.escalated = {}  # (页面类型, 代理, 身份) -> 过期时间
+
+        # 资源屏蔽与就绪等待，按页面类型配置
+        self.load_mode = dp_settings.get('load_mode', 'eager')
+        self.blocked_urls = dp_settings.get('blocked_urls', [])
+        self.page_types = dp_settings.get('page_types', {})
+        self.ready_timeout = dp_settings.get('ready_timeout', 15)
+
+        # 页面加载在独立线程池中执行，不占用 reactor 线程，也不挤占 DNS 解析等默认线程池
+        self.threadpool = ThreadPool(minthreads=1, maxthreads=self.tab_pool_size,
+                                     name='DrissionPage')
+        self.threadpool.start()
+
+        # 浏览器生命周期管理：按页数/内存回收、预热备用浏览器、崩溃自动替换
+        self.browser_manager = BrowserManager(
+            self.init_browser,
+            pool_size=self.tab_pool_size,
+            setup_tab=self._setup_tab,
+            identities=self._node_identities(),
+            max_pages=dp_settings.get('max_pages_per_browser', 500),
+            max_rss_mb=dp_settings.get('max_browser_rss_mb', 600),
+            rss_check_interval=dp_settings.get('rss_check_interval', 20),
+            prewarm_spare=dp_settings.get('prewarm_spare', True),
+            stats=stats,
+        )
+        self.browser_manager.start()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        controller = AIMDController.from_crawler(crawler) if crawler.settings.getbool('AIMD_ENABLED') else None
+        middleware = cls(crawler.settings, stats=crawler.stats, controller=controller)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
 
     def init_browser(self):
-        """初始化浏览器"""
+        """启动并初始化一个浏览器，失败时抛出异常由 BrowserManager 处理"""
+        options = ChromiumOptions()
+        options.set_paths(browser_path=None)
+        # 每个浏览器使用独立端口和用户目录，便于同时保留备用浏览器
+        options.auto_port()
+        
+        options.set_argument('--headless=new')
+        options.set_argument('--no-sandbox')
+        options.set_argument('--disable-gpu')
+        options.set_argument('--disable-dev-shm-usage')
+        options.set_argument('--disable-extensions')
+        
+        browser = ChromiumPage(options)
+        version = browser.run_cdp('Browser.getVersion')
+        self.logger.info(f"浏览器版本信息: {version}")
+        
+        # 启用网络功能并清除默认上下文的 Cookie，各身份的 Cookie 写入各自独立的浏览器上下文
+        browser.run_cdp('Network.enable')
+        browser.run_cdp('Network.clearBrowserCookies')
+        
+        self.logger.info(f"节点[{self.node_name}]浏览器初始化成功")
+        return browser
+
+    def _setup_tab(self, tab):
+        """标签页初始设置：启用网络域以便屏蔽资源，设置页面加载策略"""
+        tab.run_cdp('Network.enable')
+        tab.set.load_mode(self.load_mode)
+
+    def _page_config(self, url):
+        """获取页面类型对应的屏蔽规则、就绪选择器和超时"""
+        config = self.page_types.get(page_type(url), {})
+        return (
+            config.get('blocked_urls', self.blocked_urls),
+            config.get('ready_selector'),
+            config.get('timeout', self.ready_timeout),
+        )
+
+    def _block_resources(self, instance, tab, blocked_urls):
+        """通过 CDP 屏蔽图片、样式、字体和统计脚本，规则未变化时不重复下发"""
+        blocked_urls = tuple(blocked_urls)
+        if instance.blocked_urls.get(tab.tab_id) == blocked_urls:
+            return
+        tab.run_cdp('Network.setBlockedURLs', urls=list(blocked_urls))
+        instance.blocked_urls[tab.tab_id] = blocked_urls
+
+    def _node_identities(self):
+        """当前节点负责的 Cookie 身份列表：[(身份名, CDP Cookie 列表)]"""
+        node_config = NODE_CONFIGS.get(self.node_name, {'cookie_start_index': 0, 'cookie_end_index': 0})
+        start_idx = node_config['cookie_start_index']
+        end_idx = node_config['cookie_end_index']
+
+        identities = []
+        for idx, entry in enumerate(DOUBAN_COOKIES_POOL[start_idx:end_idx + 1], start=start_idx):
+            cookies = identity_cookies(entry)
+            if cookies:
+                # 与 request_slot 使用同一套身份名，请求才能取到对应上下文的标签页
+                identities.append((cookie_identity(entry) or f'identity{idx}', cookies))
+        return identities
+
+    def process_request(self, request, spider):
+        """处理请求
+
+        页面加载放到线程池中执行，返回 Deferred，reactor 在等待期间可以继续
+        处理其他请求、Redis 调度和 MongoDB 写入。
+        """
+        if not self._use_browser(request):
+            self._inc_stat('tiered/http')
+            return None
+        self._inc_stat('tiered/browser')
+        from twisted.internet import reactor
+        return deferToThreadPool(reactor, self.threadpool, self._fetch, request, spider)
+
+    def process_response(self, request, response, spider):
+        """普通 HTTP 响应命中反爬时升级到浏览器重新抓取"""
+        if 'drissionpage' in response.flags or not self.tiered_fetch:
+            return response
+        if request.meta.get('use_drissionpage') or not self._is_challenge(response, spider):
+            return response
+
+        key = self._escalation_key(request)
+        self.escalated[key] = time.time() + self.escalation_ttl
+        self._inc_stat('tiered/escalated')
+        spider.logger.info(f"普通请求疑似被反爬，升级为浏览器抓取: {request.url}, 状态: {response.status}")
+        escalated = request.replace(dont_filter=True)
+        escalated.meta['use_drissionpage'] = True
+        return escalated
+
+    def _use_browser(self, request):
+        """判断请求是否需要浏览器抓取"""
+        if not self.tiered_fetch or request.meta.get('use_drissionpage'):
+            return True
+        key = self._escalation_key(request)
+        expire_at = self.escalated.get(key)
+        if expire_at is None:
+            return False
+        if expire_at < time.time():
+            # 记忆过期，重新尝试普通 HTTP
+            del self.escalated[key]
+            return False
+        return True
+
+    def _escalation_key(self, request):
+        _, proxy, identity = request_slot(request)
+        return page_type(request.url), proxy, identity
+
+    def _is_challenge(self, response, spider):
+        """判断普通 HTTP 响应是否为反爬挑战"""
+        if response.status == 403:
+            return True
+        if response.status in (301, 302):
+            location = response.headers.get('Location', b'').decode('utf-8', errors='ignore')
+            if 'login' in location or 'sec.douban.com' in location:
+                return True
+        if response.status == 200 and len(response.body) < 1000:
+            return True
+        check_anti_spider = getattr(spider, 'check_anti_spider', None)
+        if response.status == 200 and check_anti_spider and check_anti_spider(response):
+            return True
+        return False
+
+    def _inc_stat(self, key, value=1):
+        if self.stats is not None:
+            self.stats.inc_value(key, value)
+
+    def _fetch(self, request, spider):
+        """在工作线程中等待代理和会话的并发名额，再取标签页抓取页面"""
+        if self.controller is None:
+            return self._fetch_page(request, spider)
+        keys = self.controller.slot_keys(request_slot(request))
+        limiter = self.controller.limiter
+        if not limiter.acquire(keys, self.controller.key_concurrency, timeout=self.controller.concurrency_timeout):
+            self._inc_stat('browser/concurrency_timeout')
+            spider.logger.warning(f"等待代理/会话并发名额超时: {request.url}")
+            retry_later(request, spider, 'concurrency_timeout')
         try:
-            options = ChromiumOptions()
-            options.set_paths(browser_path=None)
-            
-            options.set_argument('--headless=new')
-            options.set_argument('--no-sandbox')
-            options.set_argument('--disable-gpu')
-            options.set_argument('--disable-dev-shm-usage')
-            options.set_argument('--disable-extensions')
-            
-            self.browser = ChromiumPage(options)
-            version = self.browser.run_cdp('Browser.getVersion')
-            self.logger.info(f"浏览器版本信息: {version}")
-            
-            # 启用网络功能并清除所有 Cookie
-            self.browser.run_cdp('Network.enable')
-            self.browser.run_cdp('Network.clearBrowserCookies')
-            
-            self._add_cookies()
-            self.logger.info(f"节点[{self.node_name}]浏览器初始化成功")
-        except Exception as e:
-            self.logger.error(f"浏览器初始化失败: {str(e)}")
-            self.logger.exception(e)
+            return self._fetch_page(request, spider)
+        finally:
+            limiter.release(keys)
+
+    def _browser_failed(self, request, spider, reason):
+        self._inc_stat(f'browser/failed/{reason}')
+        retry_later(request, spider, reason)
 
-    def _add_cookies(self):
-        """添加 Cookie"""
+    def _fetch_page(self, request, spider):
+        """使用该请求身份的一个标签页抓取页面"""
+        _, _, identity = request_slot(request)
+        cookies = request.cookies if isinstance(request.cookies, dict) else None
         try:
-            # 获取当前节点的 Cookie
-            node_config = NODE_CONFIGS.get(self.node_name, {'cookie_start_index': 0, 'cookie_end_index': 0})
-            start_idx = node_config['cookie_start_index']
-            end_idx = node_config['cookie_end_index']
-            cookies = DOUBAN_COOKIES_POOL[start_idx:end_idx + 1]
-            
-            for cookie_dict in cookies:
-                # 将配置中的 Cookie 转换为浏览器可用的格式
-                for name, value in cookie_dict.items():
-                    js_code = f'''
-                    document.cookie = "{name}={value}; \
-                    domain=.douban.com; \
-                    path=/";
-                    '''
-                    self.browser.run_js(js_code)
-            
-            # 验证 Cookie 设置
-            cookies_result = self.browser.run_cdp('Network.getAllCookies')
-            current_cookies = cookies_result.get('cookies', [])
-            self.logger.info(f"Cookie设置完成，当前数量: {len(current_cookies)}")
-            
+            instance, tab = self.browser_manager.acquire(timeout=self.acquire_timeout,
+                                                         identity=identity, cookies=cookies)
+        except queue.Empty:
+            spider.logger.error(f"等待空闲标签页超时: {request.url}")
+            self._browser_failed(request, spider, 'tab_timeout')
         except Exception as e:
-            self.logger.error(f"设置Cookie失败: {str(e)}")
-            self.logger.exception(e)
+            # 下次请求会再次尝试启动浏览器
+            spider.logger.error(f"获取浏览器失败: {str(e)}")
+            self._browser_failed(request, spider, 'browser_unavailable')
 
-    def process_request(self, request, spider):
-        """处理请求"""
+        failed = False
+        reason = None
         try:
-            # 随机延迟
-            delay = random.uniform(3, 8)
-            time.sleep(delay)
-            
-            # 访问页面
-            self.browser.get(request.url)
-            time.sleep(2)
+            blocked_urls, ready_selector, ready_timeout = self._page_config(request.url)
+            self._block_resources(instance, tab, blocked_urls)
+
+            # 访问页面（请求间隔由 RandomDelayMiddleware 在进入本中间件前完成）
+            tab.get(request.url, timeout=ready_timeout)
+
+            # 等待回调需要的元素出现即返回，而不是固定等待
+            if ready_selector and not tab.wait.eles_loaded(f'css:{ready_selector}', timeout=ready_timeout):
+                self._inc_stat('browser/ready_timeout')
+                spider.logger.debug(f"等待 {ready_selector} 超时({ready_timeout}秒): {request.url}")
             
             # 检查重定向
-            current_url = self.browser.url
+            current_url = tab.url
             if 'login' in current_url or 'sec.douban.com' in current_url:
                 spider.logger.warning(f"被重定向到登录页: {current_url}")
-                self._add_cookies()  # 重新设置 Cookie
-                return None
-            
-            # 获取页面内容
-            html = self.browser.html
-            if not html:
+                # 只重新写入该标签页所属身份上下文的 Cookie
+                identity = instance.tab_pool.identity_of(tab)
+                if identity is not None:
+                    instance.set_cookies(identity)
+                reason = 'login_redirect'
+            else:
+                # 获取页面内容
+                html = tab.html
+                if html:
+                    return HtmlResponse(
+                        url=request.url,
+                        body=html.encode(),
+                        encoding='utf-8',
+                        request=request,
+                        flags=['drissionpage'],
+                    )
                 spider.logger.error("获取页面内容失败")
-                return None
-                
-            return HtmlResponse(
-                url=request.url,
-                body=html.encode(),
-                encoding='utf-8',
-                request=request
-            )
+                reason = 'empty_page'
         except Exception as e:
+            failed = True
             spider.logger.error(f'DrissionPage处理失败: {str(e)}')
-            return None
+            reason = 'browser_error'
+        finally:
+            self.browser_manager.release(instance, tab, failed=failed)
+        self._browser_failed(request, spider, reason)
 
     def spider_closed(self, spider):
         """关闭浏览器"""
-        if self.browser:
-            self.browser.quit()
-            self.logger.info("浏览器已关闭")
+        self.browser_manager.close()
+        self.logger.info("浏览器已关闭")
+        self.threadpool.stop()
+
+class LeaseAckMiddleware:
+    """请求处理完毕后释放调度器中的租约
+
+    放在最外层：下载完成、下载失败以及被内层中间件丢弃（IgnoreRequest）的请求
+    都会经过这里，确认后调度器不再为其续约，也不会被主控节点重新放回队列。
+    """
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if crawler.settings.getint('SCHEDULER_LEASE_TTL', 0) <= 0:
+            raise NotConfigured
+        return cls(crawler)
+
+    def _ack(self, request):
+        slot = getattr(self.crawler.engine, 'slot', None)
+        ack = getattr(getattr(slot, 'scheduler', None), 'ack', None)
+        if ack is not None:
+            ack(request)
+
+    def process_response(self, request, response, spider):
+        self._ack(request)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        self._ack(request)
+        return None
+
+class SessionRebuildMiddleware:
+    """为紧凑序列化后出队的请求重建请求头和 Cookie
+
+    douban.serializers 不把请求头和 Cookie 写入调度队列，出队的请求带有
+    meta['rebuild_session']，在这里调用爬虫的 rebuild_session 重新生成。
+    """
+
+    def process_request(self, request, spider):
+        if request.meta.pop('rebuild_session', False) and hasattr(spider, 'rebuild_session'):
+            spider.rebuild_session(request)
+        return None
+
+class TagPaginationMiddleware:
+    """丢弃已翻到底的标签的后续列表页
+
+    标签第一页会一次性生成全部翻页请求；某一页返回空列表后，爬虫记录该标签
+    已翻到底，同一标签 start 更大的页在下载前直接丢弃。
+    """
+
+    def __init__(self, stats=None):
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(stats=crawler.stats)
+
+    def process_request(self, request, spider):
+        start = tag_list_start(request.url)
+        if start <= 0 or page_type(request.url) != PAGE_TAG_LIST:
+            return None
+        exhausted_at = getattr(spider, 'tag_exhausted_at', None)
+        if exhausted_at is None:
+            return None
+        empty_start = exhausted_at(request.url)
+        if empty_start is not None and start > empty_start:
+            if self.stats is not None:
+                self.stats.inc_value('pagination/skipped')
+            spider.logger.debug(f"标签已翻到底，跳过: {request.url}")
+            raise IgnoreRequest(f"标签已翻到底: {request.url}")
+        return None
+
+class PageArchiveMiddleware:
+    """原始页面归档中间件
+
+    把成功抓取的页面交给后台线程压缩追加到本地归档，供 `scrapy reparse` 重放。
+    只在 ARCHIVE_ENABLED 开启时启用。
+    """
+
+    def __init__(self, writer, callbacks):
+        self.writer = writer
+        self.callbacks = set(callbacks)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('ARCHIVE_ENABLED'):
+            raise NotConfigured
+        node_id = os.environ.get('NODE_ID', 'master')
+        archive = PageArchive(
+            os.path.join(settings.get('ARCHIVE_DIR'), node_id),
+            segment_max_bytes=settings.getint('ARCHIVE_SEGMENT_MB', 256) * 1024 * 1024,
+            codec=settings.get('ARCHIVE_CODEC', 'zlib'),
+        )
+        writer = ArchiveWriter(archive, queue_size=settings.getint('ARCHIVE_QUEUE_SIZE', 1000),
+                               stats=crawler.stats)
+        middleware = cls(writer, settings.getlist('ARCHIVE_CALLBACKS'))
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def process_response(self, request, response, spider):
+        callback = getattr(request.callback, '__name__', None)
+        if callback in self.callbacks and response.status == 200 and len(response.body) >= 1000:
+            self.writer.put(response.url, response.body, response.status, callback,
+                            export_meta(response.meta))
+        return response
+
+    def spider_closed(self, spider):
+        self.writer.close()
+
+class RawPageExportMiddleware:
+    """原始页面导出中间件（解析层分离模式）
+
+    抓取成功的页面压缩后连同请求元数据写入 Redis Stream，由解析节点
+    （parse_node.py）在多进程池中解析；本地的回调换成空操作，工作节点只负责抓取。
+    只在 PARSE_TIER_ENABLED 开启时启用。
+    """
+
+    def __init__(self, settings, stats=None):
+        self.stats = stats
+        self.server = get_redis_from_settings(settings)
+        self.stream = settings.get('PARSE_TIER_STREAM', 'book:raw_pages')
+        self.callbacks = set(settings.getlist('PARSE_TIER_CALLBACKS'))
+        self.maxlen = settings.getint('PARSE_TIER_MAXLEN', 0) or None
+        self.logger = logging.getLogger('parse_tier')
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('PARSE_TIER_ENABLED'):
+            raise NotConfigured
+        return cls(crawler.settings, stats=crawler.stats)
+
+    def process_response(self, request, response, spider):
+        callback = getattr(request.callback, '__name__', None)
+        # 反爬页面、重定向等仍交给本地回调处理
+        if callback not in self.callbacks or response.status != 200 or len(response.body) < 1000:
+            return response
+
+        try:
+            fields = encode_page(response, callback)
+            self.server.xadd(self.stream, fields, maxlen=self.maxlen, approximate=True)
+        except Exception as e:
+            # 导出失败时退回本地解析
+            self.logger.error(f'页面导出失败: {request.url}, {str(e)}')
+            return response
+
+        if self.stats is not None:
+            self.stats.inc_value('parse_tier/exported')
+            self.stats.inc_value('parse_tier/exported_bytes', len(fields['body']))
+        return response.replace(request=request.replace(callback=_exported, errback=None))
 
 class DistributedProxyMiddleware:
     def __init__(self):
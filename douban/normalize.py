@@ -0,0 +1,172 @@
+# 字段类型规范化
+#
+# 详情页解析出的评分、页数、定价、出版年都是原始文本（"8.9"、"320页"、"59.00元"、"2019-5"），
+# 按字符串排序和范围查询既不正确也用不上索引。这里在写入前把它们转换为：
+#
+#     rating_score  -> float
+#     pages         -> int
+#     price         -> {'amount': 59.0, 'currency': 'CNY'}
+#     publish_date  -> datetime（只有年或年月时取该年/月第一天）
+#     crawl_time    -> datetime（last_seen 同）
+#
+# 原始文本保存在 raw 子文档中（抓取时间是本程序生成的，不保存原文）。
+# 无法解析的值保存为 None，原文仍在 raw 中。已经转换过的值原样保留，可以重复执行。
+
+import re
+from datetime import MAXYEAR, MINYEAR, datetime
+
+import pymongo
+
+CRAWL_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# 需要规范化、并在 raw 中保存原文的字段
+RAW_FIELDS = ('rating_score', 'pages', 'price', 'publish_date')
+
+# 货币符号/写法 -> ISO 4217 代码，按长度从长到短匹配
+CURRENCY_ALIASES = [
+    ('NT$', 'TWD'), ('HK$', 'HKD'), ('US$', 'USD'), ('CAD', 'CAD'), ('AUD', 'AUD'),
+    ('CNY', 'CNY'), ('RMB', 'CNY'), ('USD', 'USD'), ('TWD', 'TWD'), ('NTD', 'TWD'),
+    ('HKD', 'HKD'), ('MOP', 'MOP'), ('JPY', 'JPY'), ('GBP', 'GBP'), ('EUR', 'EUR'),
+    ('新台币', 'TWD'), ('台币', 'TWD'), ('港币', 'HKD'), ('港元', 'HKD'), ('澳门币', 'MOP'), ('澳门元', 'MOP'),
+    ('澳元', 'AUD'), ('美元', 'USD'), ('日元', 'JPY'), ('円', 'JPY'), ('英镑', 'GBP'), ('欧元', 'EUR'),
+    ('人民币', 'CNY'), ('元', 'CNY'),
+    ('$', 'USD'), ('¥', 'CNY'), ('￥', 'CNY'), ('£', 'GBP'), ('€', 'EUR'),
+]
+
+NUMBER_PATTERN = re.compile(r'\d+(?:[.,]\d+)*')
+DATE_PATTERN = re.compile(r'(\d{4})\s*(?:[-/.年]\s*(\d{1,2})\s*(?:[-/.月]\s*(\d{1,2}))?)?')
+
+# 与查询方式对应的索引
+INDEXES = [
+    # 按评分排序，评分相同时评价人数多的在前；也可按评分范围过滤
+    ([('rating_score', pymongo.DESCENDING), ('rating_people', pymongo.DESCENDING)], {}),
+    # 最近抓取
+    ([('crawl_time', pymongo.DESCENDING)], {}),
+    # 某个标签下按评分排序
+    ([('js_tags', pymongo.ASCENDING), ('rating_score', pymongo.DESCENDING)], {}),
+    # 出版时间范围查询，再按评分排序
+    ([('publish_date', pymongo.DESCENDING), ('rating_score', pymongo.DESCENDING)], {}),
+]
+
+
+def _number(text):
+    match = NUMBER_PATTERN.search(text)
+    if not match:
+        return None
+    value = match.group()
+    # "1,280.00" 中的逗号是千位分隔符，"12,50" 和 "1.234,00" 中的逗号是小数点
+    if ',' in value and '.' in value:
+        if value.rfind(',') > value.rfind('.'):
+            value = value.replace('.', '').replace(',', '.')
+    elif ',' in value:
+        if value.count(',') == 1 and len(value.rsplit(',', 1)[1]) != 3:
+            value = value.replace(',', '.')
+    elif value.count('.') > 1:
+        # "1.234.567" 中的点都是千位分隔符
+        value = value.replace('.', '')
+    return float(value.replace(',', ''))
+
+
+def parse_rating(value):
+    """评分文本转为 float，空值或无法解析时返回 None"""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    text = str(value).strip()
+    return _number(text) if text else None
+
+
+def parse_pages(value):
+    """页数文本（"320"、"320页"）转为 int"""
+    if value is None or isinstance(value, int):
+        return value
+    number = _number(str(value))
+    return int(number) if number is not None else None
+
+
+def parse_price(value):
+    """定价文本转为 {'amount': 金额, 'currency': 货币代码}，没有货币标记时按人民币处理"""
+    if value is None or isinstance(value, dict):
+        return value
+    text = str(value).strip()
+    amount = _number(text)
+    if amount is None:
+        return None
+    currency = 'CNY'
+    upper = text.upper()
+    for alias, code in CURRENCY_ALIASES:
+        if alias in upper:
+            currency = code
+            break
+    return {'amount': amount, 'currency': currency}
+
+
+def parse_publish_date(value):
+    """出版年（"2019-5"、"2019年5月"、"2019/05/01"、"2019"）转为 datetime"""
+    if value is None or isinstance(value, datetime):
+        return value
+    match = DATE_PATTERN.search(str(value))
+    if not match:
+        return None
+    year = int(match.group(1))
+    if not MINYEAR <= year <= MAXYEAR:
+        # "0000" 之类的占位年份
+        return None
+    month = int(match.group(2) or 1)
+    day = int(match.group(3) or 1)
+    try:
+        return datetime(year, month, day)
+    except ValueError:
+        # 月或日超出范围，只保留能确定的部分
+        try:
+            return datetime(year, month, 1)
+        except ValueError:
+            return datetime(year, 1, 1)
+
+
+def parse_crawl_time(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    try:
+        return datetime.strptime(str(value), CRAWL_TIME_FORMAT)
+    except ValueError:
+        return None
+
+
+PARSERS = {
+    'rating_score': parse_rating,
+    'pages': parse_pages,
+    'price': parse_price,
+    'publish_date': parse_publish_date,
+    'crawl_time': parse_crawl_time,
+    'last_seen': parse_crawl_time,
+}
+
+
+def normalize_item(item):
+    """就地规范化一条 item（dict），返回该 item"""
+    raw = dict(item.get('raw') or {})
+    for field, parser in PARSERS.items():
+        if field not in item:
+            continue
+        value = item[field]
+        if field in RAW_FIELDS and isinstance(value, str):
+            raw[field] = value
+        if isinstance(value, str) and not value.strip():
+            item[field] = None
+            continue
+        item[field] = parser(value)
+    if raw:
+        item['raw'] = raw
+    return item
+
+
+def normalize_batch(items):
+    for item in items:
+        normalize_item(item)
+    return items
+
+
+def ensure_indexes(collection):
+    """创建与查询方式对应的索引（已存在时不做任何事）"""
+    for keys, options in INDEXES:
+        collection.create_index(keys, background=True, **options)
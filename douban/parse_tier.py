@@ -0,0 +1,254 @@
+# 解析层分离
+#
+# 开启 PARSE_TIER_ENABLED 后，工作节点只负责抓取：RawPageExportMiddleware 把
+# 原始页面压缩后连同请求元数据写入 Redis Stream；独立的解析节点（parse_node.py）
+# 按批消费，在多进程池中运行爬虫原有的回调，把解析出的 item 交给正常的管道，
+# 把新请求放回调度队列。
+
+import json
+import logging
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+from itemadapter import is_item, ItemAdapter
+from scrapy import Request
+from scrapy.crawler import Crawler
+from scrapy.http import HtmlResponse
+from scrapy.utils.request import request_from_dict
+from scrapy.utils.project import get_project_settings
+from scrapy_redis.connection import get_redis_from_settings
+from twisted.internet import defer, threads
+
+logger = logging.getLogger('parse_tier')
+
+# 不随页面传递的请求元数据（下载过程内部使用）
+SKIP_META_KEYS = {
+    'download_slot', 'download_latency', 'download_timeout', 'proxy',
+    'handle_httpstatus_list', 'dont_redirect', 'dont_merge_cookies',
+    'use_drissionpage',
+}
+
+
+def _exported(response):
+    """页面已导出到解析层，本地不再解析"""
+    return []
+
+
+def export_meta(meta):
+    """只保留回调需要、可以 JSON 序列化的请求元数据"""
+    exported = {}
+    for key, value in meta.items():
+        if key in SKIP_META_KEYS or key.startswith('_'):
+            continue
+        try:
+            json.dumps(value)
+        except (TypeError, ValueError):
+            continue
+        exported[key] = value
+    return exported
+
+
+def encode_page(response, callback):
+    """把响应编码为 Stream 消息字段"""
+    meta = export_meta(response.meta)
+    return {
+        'url': response.url,
+        'status': str(response.status),
+        'callback': callback,
+        'priority': str(response.request.priority if response.request else 0),
+        'meta': json.dumps(meta, ensure_ascii=False),
+        'body': zlib.compress(response.body),
+    }
+
+
+def _field(fields, name):
+    value = fields.get(name.encode(), fields.get(name))
+    if isinstance(value, bytes) and name != 'body':
+        value = value.decode('utf-8')
+    return value
+
+
+def decode_page(fields):
+    """把 Stream 消息还原为 (回调名, HtmlResponse)"""
+    url = _field(fields, 'url')
+    request = Request(url, meta=json.loads(_field(fields, 'meta') or '{}'),
+                      priority=int(_field(fields, 'priority') or 0), dont_filter=True)
+    response = HtmlResponse(
+        url=url,
+        status=int(_field(fields, 'status') or 200),
+        body=zlib.decompress(_field(fields, 'body')),
+        encoding='utf-8',
+        request=request,
+    )
+    return _field(fields, 'callback'), response
+
+
+# ---------------------------------------------------------------------------
+# 解析进程
+# ---------------------------------------------------------------------------
+
+_worker_spider = None
+
+
+def init_worker(spider_cls, overrides=None):
+    """解析进程初始化：每个进程构建一个独立的爬虫实例"""
+    global _worker_spider
+    settings = get_project_settings()
+    if overrides:
+        settings.setdict(overrides, priority='cmdline')
+    crawler = Crawler(spider_cls, settings)
+    _worker_spider = spider_cls.from_crawler(crawler)
+
+
+def run_callback(spider, callback_name, response):
+    """运行爬虫回调，返回 [('item', dict) | ('request', dict)]"""
+    callback = getattr(spider, callback_name)
+    # 还原的请求不带回调，补上后回调里写入重试队列的请求才能还原到同一个回调
+    if response.request is not None and response.request.callback is None:
+        response.request.callback = callback
+    outputs = []
+    for result in callback(response) or []:
+        if isinstance(result, Request):
+            outputs.append(('request', result.to_dict(spider=spider)))
+        elif is_item(result):
+            outputs.append(('item', ItemAdapter(result).asdict()))
+    return outputs
+
+
+def parse_page(fields):
+    """在解析进程中解析一条 Stream 消息
+
+    单个页面出错（压缩数据损坏、回调不存在、回调异常）时返回 [('error', 错误信息)]，
+    不影响同批其他页面。
+    """
+    try:
+        callback_name, response = decode_page(fields)
+        return run_callback(_worker_spider, callback_name, response)
+    except Exception as e:
+        return [('error', f'{type(e).__name__}: {e}')]
+
+
+class ParseService:
+    """解析节点：消费原始页面 Stream，多进程解析后写入管道和调度队列"""
+
+    def __init__(self, crawler, spider, itemproc, scheduler):
+        settings = crawler.settings
+        self.crawler = crawler
+        self.spider = spider
+        self.itemproc = itemproc
+        self.scheduler = scheduler
+        self.server = get_redis_from_settings(settings)
+        self.stream = settings.get('PARSE_TIER_STREAM', 'book:raw_pages')
+        self.group = settings.get('PARSE_TIER_GROUP', 'parsers')
+        self.batch_size = settings.getint('PARSE_TIER_BATCH_SIZE', 32)
+        self.block_ms = settings.getint('PARSE_TIER_BLOCK_MS', 5000)
+        self.claim_idle_ms = settings.getint('PARSE_TIER_CLAIM_IDLE_MS', 300000)
+        self.max_deliveries = settings.getint('PARSE_TIER_MAX_DELIVERIES', 3)
+        self.dead_stream = settings.get('PARSE_TIER_DEAD_STREAM', f'{self.stream}:dead')
+        self.dead_maxlen = settings.getint('PARSE_TIER_DEAD_MAXLEN', 10000)
+        self.consumer = os.environ.get('NODE_ID', 'parser') + f'-{os.getpid()}'
+        processes = settings.getint('PARSE_TIER_PROCESSES', 0) or os.cpu_count()
+        self.executor = ProcessPoolExecutor(max_workers=processes, initializer=init_worker,
+                                            initargs=(type(spider),))
+        self.running = False
+        logger.info(f"解析节点[{self.consumer}]启动，进程数: {processes}")
+
+    def _ensure_group(self):
+        try:
+            self.server.xgroup_create(self.stream, self.group, id='0', mkstream=True)
+        except Exception as e:
+            # 消费组已存在
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    def _read_batch(self):
+        """优先认领其他解析节点崩溃后遗留的消息，再读取新消息"""
+        claimed = self.server.xautoclaim(self.stream, self.group, self.consumer,
+                                         min_idle_time=self.claim_idle_ms, count=self.batch_size)
+        if claimed and claimed[1]:
+            return claimed[1]
+        entries = self.server.xreadgroup(self.group, self.consumer, {self.stream: '>'},
+                                         count=self.batch_size, block=self.block_ms)
+        return entries[0][1] if entries else []
+
+    def _parse_batch(self, entries):
+        return list(self.executor.map(parse_page, [fields for _, fields in entries]))
+
+    def _delivery_count(self, entry_id):
+        pending = self.server.xpending_range(self.stream, self.group, min=entry_id, max=entry_id, count=1)
+        return pending[0]['times_delivered'] if pending else 0
+
+    def _handle_failed(self, failed):
+        """解析失败的消息不确认，超时后重新认领；投递次数达到上限后移到死信 Stream
+
+        返回移到死信 Stream 的消息数
+        """
+        dead = []
+        for entry_id, fields, error in failed:
+            deliveries = self._delivery_count(entry_id)
+            if deliveries < self.max_deliveries:
+                logger.warning(f"解析页面 {_field(fields, 'url')} 失败（第 {deliveries} 次）: {error}")
+                continue
+            logger.error(f"页面 {_field(fields, 'url')} 已投递 {deliveries} 次仍解析失败，移到死信队列: {error}")
+            pipe = self.server.pipeline()
+            pipe.xadd(self.dead_stream, dict(fields, error=error, deliveries=str(deliveries)),
+                      maxlen=self.dead_maxlen, approximate=True)
+            pipe.xack(self.stream, self.group, entry_id)
+            pipe.xdel(self.stream, entry_id)
+            pipe.execute()
+            dead.append(entry_id)
+        return len(dead)
+
+    @defer.inlineCallbacks
+    def run(self):
+        self._ensure_group()
+        self.running = True
+        yield self.itemproc.open_spider(self.spider)
+        self.scheduler.open(self.spider)
+        while self.running:
+            entries = yield threads.deferToThread(self._read_batch)
+            entries = [(entry_id, fields) for entry_id, fields in entries if fields]
+            if not entries:
+                continue
+            try:
+                results = yield threads.deferToThread(self._parse_batch, entries)
+            except Exception as e:
+                # 不确认消息，超时后会被重新认领
+                logger.error(f"批量解析失败: {str(e)}")
+                continue
+
+            items = requests = 0
+            ids, failed = [], []
+            for (entry_id, fields), outputs in zip(entries, results):
+                if outputs and outputs[0][0] == 'error':
+                    failed.append((entry_id, fields, outputs[0][1]))
+                    continue
+                ids.append(entry_id)
+                for kind, obj in outputs:
+                    if kind == 'item':
+                        yield self.itemproc.process_item(obj, self.spider)
+                        items += 1
+                    else:
+                        self.scheduler.enqueue_request(request_from_dict(obj, spider=self.spider))
+                        requests += 1
+
+            # 批量调度器先缓冲请求，确认消息前写入 Redis
+            if hasattr(self.scheduler, 'flush_enqueued'):
+                self.scheduler.flush_enqueued()
+            if ids:
+                self.server.xack(self.stream, self.group, *ids)
+                self.server.xdel(self.stream, *ids)
+                self.crawler.stats.inc_value('parse_tier/pages', len(ids))
+            if failed:
+                dead = yield threads.deferToThread(self._handle_failed, failed)
+                self.crawler.stats.inc_value('parse_tier/errors', len(failed))
+                self.crawler.stats.inc_value('parse_tier/dead', dead)
+            logger.info(f"解析 {len(ids)} 个页面，产出 {items} 条数据、{requests} 个请求")
+
+    @defer.inlineCallbacks
+    def stop(self):
+        self.running = False
+        self.scheduler.close('shutdown')
+        yield self.itemproc.close_spider(self.spider)
+        self.executor.shutdown(wait=False)
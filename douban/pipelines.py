@@ -3,9 +3,20 @@
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
 import pymongo
+from collections import deque
 from datetime import datetime
 from itemadapter import ItemAdapter
+from douban.normalize import ensure_indexes, normalize_batch
+from douban.fingerprints import WRITE_FULL, WRITE_PARTIAL, WRITE_SKIPPED, FieldFingerprintCache
+from douban.sharding import ShardRouter
+from twisted.internet import defer, task
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.failure import Failure
+from twisted.python.threadpool import ThreadPool
 
 
 class DoubanPipeline:
@@ -14,13 +25,60 @@ class DoubanPipeline:
 
 
 class BatchMongoPipeline:
-    def __init__(self, mongo_uri, mongo_db, mongo_collection, batch_size=100, mongo_params=None):
+    """批量写入 MongoDB 的管道
+
+    bulk_write 在专用线程池中执行，不阻塞 reactor。同时在写的批次数有上限
+    （MONGODB_WRITE_QUEUE_SIZE），超过时 process_item 返回 Deferred，等前面的批次
+    写完才放行，背压经由 Scrapy 的 item 处理传回下载，而不是无限堆积在内存中。
+
+    缓冲区满足任一条件即写入：条数达到当前批大小、最早的 item 超过 MONGODB_FLUSH_MAX_AGE 秒、
+    估算字节数超过 MONGODB_FLUSH_MAX_BYTES。批大小按 bulk_write 延迟的滑动平均调节：
+    延迟高（Mongo 繁忙）时加倍，用更少的往返写更多数据；延迟低时减半，数据更快落库。
+    写入前合并同一 book_id 的多条 item，按字段指纹只写变化的字段（没有变化时只更新 last_seen），
+    再按缓存的 chunk 路由表拆成每个分片一个 bulk_write 并行执行。
+    评分、页数、定价、出版年和抓取时间在写入前转换为数值/日期（MONGODB_NORMALIZE），原文保存在 raw 中。
+    收到 SIGTERM 时立即写入缓冲区，关闭时最多等待
+    MONGODB_CLOSE_TIMEOUT 秒。
+    """
+
+    def __init__(self, mongo_uri, mongo_db, mongo_collection, batch_size=100, mongo_params=None,
+                 write_queue_size=4, write_threads=1, stats=None, min_batch_size=10, max_batch_size=1000,
+                 target_latency_ms=500, flush_max_age=30, flush_max_bytes=4 * 1024 * 1024,
+                 close_timeout=8, shard_writers=4, routing_refresh=300, fingerprint_cache_size=200000,
+                 normalize=True):
         self.mongo_uri = mongo_uri
         self.mongo_db = mongo_db
         self.mongo_collection = mongo_collection
         self.batch_size = batch_size
+        self.min_batch_size = max(1, min(min_batch_size, batch_size))
+        self.max_batch_size = max(batch_size, max_batch_size)
+        self.target_latency_ms = target_latency_ms
+        self.flush_max_age = flush_max_age
+        self.flush_max_bytes = flush_max_bytes
+        self.close_timeout = close_timeout
+        self.shard_writers = shard_writers  # 0 表示不按分片拆分
+        self.routing_refresh = routing_refresh
+        self.router = None
+        self.shard_executor = None
+        # 按字段的内容指纹，跳过没有变化的写入；0 表示每次完整写入
+        self.fingerprints = FieldFingerprintCache(fingerprint_cache_size) if fingerprint_cache_size > 0 else None
+        self.normalize = normalize
+        self.latency_ewma = None  # bulk_write 延迟的滑动平均（毫秒）
         self.mongo_params = mongo_params or {}
+        self.write_queue_size = max(1, write_queue_size)
+        self.write_threads = max(1, write_threads)
+        self.stats = stats
         self.items_buffer = []
+        self.buffer_bytes = 0
+        self.buffer_since = None  # 缓冲区中最早 item 的加入时间
+        self.freshness = None
+        self.client = None
+        self.threadpool = None
+        self.spider = None
+        self._flush_task = None
+        self._previous_sigterm = None
+        self._writing = set()  # 正在写入或排队等待线程的批次
+        self._waiting = deque()  # 写入队列已满时等待的 (Deferred, 批次)
         
     @classmethod
     def from_crawler(cls, crawler):
@@ -29,7 +87,20 @@ class BatchMongoPipeline:
             mongo_db=crawler.settings.get('MONGO_DATABASE', 'douban'),
             mongo_collection=crawler.settings.get('MONGO_COLLECTION', 'books'),
             batch_size=crawler.settings.getint('MONGODB_BATCH_SIZE', 100),
-            mongo_params=crawler.settings.get('MONGODB_PARAMS', {})
+            mongo_params=crawler.settings.get('MONGODB_PARAMS', {}),
+            write_queue_size=crawler.settings.getint('MONGODB_WRITE_QUEUE_SIZE', 4),
+            write_threads=crawler.settings.getint('MONGODB_WRITE_THREADS', 1),
+            stats=crawler.stats,
+            min_batch_size=crawler.settings.getint('MONGODB_MIN_BATCH_SIZE', 10),
+            max_batch_size=crawler.settings.getint('MONGODB_MAX_BATCH_SIZE', 1000),
+            target_latency_ms=crawler.settings.getfloat('MONGODB_TARGET_LATENCY_MS', 500),
+            flush_max_age=crawler.settings.getfloat('MONGODB_FLUSH_MAX_AGE', 30),
+            flush_max_bytes=crawler.settings.getint('MONGODB_FLUSH_MAX_BYTES', 4 * 1024 * 1024),
+            close_timeout=crawler.settings.getfloat('MONGODB_CLOSE_TIMEOUT', 8),
+            shard_writers=crawler.settings.getint('MONGODB_SHARD_WRITERS', 4),
+            routing_refresh=crawler.settings.getfloat('MONGODB_ROUTING_REFRESH', 300),
+            fingerprint_cache_size=crawler.settings.getint('MONGODB_FINGERPRINT_CACHE_SIZE', 200000),
+            normalize=crawler.settings.getbool('MONGODB_NORMALIZE', True),
         )
         
     def open_spider(self, spider):
@@ -41,10 +112,55 @@ class BatchMongoPipeline:
             
             # 确保分片键索引存在
             self.collection.create_index([('book_id', pymongo.ASCENDING)], unique=True)
+            # 排序和范围查询使用的复合索引，依赖字段已规范化为数值/日期
+            if self.normalize:
+                ensure_indexes(self.collection)
             spider.logger.info('MongoDB分片集群连接成功')
+            # 写入成功后同步更新爬虫的新鲜度索引
+            self.freshness = getattr(spider, 'freshness', None)
+            # 按分片拆分批量写入
+            if self.shard_writers > 0:
+                self.router = ShardRouter(self.client, f'{self.mongo_db}.{self.mongo_collection}',
+                                          refresh_interval=self.routing_refresh)
+                self.shard_executor = ThreadPoolExecutor(max_workers=self.shard_writers,
+                                                         thread_name_prefix='MongoShardWriter')
         except Exception as e:
             spider.logger.error(f'MongoDB连接失败: {str(e)}')
             raise
+        # 写入在独立线程池中执行，不占用 reactor 线程和默认线程池
+        self.threadpool = ThreadPool(minthreads=1, maxthreads=self.write_threads, name='MongoWriter')
+        self.threadpool.start()
+        self.spider = spider
+        # 定时检查缓冲区的存留时间
+        if self.flush_max_age > 0:
+            self._flush_task = task.LoopingCall(self._flush_expired)
+            self._flush_task.start(min(self.flush_max_age, 5), now=False)
+        self._install_sigterm_handler()
+
+    def _install_sigterm_handler(self):
+        """SIGTERM 时先写入缓冲区，再交给原来的处理函数（Scrapy 的优雅关闭）"""
+        try:
+            self._previous_sigterm = signal.getsignal(signal.SIGTERM)
+            signal.signal(signal.SIGTERM, self._on_sigterm)
+        except ValueError:
+            # 不在主线程中，无法设置信号处理
+            self._previous_sigterm = None
+
+    def _on_sigterm(self, signum, frame):
+        from twisted.internet import reactor
+        reactor.callFromThread(self._flush_now, 'SIGTERM')
+        if callable(self._previous_sigterm):
+            self._previous_sigterm(signum, frame)
+
+    def _flush_now(self, reason):
+        if self.items_buffer:
+            self.spider.logger.info(f"{reason}: 立即写入缓冲区中的 {len(self.items_buffer)} 条数据")
+            self._submit(self.spider)
+
+    def _flush_expired(self):
+        if self.buffer_since is not None and time.monotonic() - self.buffer_since >= self.flush_max_age:
+            self._inc_stat('mongodb/flush/age')
+            self._submit(self.spider)
         
     def process_item(self, item, spider):
         # 添加爬取时间
@@ -52,33 +168,186 @@ class BatchMongoPipeline:
             item['crawl_time'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
             
         # 将item转换为字典并添加到缓冲区
-        self.items_buffer.append(dict(ItemAdapter(item).asdict()))
+        data = dict(ItemAdapter(item).asdict())
+        if not self.items_buffer:
+            self.buffer_since = time.monotonic()
+        self.items_buffer.append(data)
+        self.buffer_bytes += sum(len(str(v)) for v in data.values())
         
-        # 当缓冲区达到指定大小时执行批量写入
+        # 当缓冲区达到当前批大小或字节上限时交给写入线程
+        flush_reason = None
         if len(self.items_buffer) >= self.batch_size:
-            self._write_to_mongo(spider)
+            flush_reason = 'size'
+        elif self.flush_max_bytes and self.buffer_bytes >= self.flush_max_bytes:
+            flush_reason = 'bytes'
+        if flush_reason is not None:
+            self._inc_stat(f'mongodb/flush/{flush_reason}')
+            accepted = self._submit(spider)
+            if accepted is not None:
+                # 写入队列已满，等有空位后再放行
+                return accepted.addCallback(lambda _: item)
         return item
-    
-    def _write_to_mongo(self, spider):
+
+    def _submit(self, spider):
+        """把缓冲区交给写入线程；写入队列已满时返回排队成功时触发的 Deferred"""
         if not self.items_buffer:
-            return
-            
+            return None
+        batch = self._merge_duplicates(self.items_buffer)
+        self.items_buffer = []
+        self.buffer_bytes = 0
+        self.buffer_since = None
+        if len(self._writing) < self.write_queue_size:
+            self._start_write(batch, spider)
+            return None
+        waiter = defer.Deferred()
+        self._waiting.append((waiter, batch))
+        self._inc_stat('mongodb/backpressure_waits')
+        self._update_queue_stats()
+        return waiter
+
+    def _merge_duplicates(self, items):
+        """合并同一 book_id 的 item，后到的字段覆盖先到的"""
+        merged = {}
+        for item in items:
+            key = item.get('book_id')
+            if key in merged:
+                merged[key].update(item)
+            else:
+                merged[key] = item
+        if len(merged) < len(items):
+            self._inc_stat('mongodb/merged_duplicates', len(items) - len(merged))
+        return list(merged.values())
+
+    def _adapt_batch_size(self, latency_ms):
+        """按写入延迟的滑动平均调整批大小"""
+        if self.latency_ewma is None:
+            self.latency_ewma = latency_ms
+        else:
+            self.latency_ewma = 0.8 * self.latency_ewma + 0.2 * latency_ms
+        if self.latency_ewma > self.target_latency_ms:
+            self.batch_size = min(self.max_batch_size, self.batch_size * 2)
+        elif self.latency_ewma < self.target_latency_ms / 2:
+            self.batch_size = max(self.min_batch_size, self.batch_size // 2)
+        if self.stats is not None:
+            self.stats.set_value('mongodb/batch_size', self.batch_size)
+            self.stats.set_value('mongodb/write_latency_ewma_ms', int(self.latency_ewma))
+
+    def _start_write(self, batch, spider):
+        from twisted.internet import reactor
+        started = time.monotonic()
+        d = deferToThreadPool(reactor, self.threadpool, self._write_to_mongo, batch, spider)
+        self._writing.add(d)
+        self._update_queue_stats()
+        d.addBoth(self._write_done, d, len(batch), started, spider)
+
+    def _write_done(self, result, d, count, started, spider):
+        self._writing.discard(d)
+        latency_ms = (time.monotonic() - started) * 1000
+        if isinstance(result, Failure):
+            spider.logger.error(f"批量写入错误: {result.getErrorMessage()}")
+            self._inc_stat('mongodb/write_errors')
+        else:
+            self._adapt_batch_size(latency_ms)
+            # 本批完整写入、部分字段写入和只更新 last_seen 的数量
+            for kind, value in (result or {}).items():
+                self._inc_stat(f'mongodb/upsert/{kind}', value)
+        self._inc_stat('mongodb/batches')
+        self._inc_stat('mongodb/items', count)
+        self._inc_stat('mongodb/write_time_ms', int(latency_ms))
+        if self.stats is not None:
+            self.stats.set_value('mongodb/write_latency_ms', int(latency_ms))
+            self.stats.max_value('mongodb/write_latency_max_ms', int(latency_ms))
+
+        # 放行等待中的批次
+        while self._waiting and len(self._writing) < self.write_queue_size:
+            waiter, batch = self._waiting.popleft()
+            self._start_write(batch, spider)
+            waiter.callback(None)
+        self._update_queue_stats()
+        return None
+
+    def _update_queue_stats(self):
+        if self.stats is not None:
+            depth = len(self._writing) + len(self._waiting)
+            self.stats.set_value('mongodb/queue_depth', depth)
+            self.stats.max_value('mongodb/queue_depth_max', depth)
+
+    def _inc_stat(self, key, value=1):
+        if self.stats is not None:
+            self.stats.inc_value(key, value)
+    
+    def _write_to_mongo(self, batch, spider):
+        """在写入线程中执行：按目标分片分组，各分片的 bulk_write 并行执行
+
+        返回本批各写入方式的数量 {'full': n, 'partial': n, 'skipped': n}
+        """
+        if self.normalize:
+            # 在指纹比较之前转换，缓存和库中保存的都是规范化后的值
+            normalize_batch(batch)
+        updates, fingerprints, counts = self._build_updates(batch)
+        groups = self.router.partition(batch, key='book_id') if self.router is not None else {None: batch}
+        operations = [[updates[item['book_id']] for item in items] for items in groups.values()]
+        if len(groups) > 1 and self.shard_executor is not None:
+            results = list(self.shard_executor.map(self._bulk_upsert, operations, [spider] * len(groups)))
+        else:
+            results = [self._bulk_upsert(ops, spider) for ops in operations]
+
+        for items, (_, _, ok) in zip(groups.values(), results):
+            # 只有写入成功的分组才更新新鲜度索引，失败的图书下次仍会重新抓取
+            if ok and self.freshness is not None:
+                self.freshness.record(items)
+            if self.fingerprints is None:
+                continue
+            book_ids = [item['book_id'] for item in items]
+            if ok:
+                for book_id in book_ids:
+                    self.fingerprints.update(book_id, fingerprints[book_id])
+            else:
+                self.fingerprints.invalidate(book_ids)
+
+        upserted = sum(r[0] for r in results)
+        modified = sum(r[1] for r in results)
+        spider.logger.info(f"批量写入MongoDB: {len(batch)}条数据, 分片数: {len(groups)}, "
+                           f"插入: {upserted}, 更新: {modified}, 完整写入: {counts[WRITE_FULL]}, "
+                           f"部分写入: {counts[WRITE_PARTIAL]}, 未变化: {counts[WRITE_SKIPPED]}")
+        return counts
+
+    def _build_updates(self, batch):
+        """按字段指纹决定每条 item 的写入内容，返回 ({book_id: UpdateOne}, {book_id: 指纹}, 各方式数量)"""
+        counts = {WRITE_FULL: 0, WRITE_PARTIAL: 0, WRITE_SKIPPED: 0}
+        updates, fingerprints = {}, {}
+        if self.fingerprints is not None:
+            try:
+                self.fingerprints.load_missing(self.collection, [item['book_id'] for item in batch])
+            except Exception as e:
+                # 读不到已有文档时按完整写入处理
+                self.spider.logger.warning(f"读取已有文档指纹失败: {str(e)}")
+
+        for item in batch:
+            book_id = item['book_id']
+            last_seen = item.get('crawl_time')
+            if self.fingerprints is None:
+                kind, fields = WRITE_FULL, None
+            else:
+                kind, fields, fingerprints[book_id] = self.fingerprints.diff(item)
+            counts[kind] += 1
+            if kind == WRITE_FULL:
+                # 使用批量更新而不是插入，避免重复数据问题
+                update = {'$set': dict(item, last_seen=last_seen)}
+            elif kind == WRITE_PARTIAL:
+                changed = {field: item[field] for field in fields}
+                update = {'$set': dict(changed, crawl_time=last_seen, last_seen=last_seen)}
+            else:
+                update = {'$set': {'last_seen': last_seen}}
+            updates[book_id] = pymongo.UpdateOne({'book_id': book_id}, update, upsert=True)
+        return updates, fingerprints, counts
+
+    def _bulk_upsert(self, bulk_operations, spider):
+        """写入同一分片上的一组操作，返回 (插入数, 更新数, 是否全部成功)"""
         try:
-            # 使用批量更新而不是插入，避免重复数据问题
-            bulk_operations = []
-            for item in self.items_buffer:
-                bulk_operations.append(
-                    pymongo.UpdateOne(
-                        {'book_id': item['book_id']},
-                        {'$set': item},
-                        upsert=True
-                    )
-                )
-            
             if bulk_operations:
                 result = self.collection.bulk_write(bulk_operations, ordered=False)
-                spider.logger.info(f"批量写入MongoDB: {len(bulk_operations)}条数据, "
-                                  f"插入: {result.upserted_count}, 更新: {result.modified_count}")
+                return result.upserted_count, result.modified_count, True
         except pymongo.errors.BulkWriteError as e:
             # 处理批量写入错误，但不中断处理
             spider.logger.error(f"批量写入部分失败: {str(e)}")
@@ -86,14 +355,29 @@ class BatchMongoPipeline:
             if hasattr(e, 'details') and 'nInserted' in e.details:
                 spider.logger.info(f"成功插入: {e.details.get('nInserted', 0)}, "
                                   f"成功更新: {e.details.get('nModified', 0)}")
-        except Exception as e:
-            spider.logger.error(f"批量写入错误: {str(e)}")
-        
-        # 清空缓冲区
-        self.items_buffer = []
+            details = getattr(e, 'details', None) or {}
+            return details.get('nUpserted', 0), details.get('nModified', 0), False
+        return 0, 0, True
     
+    @defer.inlineCallbacks
     def close_spider(self, spider):
-        # 确保关闭爬虫时写入所有剩余数据
-        self._write_to_mongo(spider)
+        if self._flush_task is not None and self._flush_task.running:
+            self._flush_task.stop()
+        if self._previous_sigterm is not None:
+            signal.signal(signal.SIGTERM, self._previous_sigterm)
+        # 确保关闭爬虫时写入所有剩余数据，并在限定时间内等待写入线程完成
+        from twisted.internet import reactor
+        deadline = time.monotonic() + self.close_timeout
+        self._submit(spider)
+        while (self._writing or self._waiting) and time.monotonic() < deadline:
+            yield task.deferLater(reactor, 0.1, lambda: None)
+        if self._writing or self._waiting:
+            spider.logger.error(f"关闭超时({self.close_timeout}秒)，仍有 "
+                                f"{len(self._writing) + len(self._waiting)} 批数据未确认写入")
+        else:
+            if self.threadpool is not None:
+                self.threadpool.stop()
+            if self.shard_executor is not None:
+                self.shard_executor.shutdown(wait=False)
         if self.client:
             self.client.close()
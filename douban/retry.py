@@ -0,0 +1,122 @@
+# 延迟重试队列
+#
+# 被反爬拦截的请求不在爬虫里等待、也不在本地记录重试次数，而是写入 Redis 有序集合
+# <spider>:retry，分数为到期时间，成员为 "优先级分数|序列化请求"（与调度队列同一序列化方式）。
+# 尝试次数随请求保存在 meta['retry_attempt']，等待时间按指数退避并加随机抖动。
+# BatchedScheduler 定时把到期的请求原子地移回调度队列；超过最大次数的请求
+# 写入死信列表 <spider>:retry:dead，供人工排查。
+
+import importlib
+import json
+import logging
+import random
+import time
+
+from scrapy_redis import picklecompat
+from scrapy_redis.connection import get_redis_from_settings
+
+logger = logging.getLogger(__name__)
+
+# 把到期的重试请求按原优先级移回调度队列
+# KEYS[1] = 重试集合, KEYS[2] = 调度队列
+# ARGV = 当前时间, 单次最多移动的数量
+RELEASE_DUE_SCRIPT = """
+local members = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+for _, member in ipairs(members) do
+    local sep = string.find(member, '|', 1, true)
+    if sep then
+        redis.call('ZADD', KEYS[2], tonumber(string.sub(member, 1, sep - 1)), string.sub(member, sep + 1))
+    end
+    redis.call('ZREM', KEYS[1], member)
+end
+return #members
+"""
+
+
+class RetryQueue:
+    """Redis 有序集合实现的延迟重试队列"""
+
+    def __init__(self, server, key, dead_key, serializer=picklecompat, max_attempts=3,
+                 base_delay=10, max_delay=600, dead_maxlen=10000, stats=None):
+        self.server = server
+        self.key = key
+        self.dead_key = dead_key
+        self.serializer = serializer
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.dead_maxlen = dead_maxlen
+        self.stats = stats
+        self._release_script = server.register_script(RELEASE_DUE_SCRIPT)
+
+    @classmethod
+    def from_settings(cls, settings, spider_name, server=None, serializer=None, stats=None):
+        if serializer is None:
+            serializer = settings.get('SCHEDULER_SERIALIZER') or picklecompat
+            if isinstance(serializer, str):
+                serializer = importlib.import_module(serializer)
+        return cls(
+            server or get_redis_from_settings(settings),
+            key=settings.get('RETRY_QUEUE_KEY', '%(spider)s:retry') % {'spider': spider_name},
+            dead_key=settings.get('RETRY_DEAD_KEY', '%(spider)s:retry:dead') % {'spider': spider_name},
+            serializer=serializer,
+            max_attempts=settings.getint('RETRY_QUEUE_MAX_ATTEMPTS', 3),
+            base_delay=settings.getfloat('RETRY_QUEUE_BASE_DELAY', 10),
+            max_delay=settings.getfloat('RETRY_QUEUE_MAX_DELAY', 600),
+            dead_maxlen=settings.getint('RETRY_DEAD_MAXLEN', 10000),
+            stats=stats,
+        )
+
+    def backoff(self, attempt):
+        """第 attempt 次重试的等待时间：指数增长，在上限的一半到上限之间随机"""
+        cap = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return random.uniform(cap / 2, cap)
+
+    def schedule(self, request, reason, spider=None, **meta):
+        """把请求写入重试队列，额外的 meta 合并进重试请求；超过最大次数时写入死信列表并返回 False"""
+        attempt = request.meta.get('retry_attempt', 0) + 1
+        if attempt > self.max_attempts:
+            self.dead(request, reason, attempt - 1)
+            return False
+
+        retry = request.replace(dont_filter=True)
+        retry.meta.update(meta)
+        retry.meta['retry_attempt'] = attempt
+        retry.meta['retry_reason'] = reason
+        delay = self.backoff(attempt)
+        member = f'{-retry.priority}|'.encode() + self.serializer.dumps(retry.to_dict(spider=spider))
+        self.server.zadd(self.key, {member: time.time() + delay})
+        logger.info(f"{reason}: 第 {attempt} 次重试安排在 {delay:.1f} 秒后: {request.url}")
+        self._inc_stat('retry/scheduled')
+        self._inc_stat(f'retry/reason/{reason}')
+        return True
+
+    def dead(self, request, reason, attempts):
+        """写入死信列表，只保留最近 dead_maxlen 条"""
+        record = json.dumps({
+            'url': request.url,
+            'callback': getattr(request.callback, '__name__', request.callback),
+            'reason': reason,
+            'attempts': attempts,
+            'time': int(time.time()),
+        }, ensure_ascii=False)
+        pipe = self.server.pipeline()
+        pipe.lpush(self.dead_key, record)
+        pipe.ltrim(self.dead_key, 0, self.dead_maxlen - 1)
+        pipe.execute()
+        logger.error(f"达到最大重试次数({attempts})，写入死信列表: {request.url}")
+        self._inc_stat('retry/dead')
+
+    def release_due(self, queue_key, limit=100):
+        """把到期的重试请求移回调度队列，返回移动的数量"""
+        released = self._release_script(keys=[self.key, queue_key], args=[time.time(), limit])
+        if released:
+            self._inc_stat('retry/released', released)
+        return released
+
+    def __len__(self):
+        return self.server.zcard(self.key)
+
+    def _inc_stat(self, key, value=1):
+        if self.stats is not None:
+            self.stats.inc_value(key, value)
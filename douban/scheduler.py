@@ -0,0 +1,329 @@
+# 批量 Redis 调度器
+#
+# scrapy_redis 的 Scheduler + PriorityQueue 每次入队、出队各一次 Redis 往返，
+# 一个列表页产生的二十多个请求要逐个 ZADD。这里：
+#
+# - 入队先放本地缓冲，攒够一批、定时器到点或需要出队时，用一条多成员 ZADD 写入
+# - 出队用 Lua 脚本原子地取出并删除最高优先级的一小批请求，放入本地预取缓冲
+# - 预取数量有上限，正常关闭时未处理的请求放回队列
+#
+# 租约：出队的请求同时写入本进程的在途有序集合 <队列键>:inflight:<进程标识>，
+# 进程标识由 NODE_ID、主机名、pid 和启动时间组成，多个副本共用 NODE_ID 时互不干扰。
+# 分数为租约到期时间，成员为 "原优先级分数|请求"。出队的请求在 meta 中带上本进程内
+# 唯一的租约编号，请求下载完成或失败后按编号确认
+# （确认在下一次出队或心跳时随脚本一起 ZREM），进程定时心跳续约。进程崩溃后
+# 租约不再续期，由主控节点的监控循环在过期后放回队列。
+#
+# 延迟重试：爬虫把被反爬拦截的请求写入 douban.retry.RetryQueue，这里定时把到期的移回队列。
+
+import logging
+import os
+import socket
+import itertools
+import time
+from collections import deque
+
+from scrapy import signals
+from scrapy_redis.queue import PriorityQueue
+from scrapy_redis.scheduler import Scheduler
+from twisted.internet import task
+
+from douban.retry import RetryQueue
+
+logger = logging.getLogger(__name__)
+
+# 出队请求的租约编号，以 '_' 开头，导出到解析层时会被跳过
+LEASE_META_KEY = '_lease_token'
+
+# 原子地取出分数最小（优先级最高）的 ARGV[1] 个请求
+POP_BATCH_SCRIPT = """
+local items = redis.call('ZRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #items > 0 then
+    redis.call('ZREMRANGEBYRANK', KEYS[1], 0, #items - 1)
+end
+return items
+"""
+
+# 先确认已完成的租约，再取出 ARGV[1] 个请求并写入在途集合
+# KEYS[1] = 请求队列, KEYS[2] = 在途集合
+# ARGV = 数量, 租约到期时间, 已确认的成员...
+LEASE_POP_SCRIPT = """
+for i = 3, #ARGV do
+    redis.call('ZREM', KEYS[2], ARGV[i])
+end
+local items = redis.call('ZRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1, 'WITHSCORES')
+local leased = {}
+if #items > 0 then
+    redis.call('ZREMRANGEBYRANK', KEYS[1], 0, #items / 2 - 1)
+    for i = 1, #items, 2 do
+        local member = items[i + 1] .. '|' .. items[i]
+        redis.call('ZADD', KEYS[2], ARGV[2], member)
+        leased[#leased + 1] = member
+    end
+end
+return leased
+"""
+
+# 把在途集合中到期时间不晚于 ARGV[1] 的租约按原优先级放回队列
+# KEYS[1] = 请求队列, KEYS[2] = 在途集合
+REQUEUE_LEASES_SCRIPT = """
+local members = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+for _, member in ipairs(members) do
+    local sep = string.find(member, '|', 1, true)
+    if sep then
+        redis.call('ZADD', KEYS[1], tonumber(string.sub(member, 1, sep - 1)), string.sub(member, sep + 1))
+    end
+    redis.call('ZREM', KEYS[2], member)
+end
+return #members
+"""
+
+INFLIGHT_KEY = '%(queue)s:inflight:%(worker)s'
+HEARTBEAT_KEY = '%(queue)s:heartbeat:%(worker)s'
+
+
+def worker_token(node_id=None):
+    """本进程的租约标识：NODE_ID-主机名-pid-启动时间"""
+    node_id = node_id or os.environ.get('NODE_ID', 'master')
+    return f'{node_id}-{socket.gethostname()}-{os.getpid()}-{int(time.time())}'
+
+
+def requeue_leases(server, inflight_key, before=None):
+    """把在途集合中到期的租约放回队列，before 为 None 时放回全部，返回放回的数量"""
+    queue_key = inflight_key.rsplit(':inflight:', 1)[0]
+    before = '+inf' if before is None else before
+    return server.eval(REQUEUE_LEASES_SCRIPT, 2, queue_key, inflight_key, before)
+
+
+def requeue_expired_leases(server, pattern='*:inflight:*'):
+    """扫描所有节点的在途集合，放回已过期的租约，返回 {在途集合键: 放回数量}"""
+    now = time.time()
+    recovered = {}
+    for key in server.scan_iter(match=pattern, _type='ZSET'):
+        key = key.decode() if isinstance(key, bytes) else key
+        count = requeue_leases(server, key, now)
+        if count:
+            recovered[key] = count
+    return recovered
+
+
+class BatchPriorityQueue(PriorityQueue):
+    """支持批量入队、批量出队的优先级队列，单个请求的 push/pop 与父类一致"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pop_script = self.server.register_script(POP_BATCH_SCRIPT)
+        self._lease_script = self.server.register_script(LEASE_POP_SCRIPT)
+
+    def push_many(self, requests):
+        """一条 ZADD 写入多个请求"""
+        if not requests:
+            return
+        args = []
+        for request in requests:
+            args.extend((-request.priority, self._encode_request(request)))
+        self.server.execute_command('ZADD', self.key, *args)
+
+    def pop_many(self, count):
+        """原子地取出至多 count 个请求"""
+        return [self._decode_request(data) for data in self._pop_script(keys=[self.key], args=[count])]
+
+    def pop_leased(self, count, inflight_key, expires_at, acked=()):
+        """确认 acked 中的租约，再取出至多 count 个请求写入在途集合，返回 [(租约成员, 请求)]"""
+        members = self._lease_script(keys=[self.key, inflight_key], args=[count, expires_at, *acked])
+        return [(member, self._decode_request(member.split(b'|', 1)[1])) for member in members]
+
+
+class BatchedScheduler(Scheduler):
+    """批量入队、预取出队的 Redis 调度器"""
+
+    def __init__(self, server, enqueue_batch=50, flush_interval=1.0, prefetch=8,
+                 lease_ttl=300, heartbeat_interval=30, lease_max_age=1800, worker_id=None,
+                 retry_poll_interval=5, **kwargs):
+        super().__init__(server, **kwargs)
+        self.enqueue_batch = max(1, enqueue_batch)
+        self.flush_interval = flush_interval
+        self.prefetch = max(1, prefetch)
+        self.lease_ttl = lease_ttl  # 0 表示不使用租约
+        self.heartbeat_interval = heartbeat_interval
+        self.lease_max_age = lease_max_age
+        self.worker_id = worker_id or worker_token()
+        self.retry_poll_interval = retry_poll_interval  # 0 表示不释放延迟重试
+        self.retry_queue = None
+        self._pending = []  # 待写入 Redis 的请求
+        self._prefetched = deque()  # 已从 Redis 取出、尚未交给引擎的请求
+        self._leases = {}  # 租约编号 -> (租约成员, 出队时间)
+        self._lease_tokens = itertools.count(1)
+        self._acked = []  # 已确认、尚未从在途集合删除的租约成员
+        self._flush_task = None
+        self._heartbeat_task = None
+        self._retry_task = None
+
+    @classmethod
+    def from_settings(cls, settings):
+        scheduler = super().from_settings(settings)
+        scheduler.enqueue_batch = max(1, settings.getint('SCHEDULER_ENQUEUE_BATCH', 50))
+        scheduler.flush_interval = settings.getfloat('SCHEDULER_FLUSH_INTERVAL', 1.0)
+        scheduler.prefetch = max(1, settings.getint('SCHEDULER_PREFETCH', 8))
+        scheduler.lease_ttl = settings.getint('SCHEDULER_LEASE_TTL', 300)
+        scheduler.heartbeat_interval = settings.getfloat('SCHEDULER_HEARTBEAT_INTERVAL', 30)
+        scheduler.lease_max_age = settings.getint('SCHEDULER_LEASE_MAX_AGE', 1800)
+        scheduler.retry_poll_interval = settings.getfloat('SCHEDULER_RETRY_POLL_INTERVAL', 5)
+        return scheduler
+
+    def __len__(self):
+        return len(self.queue) + len(self._pending) + len(self._prefetched)
+
+    def open(self, spider):
+        super().open(spider)
+        if self.flush_interval > 0:
+            self._flush_task = task.LoopingCall(self.flush_enqueued)
+            self._flush_task.start(self.flush_interval, now=False)
+        if self.lease_ttl > 0:
+            queue_key = self.queue.key
+            self.inflight_key = INFLIGHT_KEY % {'queue': queue_key, 'worker': self.worker_id}
+            self.heartbeat_key = HEARTBEAT_KEY % {'queue': queue_key, 'worker': self.worker_id}
+            # 在途集合按进程划分，其他进程（包括同一 NODE_ID 上次运行）遗留的租约由主控节点按过期时间收回
+            logger.info(f"租约标识: {self.worker_id}")
+            crawler = getattr(spider, 'crawler', None)
+            if crawler is not None:
+                crawler.signals.connect(self.ack, signal=signals.request_left_downloader)
+                crawler.signals.connect(self.ack, signal=signals.request_dropped)
+            self._heartbeat_task = task.LoopingCall(self.heartbeat)
+            self._heartbeat_task.start(self.heartbeat_interval, now=True)
+        if self.retry_poll_interval > 0:
+            self.retry_queue = RetryQueue.from_settings(spider.settings, spider.name, server=self.server,
+                                                        serializer=self.serializer, stats=self.stats)
+            self._retry_task = task.LoopingCall(self.release_due_retries)
+            self._retry_task.start(self.retry_poll_interval, now=True)
+
+    def close(self, reason):
+        for loop in (self._flush_task, self._heartbeat_task, self._retry_task):
+            if loop is not None and loop.running:
+                loop.stop()
+        if self.lease_ttl > 0:
+            # 预取和未完成的请求都还在在途集合中，确认已完成的之后整体放回队列
+            self._prefetched.clear()
+            self._leases.clear()
+            self.flush_enqueued()
+            try:
+                if self._acked:
+                    self.server.zrem(self.inflight_key, *self._acked)
+                    self._acked = []
+                requeue_leases(self.server, self.inflight_key)
+                self.server.delete(self.heartbeat_key)
+            except Exception as e:
+                logger.error(f"归还租约失败，将由主控节点在过期后收回: {str(e)}")
+        else:
+            # 预取但未处理的请求放回队列
+            self._pending.extend(self._prefetched)
+            self._prefetched.clear()
+            self.flush_enqueued()
+        super().close(reason)
+
+    def flush(self):
+        self._pending = []
+        self._prefetched.clear()
+        self._leases.clear()
+        self._acked = []
+        super().flush()
+        if self.lease_ttl > 0:
+            self.server.delete(INFLIGHT_KEY % {'queue': self.queue.key, 'worker': self.worker_id})
+        if self.retry_queue is not None:
+            self.server.delete(self.retry_queue.key)
+
+    def release_due_retries(self):
+        """把到期的延迟重试请求移回调度队列"""
+        try:
+            self.retry_queue.release_due(self.queue.key)
+        except Exception as e:
+            logger.warning(f"释放延迟重试请求失败: {str(e)}")
+
+    def ack(self, request, spider=None, **kwargs):
+        """请求已下载完成、失败或被丢弃，释放其租约"""
+        lease = self._leases.pop(request.meta.pop(LEASE_META_KEY, None), None)
+        if lease is not None:
+            self._acked.append(lease[0])
+
+    def heartbeat(self):
+        """删除已确认的租约，为仍在处理的请求续约，并刷新节点心跳"""
+        now = time.time()
+        expires_at = now + self.lease_ttl
+        renew = []
+        for key, (member, leased_at) in list(self._leases.items()):
+            if now - leased_at > self.lease_max_age:
+                # 长时间未确认的请求多半已丢失，不再续约，过期后由主控节点放回队列
+                del self._leases[key]
+                continue
+            renew.extend((expires_at, member))
+        acked, self._acked = self._acked, []
+        try:
+            pipe = self.server.pipeline(transaction=False)
+            if acked:
+                pipe.zrem(self.inflight_key, *acked)
+            if renew:
+                pipe.execute_command('ZADD', self.inflight_key, 'XX', *renew)
+            pipe.set(self.heartbeat_key, int(now), ex=max(1, int(self.lease_ttl)))
+            pipe.execute()
+        except Exception as e:
+            self._acked = acked + self._acked
+            logger.warning(f"租约心跳失败: {str(e)}")
+
+    def flush_enqueued(self):
+        """把本地缓冲的请求一次写入 Redis"""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        try:
+            self.queue.push_many(pending)
+        except Exception as e:
+            # 写入失败时保留在本地，下次再试
+            self._pending = pending + self._pending
+            logger.error(f"批量入队失败: {str(e)}")
+            return
+        if self.stats:
+            self.stats.inc_value('scheduler/enqueue_batches/redis', spider=self.spider)
+
+    def enqueue_request(self, request):
+        if not request.dont_filter and self.df.request_seen(request):
+            self.df.log(request, self.spider)
+            return False
+        if self.stats:
+            self.stats.inc_value('scheduler/enqueued/redis', spider=self.spider)
+        self._pending.append(request)
+        if len(self._pending) >= self.enqueue_batch:
+            self.flush_enqueued()
+        return True
+
+    def next_request(self):
+        if not self._prefetched:
+            # 先写入本地缓冲的请求，保证出队时按全局优先级排序
+            self.flush_enqueued()
+            if self.lease_ttl > 0:
+                self._prefetch_leased()
+            else:
+                self._prefetched.extend(self.queue.pop_many(self.prefetch))
+        if not self._prefetched:
+            return None
+        request = self._prefetched.popleft()
+        if self.stats:
+            self.stats.inc_value('scheduler/dequeued/redis', spider=self.spider)
+        return request
+
+    def _prefetch_leased(self):
+        acked, self._acked = self._acked, []
+        now = time.time()
+        try:
+            leased = self.queue.pop_leased(self.prefetch, self.inflight_key, now + self.lease_ttl, acked)
+        except Exception:
+            self._acked = acked + self._acked
+            raise
+        for member, request in leased:
+            # 按编号而不是 id(request) 记录，请求对象回收后 id 可能被新请求复用
+            token = next(self._lease_tokens)
+            request.meta[LEASE_META_KEY] = token
+            self._leases[token] = (member, now)
+            self._prefetched.append(request)
+
+    def has_pending_requests(self):
+        return bool(self._prefetched or self._pending) or len(self.queue) > 0
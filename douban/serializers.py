@@ -0,0 +1,127 @@
+# 调度队列的紧凑请求序列化
+#
+# scrapy_redis 默认把 request.to_dict() 整个 pickle 进 Redis，其中请求头里的完整 Cookie、
+# User-Agent、Referer 以及 cookies、meta 字典占了绝大部分字节，而这些在出队后本来就会
+# 随机重新生成。这里只保存 URL、回调编号、优先级和与回调默认值不同的 meta，
+# 请求头和 Cookie 由 SessionRebuildMiddleware 在下载前调用爬虫的 rebuild_session 重建。
+#
+# 用法：SCHEDULER_SERIALIZER = 'douban.serializers'
+#
+# 编码格式：COMPACT_MARKER + JSON 数组
+#     [url, 回调, 错误回调, 优先级, dont_filter, 与默认值不同的 meta, 缺少的默认 meta 键]
+# 回调用 CALLBACKS 中的下标表示；POST、带 cb_kwargs 等无法紧凑编码的请求仍用 pickle。
+
+import json
+
+from scrapy_redis import picklecompat
+
+COMPACT_MARKER = b'\x01'
+
+# 回调名 -> 编号，只能在末尾追加，不能调整顺序
+CALLBACKS = ['parse', 'parse_tag_list', 'parse_detail', 'errback_handler']
+
+# 由 URL 代替的 meta 值
+SAME_AS_URL = '<url>'
+
+# 各回调请求的默认 meta，与 BookSpider 构造请求时一致
+LIST_PAGE_META = {
+    'dont_redirect': True,
+    'handle_httpstatus_list': [302, 403, 404, 429],
+    'download_timeout': 30,
+}
+META_DEFAULTS = {
+    'parse': LIST_PAGE_META,
+    'parse_tag_list': LIST_PAGE_META,
+    'parse_detail': {
+        'book_url': SAME_AS_URL,
+        'dont_merge_cookies': True,
+        'handle_httpstatus_list': [403, 404, 429],
+        'download_timeout': 20,
+    },
+}
+
+# 出队后由 SessionRebuildMiddleware 重建请求头和 Cookie
+REBUILD_META_KEY = 'rebuild_session'
+
+
+def _callback_id(name):
+    if name is None:
+        return None
+    try:
+        return CALLBACKS.index(name)
+    except ValueError:
+        return name
+
+
+def _callback_name(value):
+    return CALLBACKS[value] if isinstance(value, int) else value
+
+
+def _compactable(obj):
+    return (obj.get('method', 'GET') == 'GET' and not obj.get('body')
+            and not obj.get('cb_kwargs') and not obj.get('flags')
+            and obj.get('encoding', 'utf-8') == 'utf-8')
+
+
+def dumps(obj):
+    """编码 request.to_dict() 的结果"""
+    if not _compactable(obj):
+        return picklecompat.dumps(obj)
+
+    url = obj['url']
+    defaults = META_DEFAULTS.get(obj.get('callback'), {})
+    meta_diff = {}
+    for key, value in (obj.get('meta') or {}).items():
+        if key == REBUILD_META_KEY:
+            continue
+        default = defaults.get(key)
+        if default == value or (default == SAME_AS_URL and value == url):
+            continue
+        meta_diff[key] = value
+    missing = [key for key in defaults if key not in (obj.get('meta') or {})]
+
+    record = [url, _callback_id(obj.get('callback')), _callback_id(obj.get('errback')),
+              obj.get('priority', 0), int(bool(obj.get('dont_filter')))]
+    if meta_diff or missing:
+        record.append(meta_diff)
+    if missing:
+        record.append(missing)
+    try:
+        return COMPACT_MARKER + json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    except (TypeError, ValueError):
+        # meta 中有无法 JSON 序列化的值
+        return picklecompat.dumps(obj)
+
+
+def loads(data):
+    """还原为 request_from_dict 可用的字典"""
+    if not data.startswith(COMPACT_MARKER):
+        return picklecompat.loads(data)
+
+    record = json.loads(data[1:].decode('utf-8'))
+    url, callback, errback, priority, dont_filter = record[:5]
+    meta_diff = record[5] if len(record) > 5 else {}
+    missing = set(record[6]) if len(record) > 6 else set()
+
+    callback = _callback_name(callback)
+    meta = {}
+    for key, value in META_DEFAULTS.get(callback, {}).items():
+        if key not in missing:
+            meta[key] = url if value == SAME_AS_URL else (list(value) if isinstance(value, list) else value)
+    meta.update(meta_diff)
+    meta[REBUILD_META_KEY] = True
+    return {
+        'url': url,
+        'callback': callback,
+        'errback': _callback_name(errback),
+        'headers': {},
+        'method': 'GET',
+        'body': b'',
+        'cookies': {},
+        'meta': meta,
+        'encoding': 'utf-8',
+        'priority': priority,
+        'dont_filter': bool(dont_filter),
+        'flags': [],
+        'cb_kwargs': {},
+    }
@@ -25,15 +25,35 @@ USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTM
 ROBOTSTXT_OBEY = False
 
 # 并发请求设置
-# 增加并发请求数
-CONCURRENT_REQUESTS = 1  
+# 浏览器标签页池大小（DRISSIONPAGE_SETTINGS['tab_pool_size']），并发上限与之一致，
+# 标签页池才能真正并行渲染
+TAB_POOL_SIZE = 4
+# 并发上限；实际的槽位并发由 AIMD 控制器从 1 开始按反爬触发率调节
+CONCURRENT_REQUESTS = TAB_POOL_SIZE
 CONCURRENT_REQUESTS_PER_DOMAIN = 1 
 
-# 适当减少下载延迟
-DOWNLOAD_DELAY = 5  
+# 请求间隔由 AIMD 控制器 + RandomDelayMiddleware 决定，不再使用固定的下载延迟
+DOWNLOAD_DELAY = 0  
 RANDOMIZE_DOWNLOAD_DELAY = True
-RANDOM_DELAY_MIN = 4  
-RANDOM_DELAY_MAX = 10 
+# 同一槽位（域名 + 代理 + Cookie）相邻请求的随机间隔，由 RandomDelayMiddleware 非阻塞执行
+# （仅在 AIMD_ENABLED = False 时使用）
+RANDOM_DELAY_MIN = 3  
+RANDOM_DELAY_MAX = 8 
+
+# AIMD 限速：按代理、会话统计滑动窗口内的挑战率（验证码、403、跳转登录、内容过小），
+# 正常时加性缩短间隔、增加并发，遇到挑战时乘性延长间隔、减少并发
+AIMD_ENABLED = True
+AIMD_WINDOW = 300  # 滑动窗口（秒）
+AIMD_TARGET_BLOCK_RATE = 0.02  # 窗口内挑战率不超过该值时才继续加速
+AIMD_START_DELAY = 5  # 初始间隔（秒）
+AIMD_MIN_DELAY = 1
+AIMD_MAX_DELAY = 60
+AIMD_DELAY_STEP = 0.1  # 每个正常响应缩短的间隔（秒）
+AIMD_BACKOFF = 0.5  # 遇到挑战时速率、并发乘以该系数
+AIMD_COOLDOWN = 30  # 同一代理/会话两次减速之间的最短间隔（秒）
+AIMD_MIN_CONCURRENCY = 1
+AIMD_MAX_CONCURRENCY = 4  # 不超过 CONCURRENT_REQUESTS
+AIMD_CONCURRENCY_TIMEOUT = 60  # 等待代理/会话并发名额的最长时间（秒），超时写入延迟重试队列
 
 
 # 错误处理配置
@@ -130,9 +150,83 @@ DOWNLOADER_MIDDLEWARES = {
     'scrapy.downloadermiddlewares.redirect.RedirectMiddleware': None,
     'scrapy.downloadermiddlewares.httpproxy.HttpProxyMiddleware': None,
     'scrapy.downloadermiddlewares.cookies.CookiesMiddleware': None, 
+    'douban.middlewares.LeaseAckMiddleware': 50,
+    'douban.middlewares.SessionRebuildMiddleware': 100,
+    'douban.middlewares.RawPageExportMiddleware': 400,
+    'douban.middlewares.PageArchiveMiddleware': 410,
+    'douban.middlewares.TagPaginationMiddleware': 420,
+    'douban.middlewares.RandomDelayMiddleware': 450,
+    'douban.middlewares.GlobalRateLimitMiddleware': 460,
     'douban.middlewares.DrissionPageMiddleware': 500,
+    'douban.middlewares.BlockRateMiddleware': 550,
 }
 
+# 跨节点全局限速：所有工作节点共享 Redis 中的令牌桶，增加节点不会提高总请求速率
+GLOBAL_RATE_LIMIT_ENABLED = True
+GLOBAL_RATE_LIMIT = 0.5  # 每个令牌桶的总速率（请求/秒），0 表示不限速
+GLOBAL_RATE_LIMIT_BURST = 2  # 允许的突发请求数
+GLOBAL_RATE_LIMIT_SCOPE = ['domain']  # 令牌桶划分方式，可加入 'proxy'、'identity'
+GLOBAL_RATE_LIMIT_KEY = 'throttle'  # 令牌桶键前缀
+GLOBAL_RATE_LIMIT_MAX_WAIT = 30  # 最长预约等待（秒），超过时稍后重新领取
+
+# 解析层分离：工作节点只抓取，原始页面写入 Redis Stream，由 parse_node.py 多进程解析
+PARSE_TIER_ENABLED = os.environ.get('PARSE_TIER_ENABLED', '0') == '1'
+PARSE_TIER_STREAM = 'book:raw_pages'
+PARSE_TIER_GROUP = 'parsers'
+PARSE_TIER_CALLBACKS = ['parse_detail', 'parse_tag_list']  # 交给解析节点的回调
+PARSE_TIER_BATCH_SIZE = 32  # 每批读取的页面数
+PARSE_TIER_PROCESSES = 0  # 解析进程数，0 表示 CPU 核数
+PARSE_TIER_CLAIM_IDLE_MS = 300000  # 解析节点崩溃后，超过该时间未确认的页面由其他节点认领
+PARSE_TIER_MAXLEN = 200000  # Stream 近似最大长度，防止解析节点全部停止时无限增长
+PARSE_TIER_MAX_DELIVERIES = 3  # 同一页面投递该次数后仍解析失败，移到死信 Stream
+PARSE_TIER_DEAD_STREAM = 'book:raw_pages:dead'
+PARSE_TIER_DEAD_MAXLEN = 10000
+
+# 延迟重试队列：被反爬拦截的请求写入 Redis 有序集合，按指数退避（带随机抖动）到期后放回调度队列
+RETRY_QUEUE_ENABLED = True
+RETRY_QUEUE_KEY = '%(spider)s:retry'
+RETRY_DEAD_KEY = '%(spider)s:retry:dead'  # 超过最大次数的请求写入该列表
+RETRY_QUEUE_MAX_ATTEMPTS = 3
+RETRY_QUEUE_BASE_DELAY = 10  # 第一次重试的等待上限（秒），之后每次翻倍
+RETRY_QUEUE_MAX_DELAY = 600
+RETRY_DEAD_MAXLEN = 10000
+SCHEDULER_RETRY_POLL_INTERVAL = 5  # 调度器检查到期重试的间隔（秒）
+
+# 标签翻页：第一页读取总页数后一次性生成其余页的请求
+TAG_MAX_PAGES = 50  # 每个标签最多抓取的页数
+TAG_EXHAUSTED_TTL = 86400  # 标签翻到底的记录保留时间（秒），过期后重新抓取后续页
+
+# 增量抓取：新鲜度索引（Redis 哈希）记录每本书最近的抓取时间和内容哈希
+FRESHNESS_ENABLED = True
+FRESHNESS_KEY = 'book:freshness'
+# 重访策略：[评分人数下限, 内容未变化时长下限（秒）, 最长重访间隔（秒）]，取第一条满足的
+# （评分人数、未变化时长都更高的规则优先）
+FRESHNESS_REVISIT_POLICY = [
+    [10000, 0, 3 * 86400],
+    [1000, 0, 7 * 86400],
+    [0, 180 * 86400, 60 * 86400],
+    [0, 0, 30 * 86400],
+]
+
+# 原始页面归档：压缩追加写入本地分段文件，解析逻辑修改后用 `scrapy reparse` 重放
+ARCHIVE_ENABLED = True
+ARCHIVE_DIR = os.path.join(os.getcwd(), 'archive')  # 每个节点写入 ARCHIVE_DIR/<NODE_ID>
+ARCHIVE_CALLBACKS = ['parse_detail', 'parse_tag_list']
+ARCHIVE_CODEC = 'zlib'  # 安装 zstandard 后可改为 'zstd'
+ARCHIVE_SEGMENT_MB = 256  # 单个分段文件大小上限
+ARCHIVE_QUEUE_SIZE = 1000  # 待写入队列上限，写入跟不上时丢弃
+
+# 自定义命令（scrapy reparse）
+COMMANDS_MODULE = 'douban.commands'
+
+# 调试页面采集：正常页面按采样率保存，异常页面必定保存，gzip 压缩后写入环形目录
+DEBUG_CAPTURE_ENABLED = True
+DEBUG_CAPTURE_DIR = os.path.join(os.getcwd(), 'logs', 'captures')
+DEBUG_CAPTURE_SAMPLE_RATE = 0.01  # 正常页面的采样率
+DEBUG_CAPTURE_MAX_FILES = 500  # 目录中最多保留的页面数，超出后删除最旧的
+DEBUG_CAPTURE_MIN_BODY = 1000  # 小于该字节数的响应视为异常
+DEBUG_CAPTURE_QUEUE_SIZE = 100  # 待写入队列上限，写入跟不上时丢弃
+
 SPIDER_MIDDLEWARES = {
     'douban.middlewares.DoubanSpiderMiddleware': 543,
 }
@@ -147,6 +241,33 @@ DRISSIONPAGE_SETTINGS = {
     'timeout': 30,        
     'proxy': None,        
     'download_path': 'downloads',
+    # 标签页池大小：每个节点可同时渲染的页面数，CONCURRENT_REQUESTS 超过该值时多余请求排队等待标签页
+    'tab_pool_size': TAB_POOL_SIZE,
+    'tab_acquire_timeout': 60,  # 等待空闲标签页的最长时间（秒）
+    # 浏览器回收：服务页数或进程树 RSS 超过阈值后切换到预热好的备用浏览器
+    'max_pages_per_browser': 500,
+    'max_browser_rss_mb': 600,
+    'rss_check_interval': 20,  # 每服务多少个页面检查一次 RSS
+    'prewarm_spare': True,
+    # 分级抓取：先用普通 HTTP，命中反爬后才升级到浏览器；关闭后所有请求都走浏览器
+    'tiered_fetch': True,
+    'escalation_ttl': 1800,  # 升级决定按 页面类型+代理+Cookie 记忆的时长（秒）
+    # 页面加载策略：eager 在 DOMContentLoaded 后返回，不等待图片等子资源
+    'load_mode': 'eager',
+    'ready_timeout': 15,  # 未单独配置的页面类型等待就绪的超时（秒）
+    # 通过 CDP Network.setBlockedURLs 屏蔽的资源，节省代理流量和页面加载时间
+    'blocked_urls': [
+        '*.jpg', '*.jpeg', '*.png', '*.gif', '*.webp', '*.svg', '*.ico',
+        '*.css', '*.woff', '*.woff2', '*.ttf', '*.otf',
+        '*hm.baidu.com*', '*google-analytics.com*', '*googletagmanager.com*',
+        '*erebor.douban.com*', '*doubanio.com/dae/*',
+    ],
+    # 按页面类型配置就绪选择器、超时和屏蔽规则（未配置 blocked_urls 时使用上面的默认值）
+    'page_types': {
+        'detail': {'ready_selector': 'div#info', 'timeout': 15},
+        'tag_list': {'ready_selector': 'li.subject-item', 'timeout': 15},
+        'tag_index': {'ready_selector': 'table.tagCol', 'timeout': 10},
+    },
     'cookies': [
         # 第一个账号
         {
@@ -220,8 +341,8 @@ DRISSIONPAGE_SETTINGS = {
 COOKIES_ENABLED = True
 COOKIES_DEBUG = True
 
-# 启用自动限速
-AUTOTHROTTLE_ENABLED = True
+# 自动限速只根据延迟调节，已由按反爬触发率调节的 AIMD 控制器代替
+AUTOTHROTTLE_ENABLED = False
 AUTOTHROTTLE_START_DELAY = 5
 AUTOTHROTTLE_MAX_DELAY = 30
 AUTOTHROTTLE_TARGET_CONCURRENCY = 0.2
@@ -243,15 +364,46 @@ MONGODB_PARAMS = {
     'waitQueueTimeoutMS': 5000,
     'retryWrites': True,
 }
+# 批量写入在独立线程中执行；同时在写（含排队）的批次超过该数量时，管道返回 Deferred 向抓取施加背压
+MONGODB_WRITE_QUEUE_SIZE = 4
+MONGODB_WRITE_THREADS = 1  # 大于 1 时同一本书的两次写入可能乱序
+# 写入时机：条数达到批大小、最早的 item 存留超过 MAX_AGE 秒或估算大小超过 MAX_BYTES，满足其一即写入
+MONGODB_BATCH_SIZE = 100  # 初始批大小
+MONGODB_MIN_BATCH_SIZE = 10
+MONGODB_MAX_BATCH_SIZE = 1000
+MONGODB_TARGET_LATENCY_MS = 500  # 写入延迟高于该值时加大批次，低于一半时减小
+MONGODB_FLUSH_MAX_AGE = 30
+MONGODB_FLUSH_MAX_BYTES = 4 * 1024 * 1024
+# 按 config.chunks 路由表把一批 upsert 拆成每个分片一个 bulk_write，并行写入的线程数；0 表示整批交给 mongos
+MONGODB_SHARD_WRITERS = 4
+MONGODB_ROUTING_REFRESH = 300  # 路由表缓存时间（秒）
+# 按字段的内容指纹缓存的图书数（LRU），内容没有变化的图书只更新 last_seen；0 表示每次完整写入
+MONGODB_FINGERPRINT_CACHE_SIZE = 200000
+# 写入前把评分、页数、定价、出版年、抓取时间转换为数值/日期并创建对应索引，原文保存在 raw 中
+# 已有数据用 scrapy backfill 转换
+MONGODB_NORMALIZE = True
+MONGODB_CLOSE_TIMEOUT = 8  # 关闭（含 SIGTERM）时等待写入完成的最长时间，需小于容器的停止宽限期
 
 # Set settings whose default value is deprecated to a future-proof value
 TWISTED_REACTOR = "twisted.internet.asyncioreactor.AsyncioSelectorReactor"
 
 # Scrapy-Redis配置 
-# 启用Redis调度器
-SCHEDULER = "scrapy_redis.scheduler.Scheduler"
-# 确保所有爬虫通过Redis去重
-DUPEFILTER_CLASS = "scrapy_redis.dupefilter.RFPDupeFilter"
+# 启用Redis调度器：批量入队、预取出队，减少 Redis 往返
+SCHEDULER = "douban.scheduler.BatchedScheduler"
+SCHEDULER_ENQUEUE_BATCH = 50  # 本地缓冲攒够该数量的请求后一次写入
+SCHEDULER_FLUSH_INTERVAL = 1.0  # 本地缓冲最长停留时间（秒）
+SCHEDULER_PREFETCH = 8  # 每次从 Redis 预取的请求数
+# 在途租约：出队的请求记入本节点的在途集合，节点崩溃后由主控节点在租约过期后放回队列
+SCHEDULER_LEASE_TTL = 300  # 租约有效期（秒），0 表示不使用租约
+SCHEDULER_HEARTBEAT_INTERVAL = 30  # 心跳续约间隔（秒）
+SCHEDULER_LEASE_MAX_AGE = 1800  # 出队超过该时间仍未确认的请求不再续约
+# 确保所有爬虫通过Redis去重：基于 Redis 位图的可扩展布隆过滤器，内存占用远小于指纹集合
+DUPEFILTER_CLASS = "douban.dupefilter.BloomDupeFilter"
+BLOOM_INITIAL_CAPACITY = 1000000  # 第一层容量，写满后新建容量翻倍的下一层
+BLOOM_ERROR_RATE = 0.001  # 目标总误判率
+BLOOM_GROWTH = 2  # 每层容量增长倍数
+BLOOM_TIGHTENING = 0.5  # 每层误判率收紧系数
+DUPEFILTER_LRU_SIZE = 100000  # 本地缓存已见过的指纹数，命中时不再访问 Redis
 # 将爬取到的项目存储到Redis中
 SCRAPY_REDIS_ITEMS_KEY = "%(spider)s:items"
 
@@ -265,7 +417,9 @@ SCHEDULER_FLUSH_ON_START = False  # 不清空Redis队列
 # SCHEDULER_FLUSH_ON_START = True  # 每次启动时清空队列
 
 # 使用优先级队列
-SCHEDULER_QUEUE_CLASS = 'scrapy_redis.queue.SpiderPriorityQueue'
+SCHEDULER_QUEUE_CLASS = 'douban.scheduler.BatchPriorityQueue'
+# 紧凑序列化：队列中只保存 URL、回调、优先级和必要的 meta，请求头和 Cookie 出队后重建
+SCHEDULER_SERIALIZER = 'douban.serializers'
 
 # 仅在开发调试时启用
 DUPEFILTER_DEBUG = False
@@ -0,0 +1,102 @@
+# 按分片拆分批量写入
+#
+# 经 mongos 的无序 bulk_write 中，一批 upsert 的 book_id 落在不同分片上，mongos 要把
+# 一批拆给所有分片并等最慢的一个返回。这里在客户端缓存 config.chunks 路由表，
+# 按分片键（哈希或范围）算出每条 upsert 所在的分片，每个分片各发一个 bulk_write 并行执行。
+# mongos 仍负责最终路由，路由表过期只会让个别写入多一跳，不影响正确性。
+#
+# 哈希值与 MongoDB 的 convertShardKeyToHashed 一致：
+# md5(种子 0 + 规范类型 + 值) 的前 8 字节按小端解释为有符号 64 位整数。
+# 数值统一截断为 64 位整数后计算，1、1.0、1.9 的哈希值相同。
+
+import hashlib
+import logging
+import struct
+import time
+from bisect import bisect_right
+
+logger = logging.getLogger(__name__)
+
+# BSON 规范类型（canonicalType）
+CANONICAL_NUMBER = 10
+CANONICAL_STRING = 15
+
+
+def hashed_shard_key(value):
+    """计算字符串或数值的哈希分片键值"""
+    if isinstance(value, bool):
+        raise TypeError('不支持布尔类型的分片键')
+    if isinstance(value, float):
+        if value != value or value in (float('inf'), float('-inf')):
+            raise TypeError('不支持 NaN 或无穷大的分片键')
+        value = int(value)
+    if isinstance(value, int):
+        data = struct.pack('<iiq', 0, CANONICAL_NUMBER, value)
+    else:
+        raw = str(value).encode('utf-8') + b'\x00'
+        data = struct.pack('<ii', 0, CANONICAL_STRING) + struct.pack('<i', len(raw)) + raw
+    return struct.unpack('<q', hashlib.md5(data).digest()[:8])[0]
+
+
+class ShardRouter:
+    """缓存集合的 chunk 路由表，把分片键值映射到分片名"""
+
+    def __init__(self, client, namespace, refresh_interval=300):
+        self.client = client
+        self.namespace = namespace
+        self.refresh_interval = refresh_interval
+        self.field = None
+        self.hashed = False
+        self.bounds = []  # 第 2 个 chunk 起每个 chunk 的下界
+        self.shards = []  # 与 chunk 一一对应的分片名
+        self.loaded_at = 0
+
+    def load(self):
+        """从 config 库读取分片键和 chunk 列表，集合未分片时路由表为空"""
+        config = self.client['config']
+        collection = config['collections'].find_one({'_id': self.namespace})
+        if not collection or collection.get('dropped'):
+            self.field, self.bounds, self.shards = None, [], []
+            self.loaded_at = time.monotonic()
+            return
+
+        self.field, kind = next(iter(collection['key'].items()))
+        self.hashed = kind == 'hashed'
+        # MongoDB 5.0 起 chunk 按集合 uuid 关联，更早的版本按 ns 关联
+        query = {'uuid': collection['uuid']} if 'uuid' in collection else {'ns': self.namespace}
+        chunks = list(config['chunks'].find(query, {'min': 1, 'shard': 1}).sort('min', 1))
+        self.shards = [chunk['shard'] for chunk in chunks]
+        self.bounds = [chunk['min'][self.field] for chunk in chunks[1:]]
+        self.loaded_at = time.monotonic()
+        logger.info(f"加载 {self.namespace} 路由表: {len(chunks)} 个 chunk, "
+                    f"{len(set(self.shards))} 个分片")
+
+    def _ensure_loaded(self):
+        if not self.loaded_at or time.monotonic() - self.loaded_at > self.refresh_interval:
+            try:
+                self.load()
+            except Exception as e:
+                # 读不到路由表时不拆分，整批交给 mongos
+                logger.warning(f"读取分片路由表失败: {str(e)}")
+                self.loaded_at = time.monotonic()
+
+    def shard_for(self, key_value):
+        """返回分片键值所在的分片名，未分片或无法计算时返回 None"""
+        if not self.shards:
+            return None
+        value = hashed_shard_key(key_value) if self.hashed else key_value
+        try:
+            return self.shards[bisect_right(self.bounds, value)]
+        except TypeError:
+            # 范围分片的边界与值类型不可比较（如 MinKey）
+            return None
+
+    def partition(self, items, key=None):
+        """把 item 按分片分组，返回 {分片名: [item]}"""
+        self._ensure_loaded()
+        key = key or self.field
+        groups = {}
+        for item in items:
+            shard = self.shard_for(item.get(key)) if key else None
+            groups.setdefault(shard, []).append(item)
+        return groups
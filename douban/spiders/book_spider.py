@@ -5,7 +5,13 @@ import random
 import string
 from urllib.parse import urljoin  
 from ..items import BookItem
+from ..extractors import extract_info
+from ..debug_capture import DebugCaptureStore
+from ..freshness import FreshnessIndex
+from ..retry import RetryQueue
+from ..urls import TAG_PAGE_SIZE, tag_name, tag_list_start, tag_list_page_url
 from datetime import datetime
+from scrapy.exceptions import IgnoreRequest
 from scrapy.spidermiddlewares.httperror import HttpError
 from twisted.internet.error import DNSLookupError, TimeoutError, TCPTimedOutError
 from scrapy import signals
@@ -24,8 +30,17 @@ class BookSpider(RedisSpider):
         super(BookSpider, self).__init__(*args, **kwargs)
         # 图书详情页URL正则
         self.detail_pattern = re.compile(r'https://book.douban.com/subject/(\d+)/')
-        self.retry_count = {}
-        self.max_retries = 3
+        # 延迟重试队列（Redis），尝试次数随请求保存在 meta['retry_attempt']
+        self.retry_queue = None
+        # 调试页面采集，由 from_crawler 根据配置创建
+        self.debug_capture = None
+        # 新鲜度索引，跳过最近已抓取过的详情页
+        self.freshness = None
+        # 标签翻页：每个标签最多抓取的页数，以及已翻到底的标签（标签名 -> (首个空页的 start, 本地缓存过期时间)）
+        self.tag_max_pages = 50
+        self.tag_exhausted_ttl = 86400
+        self.tag_exhausted = {}
+        self.tag_exhausted_key = f'{self.name}:tag_exhausted'
         # 直接使用上面导入的Cookie池
         try:
             self.cookies_pool = DOUBAN_COOKIES_POOL
@@ -43,11 +58,109 @@ class BookSpider(RedisSpider):
         """注册信号"""
         spider = super(BookSpider, cls).from_crawler(crawler, *args, **kwargs)
         crawler.signals.connect(spider.spider_closed, signal=signals.spider_closed)
+        spider.debug_capture = DebugCaptureStore.from_crawler(crawler)
+        spider.freshness = FreshnessIndex.from_crawler(crawler)
+        if crawler.settings.getbool('RETRY_QUEUE_ENABLED', True):
+            spider.retry_queue = RetryQueue.from_settings(crawler.settings, spider.name, stats=crawler.stats)
+        spider.tag_max_pages = crawler.settings.getint('TAG_MAX_PAGES', 50)
+        spider.tag_exhausted_ttl = crawler.settings.getint('TAG_EXHAUSTED_TTL', 86400)
         return spider
         
     def spider_closed(self):
         # DrissionPage 中间件会处理浏览器关闭
-        pass
+        if self.debug_capture is not None:
+            self.debug_capture.close()
+
+    def capture_page(self, response, reason=None):
+        """保存调试页面（异常必采，正常页面按采样率）"""
+        if self.debug_capture is not None:
+            self.debug_capture.capture(response, reason)
+
+    def tag_exhausted_at(self, url):
+        """标签已翻到底时返回首个空页的 start，否则返回 None
+
+        结果在本地缓存一分钟，多个工作节点通过 Redis 哈希共享。哈希的每个字段保存
+        "start|过期时间戳"，各标签分别过期，不对整个哈希设置 TTL。
+        """
+        tag = tag_name(url)
+        if tag is None:
+            return None
+        now = time.time()
+        cached = self.tag_exhausted.get(tag)
+        if cached and cached[1] > now:
+            return cached[0]
+
+        start = None
+        cache_until = now + 60
+        if self.server is not None:
+            try:
+                value = self.server.hget(self.tag_exhausted_key, tag)
+                if value is not None:
+                    if isinstance(value, bytes):
+                        value = value.decode('utf-8')
+                    # 旧格式只有 start，随整个哈希的 TTL 过期
+                    start, _, expires_at = value.partition('|')
+                    start, expires_at = int(start), float(expires_at or 'inf')
+                    if expires_at <= now:
+                        start = None
+                    else:
+                        cache_until = min(cache_until, expires_at)
+            except Exception as e:
+                start = None
+                self.logger.debug(f"读取标签翻页状态失败: {str(e)}")
+        self.tag_exhausted[tag] = (start, cache_until)
+        return start
+
+    def mark_tag_exhausted(self, url):
+        """记录标签在该页已没有图书，之后更靠后的页不再抓取"""
+        tag = tag_name(url)
+        if tag is None:
+            return
+        start = tag_list_start(url)
+        current = self.tag_exhausted_at(url)
+        if current is not None and current <= start:
+            return
+        expires_at = int(time.time() + self.tag_exhausted_ttl)
+        self.tag_exhausted[tag] = (start, expires_at)
+        self.logger.info(f"标签[{tag}]在 start={start} 处已无图书，跳过之后的页")
+        if self.server is not None:
+            try:
+                # 过期时间随字段保存，不重置其他标签的记录
+                self.server.hset(self.tag_exhausted_key, tag, f'{start}|{expires_at}')
+            except Exception as e:
+                self.logger.warning(f"保存标签翻页状态失败: {str(e)}")
+
+    def total_tag_pages(self, response):
+        """从分页栏读取标签的总页数，读取不到返回 0"""
+        total = response.css('div.paginator span.thispage::attr(data-total-page)').get()
+        if total and total.isdigit():
+            return int(total)
+        numbers = [int(n) for n in response.css('div.paginator a::text').getall() if n.strip().isdigit()]
+        return max(numbers) if numbers else 0
+
+    def tag_page_request(self, url, referer, page):
+        """标签列表页的某一页"""
+        cookie = random.choice(self.cookies_pool) if self.cookies_pool else {'bid': self._generate_bid()}
+        cookie_str = '; '.join([f"{k}={v}" for k, v in cookie.items()])
+        return scrapy.Request(
+            url,
+            callback=self.parse_tag_list,
+            errback=self.errback_handler,
+            meta={
+                'tag_page': page,
+                'dont_redirect': True,
+                'handle_httpstatus_list': [302, 403, 404, 429],
+                'download_timeout': 30
+            },
+            headers={
+                'Referer': referer,
+                'User-Agent': self.get_random_ua(),
+                'Cookie': cookie_str
+            },
+            cookies=cookie,
+            # 列表页每次运行都要重新抓取，不能被持久化的去重过滤器挡掉
+            dont_filter=True
+        )
 
     def check_anti_spider(self, response):
         """检查是否被反爬"""
@@ -68,64 +181,31 @@ class BookSpider(RedisSpider):
             self.logger.error(f"检查反爬发生错误: {e}")
             return False
 
-    def handle_anti_spider(self, response):
-        """处理反爬 - 使用更多的请求头和代理策略"""
-        url = response.url
-        if url not in self.retry_count:
-            self.retry_count[url] = 0
-        
-        if self.retry_count[url] >= self.max_retries:
-            self.logger.error(f"达到最大重试次数: {url}")
+    def handle_anti_spider(self, response, reason='captcha', use_browser=True):
+        """处理反爬 - 写入延迟重试队列，按指数退避到期后由调度器放回队列
+
+        重试请求的 Cookie 和请求头在出队时由 rebuild_session 重新生成；
+        use_browser 为 True 时重试直接使用浏览器。超过最大次数的请求写入死信列表。
+        """
+        if self.retry_queue is None:
+            self.logger.warning(f"未启用重试队列，放弃重试: {response.url}")
             return None
+        meta = {'use_drissionpage': True} if use_browser else {}
+        try:
+            self.retry_queue.schedule(response.request, reason, spider=self, **meta)
+        except Exception as e:
+            self.logger.error(f"写入重试队列失败: {response.url}, 错误: {str(e)}")
+        return None
         
-        self.retry_count[url] += 1
-        
-        # 添加随机延迟
-        delay = random.uniform(5, 15)
-        self.logger.info(f"检测到反爬，等待 {delay:.2f} 秒后重试: {url}")
-        time.sleep(delay)
-        
-        # 从Cookie池中随机选择一个Cookie
+    def rebuild_session(self, request):
+        """为从调度队列恢复的请求重新生成 Cookie 和请求头（队列中不保存这些内容）"""
         cookie = random.choice(self.cookies_pool) if self.cookies_pool else {'bid': self._generate_bid()}
         cookie_str = '; '.join([f"{k}={v}" for k, v in cookie.items()])
-        
-        # 构建更丰富的请求头
-        headers = {
-            'User-Agent': self.get_random_ua(),
-            'Referer': 'https://book.douban.com/',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8',
-            'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
-            'Cache-Control': 'max-age=0',
-            'Connection': 'keep-alive',
-            'Cookie': cookie_str,
-            'Upgrade-Insecure-Requests': '1',
-            'Sec-Fetch-Dest': 'document',
-            'Sec-Fetch-Mode': 'navigate',
-            'Sec-Fetch-Site': 'same-origin',
-            'Sec-Fetch-User': '?1',
-            'Pragma': 'no-cache'
-        }
-        
-        # 随机添加一些额外的请求头
-        if random.random() > 0.5:
-            headers['DNT'] = '1'
-        
-        # 使用 DrissionPage 中间件处理
-        return scrapy.Request(
-            url,
-            callback=self.parse,
-            dont_filter=True,
-            meta={
-                'dont_redirect': True,
-                'handle_httpstatus_list': [302, 403, 404, 429],
-                'use_drissionpage': True,  # 标记使用 DrissionPage 处理
-                'download_timeout': 30,
-                'retry_count': self.retry_count[url]
-            },
-            headers=headers,
-            cookies=cookie
-        )
-        
+        request.cookies = dict(cookie)
+        request.headers.setdefault('User-Agent', self.get_random_ua())
+        request.headers.setdefault('Referer', 'https://book.douban.com/')
+        request.headers['Cookie'] = cookie_str
+
     def get_random_ua(self):
         """获取随机User-Agent"""
         user_agents = [
@@ -161,7 +241,6 @@ class BookSpider(RedisSpider):
                     'dont_redirect': True,
                     'handle_httpstatus_list': [302, 403, 404, 429],
                     'download_timeout': 30,
-                    'use_drissionpage': True,  # 标记使用 DrissionPage 处理
                 },
                 headers={
                     'User-Agent': self.get_random_ua(),
@@ -181,7 +260,6 @@ class BookSpider(RedisSpider):
                     'dont_redirect': True,
                     'handle_httpstatus_list': [302, 403, 404, 429],
                     'download_timeout': 30,
-                    'use_drissionpage': True,  # 标记使用 DrissionPage 处理
                 },
                 headers={
                     'User-Agent': self.get_random_ua(),
@@ -204,43 +282,21 @@ class BookSpider(RedisSpider):
         if len(response.body) < 1000:
             self.logger.warning(f"响应内容过小，可能被反爬: {len(response.body)} 字节")
             self.logger.info(f"Response Body: {response.text}")
+            self.capture_page(response, 'small_body')
         
         # 检查是否被反爬
         if response.status == 403:
             self.logger.warning(f"请求被拒绝(403): {response.url}")
-            # 重试请求，添加随机延迟和新的 User-Agent
-            time.sleep(random.uniform(3, 8))  # 添加随机延迟
-            
-            # 从Cookie池中随机选择一个Cookie
-            cookie = random.choice(self.cookies_pool) if self.cookies_pool else {'bid': self._generate_bid()}
-            cookie_str = '; '.join([f"{k}={v}" for k, v in cookie.items()])
-            
-            return scrapy.Request(
-                response.url,
-                callback=self.parse,
-                dont_filter=True,
-                meta={
-                    'dont_redirect': True,
-                    'handle_httpstatus_list': [302, 403, 404, 429],
-                    'download_timeout': 30
-                },
-                headers={
-                    'User-Agent': self.get_random_ua(),
-                    'Referer': 'https://book.douban.com/',
-                    'Cookie': cookie_str  # 添加Cookie
-                },
-                cookies=cookie  # 同时设置cookies字典
-            )
+            self.capture_page(response, 'http_403')
+            # 换新的 Cookie 和 User-Agent 延迟重试
+            return self.handle_anti_spider(response, reason='http_403', use_browser=False)
         
         if self.check_anti_spider(response):
             self.logger.warning(f"检测到反爬虫: {response.url}")
-            return self.handle_anti_spider(response)
+            self.capture_page(response, 'captcha')
+            return self.handle_anti_spider(response, reason='captcha')
             
         try:
-            # 保存响应内容用于调试
-            with open('debug_response.html', 'w', encoding='utf-8') as f:
-                f.write(response.text)
-                
             # 尝试多种选择器
             tags = response.css('table.tagCol td a::attr(href)').getall()
             if not tags:
@@ -252,7 +308,10 @@ class BookSpider(RedisSpider):
                 self.logger.warning(f"未找到标签列表: {response.url}")
                 self.logger.info(f"页面大小: {len(response.text)} 字节")
                 self.logger.info(f"响应状态: {response.status}")
+                self.capture_page(response, 'no_tags')
                 return
+
+            self.capture_page(response)
                 
             for tag_url in tags:
                 tag_url = response.urljoin(tag_url)
@@ -287,10 +346,6 @@ class BookSpider(RedisSpider):
         try:
             self.logger.info(f"解析图书列表页: {response.url}, 状态: {response.status}")
             
-            # 保存响应内容用于调试
-            with open('tag_list_page.html', 'w', encoding='utf-8') as f:
-                f.write(response.text)
-            
             # 提取图书详情页链接
             book_links = response.css('div.info h2 a::attr(href)').getall()
             
@@ -302,10 +357,34 @@ class BookSpider(RedisSpider):
             
             if not book_links:
                 self.logger.warning(f"未找到图书链接: {response.url}")
+                self.capture_page(response, 'no_books')
+                if response.status == 200 and not self.check_anti_spider(response):
+                    # 空页说明已翻到底，同一标签之后的页由 TagPaginationMiddleware 直接丢弃
+                    self.mark_tag_exhausted(response.url)
                 return
+
+            self.capture_page(response)
             
             self.logger.info(f"找到 {len(book_links)} 本图书")
             
+            # 跳过按重访策略仍未过期的图书
+            book_ids = {}
+            revisit = set()
+            if self.freshness is not None:
+                for link in book_links:
+                    match = self.detail_pattern.match(link)
+                    if match:
+                        book_ids[link] = match.group(1)
+                stale = self.freshness.stale(list(set(book_ids.values())))
+                # 抓取过但已过期的图书需要绕过去重过滤器重新抓取
+                revisit = {book_id for book_id in stale if book_id in self.freshness}
+                fresh_count = len(book_links)
+                book_links = [link for link in book_links
+                              if link not in book_ids or book_ids[link] in stale]
+                fresh_count -= len(book_links)
+                if fresh_count:
+                    self.logger.info(f"跳过 {fresh_count} 本近期已抓取的图书")
+            
         # 批量处理图书链接
             for link in book_links:
                 # 从Cookie池中随机选择一个Cookie
@@ -328,18 +407,33 @@ class BookSpider(RedisSpider):
                         'Cookie': cookie_str  # 添加Cookie
                     },
                     cookies=cookie,  # 同时设置cookies字典
-                    priority=1  # 设置优先级
+                    priority=1,  # 设置优先级
+                    # 详情页按 book_id 去重，同一本书从不同标签进入只抓取一次
+                    dont_filter=book_ids.get(link) in revisit
                 )
             
-            # 提取下一页链接
+            # 翻页：第一页读取总页数，一次性生成其余各页请求，由调度器分发到各节点并行抓取
+            start = tag_list_start(response.url)
+            if 'tag_page' in response.meta and start > 0:
+                return
+            total_pages = min(self.total_tag_pages(response), self.tag_max_pages) if start == 0 else 0
+            if total_pages > 1:
+                self.logger.info(f"标签共 {total_pages} 页，生成翻页请求: {response.url}")
+                for page in range(1, total_pages):
+                    yield self.tag_page_request(
+                        tag_list_page_url(response.url, page * TAG_PAGE_SIZE), response.url, page)
+                return
+
+            # 读取不到总页数时沿下一页链接顺序翻页
             next_page = response.css('span.next a::attr(href)').get()
-            if next_page:
+            if next_page and start // TAG_PAGE_SIZE + 1 < self.tag_max_pages:
                 next_url = response.urljoin(next_page)
                 self.logger.info(f"找到下一页: {next_url}")
                 yield scrapy.Request(
                     next_url, 
                     callback=self.parse_tag_list,
-                    errback=self.errback_handler
+                    errback=self.errback_handler,
+                    dont_filter=True
                 )
         except Exception as e:
             self.logger.error(f"解析列表页出错: {response.url}, 错误: {str(e)}")
@@ -350,11 +444,9 @@ class BookSpider(RedisSpider):
             # 添加响应检查
             if not response.body or len(response.body) < 1000:
                 self.logger.warning(f"响应内容异常: {response.url}")
-                # 修改：使用yield替代return，并移除return语句
-                request = self.handle_anti_spider(response)
-                if request:
-                    yield request
-                return  # 这里的return不带值，用于提前结束函数，不会导致警告
+                self.capture_page(response, 'small_body')
+                self.handle_anti_spider(response, reason='small_body')
+                return
                 
             book = BookItem()
             
@@ -393,90 +485,29 @@ class BookSpider(RedisSpider):
                 book['rating_score'] = None
                 book['rating_people'] = 0
             
-            # 提取图书信息
-            info_text = ''.join(response.css('div#info').getall()) or ''
-            
-            # 使用更精确的提取方法
-            def safe_extract(pattern, text, default=''):
-                match = re.search(pattern, text, re.DOTALL)
-                return match.group(1).strip() if match else default
-            
-            # 提取作者信息 - 优化提取逻辑
-            # 方法1: 使用更精确的CSS选择器
-            authors = []
-            # 修复：使用更准确的选择器
-            author_links = response.css('span.pl:contains("作者") + a::text, span.pl:contains("作者") ~ a::text').getall()
-            if author_links:
-                authors = [a.strip() for a in author_links if a.strip()]
-            
-            # 方法2: 如果CSS选择器失败，尝试使用正则表达式
-            if not authors:
-                author_text = safe_extract(r'作者:</span>(.*?)(?:<br|<span class="pl">)', info_text, '')
-                if author_text:
-                    # 提取所有<a>标签中的文本
-                    authors = re.findall(r'<a[^>]*>(.*?)</a>', author_text)
-                    if not authors:
-                        # 如果没有<a>标签，尝试提取纯文本
-                        authors = [re.sub(r'<[^>]+>', '', author_text).strip()]
+            # 提取图书信息：单次遍历 div#info，标签与值一一配对
+            info = {}
+            for info_node in response.css('div#info'):
+                for field, value in extract_info(info_node.root).items():
+                    info.setdefault(field, value)
             
-            # 清理作者信息
-            authors = [a.replace('\n', '').replace(' ', '').strip() for a in authors if a.strip()]
+            # 作者、译者为清理后的名字列表
+            authors = info.get('author') or []
             book['author'] = ' / '.join(authors) if authors else '未知'
-            
-            # 提取译者信息 - 优化提取逻辑
-            translators = []
-            # 修复：使用更准确的选择器
-            translator_links = response.css('span.pl:contains("译者") + a::text, span.pl:contains("译者") ~ a::text').getall()
-            if translator_links:
-                translators = [t.strip() for t in translator_links if t.strip()]
-            
-            # 如果CSS选择器失败，尝试使用正则表达式
-            if not translators:
-                translator_text = safe_extract(r'译者:</span>(.*?)(?:<br|<span class="pl">)', info_text, '')
-                if translator_text:
-                    # 提取所有<a>标签中的文本
-                    translators = re.findall(r'<a[^>]*>(.*?)</a>', translator_text)
-                    if not translators:
-                        # 如果没有<a>标签，尝试提取纯文本
-                        translators = [re.sub(r'<[^>]+>', '', translator_text).strip()]
-            
-            # 清理译者信息
-            translators = [t.replace('\n', '').replace(' ', '').strip() for t in translators if t.strip()]
-            book['translator'] = ' / '.join(translators) if translators else ''
-            
-            # 提取出版社信息 - 修复：清理HTML标签
-            publisher_raw = safe_extract(r'出版社:</span>\s*(.*?)<br', info_text, '未知')
-            book['publisher'] = re.sub(r'<[^>]+>', '', publisher_raw).strip()
-            
-            # 提取出版年信息 
-            book['publish_date'] = safe_extract(r'出版年:</span>\s*(.*?)<br', info_text, '').strip()
-            
-            # 提取页数信息 
-            book['pages'] = safe_extract(r'页数:</span>\s*(.*?)<br', info_text, '').strip()
-            
-            # 提取定价信息 
-            book['price'] = safe_extract(r'定价:</span>\s*(.*?)<br', info_text, '').strip()
-            
-            # 提取装帧信息 
-            book['binding'] = safe_extract(r'装帧:</span>\s*(.*?)<br', info_text, '').strip()
-            
-            # 提取ISBN信息 
-            book['isbn'] = safe_extract(r'ISBN:</span>\s*(.*?)(?:<br|</div>)', info_text, '').strip()
-            
-            # 提取副标题信息 
-            book['subtitle'] = safe_extract(r'副标题:</span>\s*(.*?)<br', info_text, '').strip()
-            
-            # 提取原作名信息 - 
-            book['original_title'] = safe_extract(r'原作名:</span>\s*(.*?)<br', info_text, '').strip()
-            
-            # 提取丛书信息
-            series = safe_extract(r'丛书:</span>\s*<span[^>]*>(.*?)</span>', info_text, '')
-            if not series:
-                series = safe_extract(r'丛书:</span>\s*<a[^>]*>(.*?)</a>', info_text, '')
-            book['series'] = series.strip()
+            book['translator'] = ' / '.join(info.get('translator') or [])
+            
+            book['publisher'] = info.get('publisher', '未知')
+            book['publish_date'] = info.get('publish_date', '')
+            book['pages'] = info.get('pages', '')
+            book['price'] = info.get('price', '')
+            book['binding'] = info.get('binding', '')
+            book['isbn'] = info.get('isbn', '')
+            book['subtitle'] = info.get('subtitle', '')
+            book['original_title'] = info.get('original_title', '')
+            book['series'] = info.get('series', '')
             
             # 修复标签提取 - 从JavaScript中提取标签
-            js_content = response.xpath('//script[contains(., "criteria")]').get() or ''
+            js_content = response.xpath('//script[contains(text(), "criteria")]/text()').get() or ''
             criteria_match = re.search(r'criteria\s*=\s*[\'"]([^\'"]+)[\'"]', js_content)
             if criteria_match:
                 criteria_str = criteria_match.group(1)
@@ -525,12 +556,18 @@ class BookSpider(RedisSpider):
             # 添加爬取时间
             book['crawl_time'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
             
-            self.logger.info(f"成功解析图书: {book['title']}, 作者: {book['author']}, 标签: {book.get('js_tags', [])}")
+            if book['title'] == '未知标题' or not response.css('div#info'):
+                self.capture_page(response, 'no_info')
+            else:
+                self.capture_page(response)
+            
+            self.logger.debug(f"成功解析图书: {book['title']}, 作者: {book['author']}, 标签: {book.get('js_tags', [])}")
             
             yield book
             
         except Exception as e:
             self.logger.error(f"解析详情页出错: {response.url}, 错误: {str(e)}")
+            self.capture_page(response, 'parse_error')
             # 即使出错也尝试保存基本信息
             try:
                 book = BookItem()
@@ -550,6 +587,11 @@ class BookSpider(RedisSpider):
         request = failure.request
         error_info = None
         
+        if failure.check(IgnoreRequest):
+            # 中间件主动放弃的请求（已写入重试队列或无需抓取），不记为失败
+            self.logger.debug(f'请求已放弃: {request.url}, 原因: {failure.value}')
+            return
+        
         if failure.check(HttpError):
             error_info = f'HTTP {failure.value.response.status}'
         elif failure.check(DNSLookupError):
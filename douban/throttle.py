@@ -0,0 +1,475 @@
+# 请求节流组件
+#
+# 所有等待都通过 reactor 定时器完成，不调用 time.sleep，
+# 等待期间 reactor 可以继续处理其他请求、Redis 调度和 MongoDB 写入。
+
+import hashlib
+import logging
+import threading
+import time
+from collections import deque
+from urllib.parse import urlparse
+
+from twisted.internet.task import deferLater
+
+logger = logging.getLogger(__name__)
+
+# 共享令牌桶（GCRA 形式）：键中保存下一个令牌的理论到达时间 tat（毫秒），
+# 每次领取把 tat 推后一个间隔，允许提前 burst 个间隔领取。
+# 需要等待时直接预约，返回等待毫秒数；预约超过 max_wait 时不预约，返回负的等待时间，调用方稍后重试。
+# 时间取 Redis 服务器时间，各节点时钟不一致也不影响。
+# KEYS[1] = 令牌桶键
+# ARGV = 令牌间隔(毫秒), 突发数量, 最长预约时间(毫秒)
+TOKEN_BUCKET_SCRIPT = """
+local interval = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local max_wait = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+
+local tat = tonumber(redis.call('GET', KEYS[1]) or '0')
+if tat < now then
+    tat = now
+end
+local wait = tat + interval - burst * interval - now
+if wait < 0 then
+    wait = 0
+end
+if wait > max_wait then
+    return -wait
+end
+redis.call('SET', KEYS[1], tat + interval, 'PX', tat + interval - now + burst * interval)
+return wait
+"""
+
+
+# 没有登录 Cookie、只带随机 bid 的请求共用的身份
+ANONYMOUS_IDENTITY = 'anonymous'
+
+
+def cookie_identity(cookies):
+    """Cookie 池中的一项或请求的 cookies 字典对应的身份名
+
+    依次取 user_id（Cookie 池）、dbcl2（登录 Cookie）、整串 Cookie 的哈希；
+    只有随机 bid 的请求归为同一个匿名身份，否则每个请求都是一个新槽位。
+    """
+    if not cookies:
+        return ''
+    for name in ('user_id', 'dbcl2'):
+        if cookies.get(name):
+            return str(cookies[name])
+    if cookies.get('cookie'):
+        return hashlib.md5(str(cookies['cookie']).encode('utf-8')).hexdigest()[:12]
+    if set(cookies) == {'bid'}:
+        return ANONYMOUS_IDENTITY
+    raw = '; '.join(f'{k}={v}' for k, v in sorted(cookies.items()))
+    return hashlib.md5(raw.encode('utf-8')).hexdigest()[:12]
+
+
+def request_slot(request):
+    """计算请求所属的延迟槽位：(域名, 代理, Cookie身份)"""
+    domain = urlparse(request.url).hostname or ''
+    proxy = request.meta.get('proxy') or ''
+
+    cookies = request.cookies if isinstance(request.cookies, dict) else {}
+    identity = cookie_identity(cookies)
+    if not identity:
+        cookie_header = request.headers.get('Cookie')
+        if cookie_header:
+            pairs = dict(item.strip().split('=', 1) for item in cookie_header.decode('latin-1').split(';')
+                         if '=' in item)
+            identity = cookie_identity(pairs)
+
+    return domain, proxy, identity
+
+
+class SlotDelayScheduler:
+    """按槽位的非阻塞延迟调度器
+
+    同一槽位上相邻两次放行之间至少间隔 delay 秒，不同槽位互不影响。
+    一个请求可以同时属于多个槽位（如代理和会话），放行时间取各槽位约束中最晚的，
+    并同时记入这些槽位。wait() 返回一个 Deferred，到点后才触发，等待期间不阻塞 reactor。
+    放行时间早于 idle_ttl 秒之前的槽位已不再约束后续请求，定期清理。
+    """
+
+    def __init__(self, stats=None, clock=None, idle_ttl=300):
+        self.stats = stats
+        if clock is None:
+            # 延迟导入，避免在 Scrapy 安装 TWISTED_REACTOR 之前装上默认 reactor
+            from twisted.internet import reactor as clock
+        self.clock = clock
+        self.idle_ttl = idle_ttl
+        self._last_release = {}
+        self._last_sweep = self.clock.seconds()
+
+    def __len__(self):
+        return len(self._last_release)
+
+    def wait(self, slot, delay):
+        """为槽位预约下一次放行时间，返回到点触发的 Deferred
+
+        :param delay: 与该槽位上一次放行的最小间隔
+        """
+        return self.wait_all([(slot, delay)])
+
+    def wait_all(self, delays):
+        """同时满足多个槽位的间隔，delays 为 [(槽位, 最小间隔)]"""
+        now = self.clock.seconds()
+        if now - self._last_sweep >= self.idle_ttl:
+            self._sweep(now)
+        release_at = now
+        for slot, delay in delays:
+            last = self._last_release.get(slot)
+            if last is not None:
+                release_at = max(release_at, last + delay)
+        for slot, _ in delays:
+            self._last_release[slot] = release_at
+
+        wait_time = release_at - now
+        self._inc_stat('delay/requests', 1)
+        if wait_time <= 0:
+            return deferLater(self.clock, 0, lambda: None)
+
+        self._inc_stat('delay/wait_time', wait_time)
+        return deferLater(self.clock, wait_time, self._released, release_at)
+
+    def _sweep(self, now):
+        """删除长时间没有请求的槽位（delay 不超过 idle_ttl 时已不影响下一次放行）"""
+        self._last_sweep = now
+        expired = [slot for slot, release_at in self._last_release.items() if now - release_at > self.idle_ttl]
+        for slot in expired:
+            del self._last_release[slot]
+        if expired:
+            self._inc_stat('delay/slots_evicted', len(expired))
+
+    def _released(self, release_at):
+        # 实际触发时间晚于预约时间的部分，说明 reactor 被其他同步操作阻塞了
+        lag = self.clock.seconds() - release_at
+        if lag > 0:
+            self._inc_stat('delay/blocked_time', lag)
+        return None
+
+    def _inc_stat(self, key, value):
+        if self.stats is not None:
+            self.stats.inc_value(key, value)
+
+
+class GlobalRateLimiter:
+    """跨节点共享的令牌桶限速器
+
+    所有节点从 Redis 中同一个令牌桶领取令牌，增加节点只会分摊固定的总速率，
+    不会成倍提高对目标站点的请求频率。令牌桶按域名划分，可选再按代理、Cookie身份划分。
+    acquire() 返回 Deferred，需要等待时用 reactor 定时器等待，不阻塞其他请求。
+    """
+
+    def __init__(self, server, rate, burst=1, scope=('domain',), key_prefix='throttle',
+                 max_wait=30, stats=None, clock=None):
+        if rate <= 0:
+            raise ValueError(f'GLOBAL_RATE_LIMIT 必须大于 0: {rate}')
+        self.server = server
+        self.interval_ms = max(1, int(1000 / rate))
+        self.burst = max(1, burst)
+        self.scope = tuple(scope)
+        self.key_prefix = key_prefix
+        self.max_wait_ms = int(max_wait * 1000)
+        self.stats = stats
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.clock = clock
+        self.script = server.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def bucket_key(self, slot):
+        """按 scope 从 (域名, 代理, 身份) 中取出令牌桶键"""
+        domain, proxy, identity = slot
+        parts = {'domain': domain, 'proxy': proxy, 'identity': identity}
+        return ':'.join([self.key_prefix] + [parts[name] or '-' for name in self.scope])
+
+    def acquire(self, slot):
+        """领取一个令牌，返回领到时触发的 Deferred"""
+        key = self.bucket_key(slot)
+        try:
+            wait_ms = int(self.script(keys=[key], args=[self.interval_ms, self.burst, self.max_wait_ms]))
+        except Exception as e:
+            # Redis 不可用时放行，只剩本地延迟约束
+            logger.warning(f"领取全局令牌失败，本次不限速: {str(e)}")
+            self._inc_stat('throttle/global_errors', 1)
+            return deferLater(self.clock, 0, lambda: None)
+
+        if wait_ms < 0:
+            # 令牌已被预约得太远，等一段时间后重新领取，期间不占用令牌
+            self._inc_stat('throttle/global_deferred', 1)
+            return deferLater(self.clock, self.max_wait_ms / 1000, self.acquire, slot)
+
+        self._inc_stat('throttle/global_acquired', 1)
+        if wait_ms == 0:
+            return deferLater(self.clock, 0, lambda: None)
+        self._inc_stat('throttle/global_wait_time', wait_ms / 1000)
+        return deferLater(self.clock, wait_ms / 1000, lambda: None)
+
+    def _inc_stat(self, key, value):
+        if self.stats is not None:
+            self.stats.inc_value(key, value)
+
+
+def challenge_reason(response, min_body=1000):
+    """判断响应是否为反爬挑战，返回原因（http_403、login_redirect、captcha、small_body），正常返回 None"""
+    if response.status in (403, 429):
+        return f'http_{response.status}'
+    location = response.headers.get('Location', b'') or b''
+    if 'login' in response.url or 'sec.douban.com' in response.url \
+            or b'login' in location or b'sec.douban.com' in location:
+        return 'login_redirect'
+    if response.status != 200:
+        return None
+    body = response.body
+    if '验证码'.encode('utf-8') in body or '人机验证'.encode('utf-8') in body:
+        return 'captcha'
+    if len(body) < min_body:
+        return 'small_body'
+    return None
+
+
+class AIMDController:
+    """按反爬触发率调节抓取速度的 AIMD 控制器
+
+    对每个代理、每个会话（Cookie身份）分别维护滑动窗口内的挑战率和请求间隔：
+    窗口内挑战率不高于目标值时，每个正常响应把间隔减小 delay_step（加性增速）；
+    遇到挑战时间隔除以 backoff（乘性减速），同一键在 cooldown 内只减速一次，
+    避免已发出的请求集中返回挑战时连续减速。
+    并发数同样按代理、会话分别加性增加、乘性减少。
+
+    间隔和并发都按键生效：RandomDelayMiddleware 按代理、会话分别保持各自的间隔，
+    请求需要同时满足所属两个键的间隔；limiter 按键计数，请求需要同时占用代理和会话的
+    并发名额才能发出（普通 HTTP 请求在 BlockRateMiddleware、浏览器请求在
+    DrissionPageMiddleware 中占用），多个身份共用一个代理时合计不超过该代理的上限。
+    """
+
+    def __init__(self, window=300, target_block_rate=0.02, start_delay=5, min_delay=1, max_delay=60,
+                 delay_step=0.1, backoff=0.5, cooldown=30, min_concurrency=1, max_concurrency=4,
+                 concurrency_timeout=60, stats=None, clock=None):
+        self.window = window
+        self.target_block_rate = target_block_rate
+        self.start_delay = start_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.delay_step = delay_step
+        self.backoff = backoff
+        self.cooldown = cooldown
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.concurrency_timeout = concurrency_timeout  # 等待并发名额的最长时间（秒）
+        self.stats = stats
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.clock = clock
+        self.keys = {}  # (类型, 值) -> 状态
+        # 普通 HTTP 与浏览器请求共用，同一代理、会话的并发合并计算
+        self.limiter = SlotConcurrencyLimiter()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        """同一个 crawler 上的中间件共享一个控制器"""
+        controller = getattr(crawler, 'aimd_controller', None)
+        if controller is None:
+            settings = crawler.settings
+            controller = cls(
+                window=settings.getfloat('AIMD_WINDOW', 300),
+                target_block_rate=settings.getfloat('AIMD_TARGET_BLOCK_RATE', 0.02),
+                start_delay=settings.getfloat('AIMD_START_DELAY', 5),
+                min_delay=settings.getfloat('AIMD_MIN_DELAY', 1),
+                max_delay=settings.getfloat('AIMD_MAX_DELAY', 60),
+                delay_step=settings.getfloat('AIMD_DELAY_STEP', 0.1),
+                backoff=settings.getfloat('AIMD_BACKOFF', 0.5),
+                cooldown=settings.getfloat('AIMD_COOLDOWN', 30),
+                min_concurrency=settings.getint('AIMD_MIN_CONCURRENCY', 1),
+                max_concurrency=settings.getint('AIMD_MAX_CONCURRENCY', 4),
+                concurrency_timeout=settings.getfloat('AIMD_CONCURRENCY_TIMEOUT', 60),
+                stats=crawler.stats,
+            )
+            crawler.aimd_controller = controller
+        return controller
+
+    @staticmethod
+    def slot_keys(slot):
+        _, proxy, identity = slot
+        return [('proxy', proxy or 'direct'), ('session', identity or ANONYMOUS_IDENTITY)]
+
+    def _state(self, key):
+        state = self.keys.get(key)
+        if state is None:
+            state = self.keys[key] = {'delay': self.start_delay, 'events': deque(), 'blocked': 0,
+                                      'last_cut': None, 'last_seen': self.clock.seconds(),
+                                      'concurrency': float(self.min_concurrency), 'last_concurrency_cut': None}
+        return state
+
+    def _prune(self, state, now):
+        events = state['events']
+        while events and events[0][0] < now - self.window:
+            _, blocked = events.popleft()
+            state['blocked'] -= blocked
+
+    def block_rate(self, key):
+        state = self.keys.get(key)
+        if not state or not state['events']:
+            return 0.0
+        self._prune(state, self.clock.seconds())
+        return state['blocked'] / len(state['events']) if state['events'] else 0.0
+
+    def key_delay(self, key):
+        """该代理或会话当前应保持的间隔（秒）"""
+        state = self.keys.get(key)
+        return state['delay'] if state is not None else self.start_delay
+
+    def delay(self, slot):
+        """该请求所属各键中最大的间隔（秒）"""
+        return max(self.key_delay(key) for key in self.slot_keys(slot))
+
+    @staticmethod
+    def downloader_slot(slot):
+        """普通 HTTP 请求使用的 Scrapy 下载器槽位名 (域名, 代理, 身份)
+
+        槽位并发只是上限，代理、会话的合计并发由 limiter 控制。
+        """
+        domain, proxy, identity = slot
+        return f"{domain}|{proxy or 'direct'}|{identity or ANONYMOUS_IDENTITY}"
+
+    def record(self, slot, reason=None):
+        """记录一个响应，reason 为挑战原因，正常响应为 None"""
+        now = self.clock.seconds()
+        blocked = int(reason is not None)
+        for key in self.slot_keys(slot):
+            state = self._state(key)
+            state['last_seen'] = now
+            self._prune(state, now)
+            state['events'].append((now, blocked))
+            state['blocked'] += blocked
+            if blocked:
+                if state['last_cut'] is None or now - state['last_cut'] >= self.cooldown:
+                    state['delay'] = min(self.max_delay, state['delay'] / self.backoff)
+                    state['last_cut'] = now
+                    self._inc_stat('aimd/cuts')
+            elif state['blocked'] <= self.target_block_rate * len(state['events']):
+                state['delay'] = max(self.min_delay, state['delay'] - self.delay_step)
+            self._adjust_concurrency(state, blocked, now)
+
+        if reason is not None:
+            self._inc_stat(f'aimd/challenges/{reason}')
+        self._inc_stat('aimd/responses')
+        self._evict(now)
+
+    def _adjust_concurrency(self, state, blocked, now):
+        current = state['concurrency']
+        if blocked:
+            last_cut = state['last_concurrency_cut']
+            if last_cut is None or now - last_cut >= self.cooldown:
+                current = max(self.min_concurrency, current * self.backoff)
+                state['last_concurrency_cut'] = now
+        else:
+            # 每个正常响应增加 1/并发数，相当于每轮并发请求加一
+            current = min(self.max_concurrency, current + 1 / max(current, 1))
+        state['concurrency'] = current
+
+    def key_concurrency(self, key):
+        """该代理或会话当前允许的并发数"""
+        state = self.keys.get(key)
+        value = int(state['concurrency']) if state is not None else self.min_concurrency
+        return max(self.min_concurrency, value)
+
+    def concurrency_for(self, slot):
+        """该请求所属各键中最小的并发数"""
+        return min(self.key_concurrency(key) for key in self.slot_keys(slot))
+
+    def _evict(self, now):
+        # 窗口期内没有新响应的代理、会话直接丢弃，并发数随之回到最小值
+        if len(self.keys) < 1000:
+            return
+        for key in [k for k, s in self.keys.items() if now - s['last_seen'] > self.window]:
+            del self.keys[key]
+
+    def export_stats(self):
+        """把当前状态写入 stats：各代理的间隔、挑战率和并发数，以及会话的汇总"""
+        if self.stats is None:
+            return
+        sessions = []
+        for (kind, value), state in self.keys.items():
+            if kind == 'proxy':
+                self.stats.set_value(f'aimd/proxy/{value}/delay', round(state['delay'], 3))
+                self.stats.set_value(f'aimd/proxy/{value}/block_rate', round(self.block_rate((kind, value)), 4))
+                self.stats.set_value(f'aimd/proxy/{value}/concurrency', round(state['concurrency'], 2))
+            else:
+                sessions.append(state)
+        if sessions:
+            delays = [state['delay'] for state in sessions]
+            self.stats.set_value('aimd/session/count', len(sessions))
+            self.stats.set_value('aimd/session/delay_max', round(max(delays), 3))
+            self.stats.set_value('aimd/session/delay_avg', round(sum(delays) / len(delays), 3))
+            self.stats.set_value('aimd/session/concurrency_min',
+                                 round(min(state['concurrency'] for state in sessions), 2))
+
+    def _inc_stat(self, key, value=1):
+        if self.stats is not None:
+            self.stats.inc_value(key, value)
+
+
+class SlotConcurrencyLimiter:
+    """按键限制同时进行的请求数，可在下载线程和 reactor 线程中使用
+
+    一个请求同时占用多个键（代理、会话）的名额：所有键都有空余时才一次性占用，
+    不会出现占了一个键再等另一个键的死锁。上限由调用方传入的 limit(键) 给出
+    （AIMDController.key_concurrency），每次检查时重新读取，控制器减小并发后，
+    等待中的请求不会再超出新的上限。
+    """
+
+    def __init__(self):
+        self._active = {}
+        self._condition = threading.Condition()
+
+    def active(self, key):
+        return self._active.get(key, 0)
+
+    def _take(self, keys, limit):
+        if any(self._active.get(key, 0) >= limit(key) for key in keys):
+            return False
+        for key in keys:
+            self._active[key] = self._active.get(key, 0) + 1
+        return True
+
+    def try_acquire(self, keys, limit):
+        """不等待，能同时占用全部键的名额时返回 True"""
+        with self._condition:
+            return self._take(keys, limit)
+
+    def acquire(self, keys, limit, timeout=None):
+        """在下载线程中阻塞等待全部键的名额，超时返回 False"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while not self._take(keys, limit):
+                remaining = 1 if deadline is None else deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                # 上限可能被控制器调大，定期重新检查
+                self._condition.wait(min(remaining, 1))
+            return True
+
+    def acquire_later(self, keys, limit, timeout, clock, interval=0.2):
+        """在 reactor 线程中等待全部键的名额，返回触发 True（已占用）或 False（超时）的 Deferred"""
+        deadline = clock.seconds() + timeout
+
+        def attempt():
+            if self.try_acquire(keys, limit):
+                return True
+            if clock.seconds() >= deadline:
+                return False
+            return deferLater(clock, interval, attempt)
+
+        return deferLater(clock, 0, attempt)
+
+    def release(self, keys):
+        with self._condition:
+            for key in keys:
+                count = self._active.get(key, 0) - 1
+                if count > 0:
+                    self._active[key] = count
+                else:
+                    self._active.pop(key, None)
+            self._condition.notify_all()
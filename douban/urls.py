@@ -0,0 +1,71 @@
+# 豆瓣图书 URL 工具
+#
+# 统一判断页面类型，供中间件按页面类型选择抓取策略。
+
+import re
+from urllib.parse import parse_qsl, unquote, urlencode, urlparse
+
+DETAIL_PATTERN = re.compile(r'^/subject/(\d+)/?')
+TAG_LIST_PATTERN = re.compile(r'^/tag/([^/?#]+)/?$')
+
+PAGE_DETAIL = 'detail'
+PAGE_TAG_LIST = 'tag_list'
+PAGE_TAG_INDEX = 'tag_index'
+PAGE_OTHER = 'other'
+
+# 标签列表页每页图书数，翻页参数 start 按此递增
+TAG_PAGE_SIZE = 20
+
+
+def page_type(url):
+    """根据 URL 判断页面类型：详情页、标签列表页、标签索引页或其他"""
+    path = urlparse(url).path or '/'
+    if DETAIL_PATTERN.match(path):
+        return PAGE_DETAIL
+    if path.rstrip('/') == '/tag':
+        return PAGE_TAG_INDEX
+    if TAG_LIST_PATTERN.match(path):
+        return PAGE_TAG_LIST
+    return PAGE_OTHER
+
+
+def tag_name(url):
+    """标签列表页对应的标签名，非标签列表页返回 None"""
+    match = TAG_LIST_PATTERN.match(urlparse(url).path or '/')
+    return unquote(match.group(1)) if match else None
+
+
+def tag_list_start(url):
+    """标签列表页的 start 参数"""
+    try:
+        return int(dict(parse_qsl(urlparse(url).query)).get('start', 0))
+    except ValueError:
+        return 0
+
+
+def tag_list_page_url(url, start):
+    """同一标签指定 start 的列表页 URL，保留 type 等其他参数"""
+    parsed = urlparse(url)
+    query = dict(parse_qsl(parsed.query))
+    query['start'] = str(start)
+    return parsed._replace(query=urlencode(query)).geturl()
+
+
+def canonical_key(url):
+    """去重用的规范化键
+
+    详情页只看 book_id，不同标签进入或带不同查询参数的同一本书视为同一请求；
+    标签列表页规范为 (标签, start, 排序方式)；其他页面返回 None，按完整 URL 去重。
+    """
+    parsed = urlparse(url)
+    path = parsed.path or '/'
+    match = DETAIL_PATTERN.match(path)
+    if match:
+        return f'book:{match.group(1)}'
+    tag = tag_name(url)
+    if tag is not None:
+        query = dict(parse_qsl(parsed.query))
+        return f"tag:{tag}:{tag_list_start(url)}:{query.get('type') or 'T'}"
+    if path.rstrip('/') == '/tag':
+        return 'tag_index'
+    return None
@@ -8,6 +8,7 @@ from datetime import datetime
 import pymongo
 from douban.settings import MONGO_URI, MONGO_DATABASE
 from douban.config import PROXY_POOL
+from douban.scheduler import requeue_expired_leases
 
 # 配置日志
 log_dir = os.environ.get("LOG_DIR", "./logs")  # 简化日志路径
@@ -86,6 +87,16 @@ class MasterNode:
             logger.error(f"MongoDB连接失败: {str(e)}")
             return False
 
+    def recover_leases(self):
+        """把崩溃节点过期未续约的在途请求放回队列"""
+        try:
+            recovered = requeue_expired_leases(self.redis_client)
+        except redis.RedisError as e:
+            logger.error(f"回收过期租约失败: {e}")
+            return
+        for key, count in recovered.items():
+            logger.warning(f"节点租约过期，已将 {count} 个请求放回队列: {key}")
+
     def run(self):
         """运行主控节点"""
         try:
@@ -110,6 +121,7 @@ class MasterNode:
             # 持续监控
             while True:
                 time.sleep(60)  # 每分钟检查一次
+                self.recover_leases()
                 
         except KeyboardInterrupt:
             logger.info("收到停止信号，正在关闭...")
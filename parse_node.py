@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""解析节点
+
+配合 PARSE_TIER_ENABLED=1 的工作节点使用：从 Redis Stream 批量读取原始页面，
+在多进程池中运行 BookSpider 的解析回调，item 写入正常的管道，新请求放回调度队列。
+解析节点不需要浏览器，可以部署在廉价的 CPU 节点上并独立扩容。
+"""
+import os
+import sys
+import signal
+import logging
+
+# 添加项目路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(current_dir)
+
+from scrapy.utils.project import get_project_settings
+from scrapy.utils.misc import load_object
+from scrapy.utils.reactor import install_reactor
+
+# 配置日志
+node_id = os.environ.get("NODE_ID", "parser")
+log_dir = os.environ.get("LOG_DIR", "./logs")
+os.makedirs(log_dir, exist_ok=True)
+log_file = os.path.join(log_dir, f"{node_id}.log")
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s %(levelname)s: %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S',
+    handlers=[
+        logging.FileHandler(log_file),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+
+def main():
+    settings = get_project_settings()
+    install_reactor(settings['TWISTED_REACTOR'])
+
+    from twisted.internet import reactor
+    from scrapy.crawler import Crawler
+    from douban.parse_tier import ParseService
+    from douban.spiders.book_spider import BookSpider
+
+    crawler = Crawler(BookSpider, settings)
+    spider = BookSpider.from_crawler(crawler)
+    crawler.spider = spider
+    # 复用 Scrapy 的管道管理器，管道行为与工作节点本地解析时一致
+    itemproc = load_object(settings['ITEM_PROCESSOR']).from_crawler(crawler)
+    scheduler = load_object(settings['SCHEDULER']).from_crawler(crawler)
+
+    service = ParseService(crawler, spider, itemproc, scheduler)
+
+    def shutdown(*args):
+        logger.info("解析节点正在退出...")
+        d = service.stop()
+        d.addBoth(lambda _: reactor.stop())
+
+    def on_error(failure):
+        logger.error(f"解析节点运行出错: {failure.getErrorMessage()}")
+        shutdown()
+
+    signal.signal(signal.SIGTERM, lambda *args: reactor.callFromThread(shutdown))
+    signal.signal(signal.SIGINT, lambda *args: reactor.callFromThread(shutdown))
+
+    reactor.callWhenRunning(lambda: service.run().addErrback(on_error))
+    reactor.run(installSignalHandlers=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -12,8 +12,9 @@ def print_stats():
     total = collection.count_documents({})
     print(f"\n总计爬取图书: {total} 本")
     
-    # 按评分排序
-    top_rated = collection.find().sort('rating_score', -1).limit(5)
+    # 按评分排序（使用 rating_score + rating_people 复合索引）
+    top_rated = collection.find({'rating_score': {'$ne': None}}).sort(
+        [('rating_score', -1), ('rating_people', -1)]).limit(5)
     print("\n评分最高的5本书:")
     for book in top_rated:
         print(f"{book['title']} - 评分: {book['rating_score']} ({book['rating_people']}人评价)")
@@ -24,6 +25,16 @@ def print_stats():
     for book in recent:
         print(f"{book['title']} - 爬取时间: {book['crawl_time']}")
 
+def books_published_between(start_year, end_year, limit=10):
+    """按出版年范围查询，按评分排序（使用 publish_date + rating_score 复合索引）"""
+    query = {'publish_date': {'$gte': datetime(start_year, 1, 1), '$lt': datetime(end_year + 1, 1, 1)}}
+    results = collection.find(query).sort([('publish_date', -1), ('rating_score', -1)]).limit(limit)
+    print(f"\n{start_year}-{end_year} 年出版的图书:")
+    for book in results:
+        price = book.get('price') if isinstance(book.get('price'), dict) else {}
+        print(f"{book['title']} - 出版: {book['publish_date']:%Y-%m}, 评分: {book['rating_score']}, "
+              f"定价: {price.get('amount')} {price.get('currency', '')}")
+
 def search_book(keyword):
     """搜索图书"""
     query = {'title': {'$regex': keyword, '$options': 'i'}}
@@ -34,6 +45,8 @@ def search_book(keyword):
         print(f"作者: {book['author']}")
         print(f"评分: {book['rating_score']} ({book['rating_people']}人评价)")
         print(f"标签: {', '.join(book['js_tags'])}")
+        if isinstance(book.get('price'), dict):
+            print(f"定价: {book['price']['amount']} {book['price']['currency']}")
 
 if __name__ == '__main__':
     print_stats()
@@ -41,4 +54,13 @@ if __name__ == '__main__':
     # 搜索示例
     keyword = input("\n请输入要搜索的书名关键词(直接回车跳过): ")
     if keyword:
-        search_book(keyword)
\ No newline at end of file
+        search_book(keyword)
+
+    # 按出版年范围查询示例
+    years = input("\n请输入出版年范围，如 2015-2020(直接回车跳过): ").strip()
+    if years:
+        start, _, end = years.partition('-')
+        try:
+            books_published_between(int(start), int(end or start))
+        except ValueError:
+            print("出版年范围格式不正确")
\ No newline at end of file
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""去重过滤器基准
+
+在本地 redis-server 上对比 scrapy_redis 的集合去重 (RFPDupeFilter) 与
+douban.dupefilter.BloomDupeFilter：写入耗时、Redis 内存占用和实测误判率。
+
+用法：
+    python scripts/bench_dupefilter.py [-n 写入数量] [--probe 探测数量] [--redis-url redis://127.0.0.1:6379/15]
+
+参考结果（默认参数，本机 redis-server 6.2，单核）：
+
+                     写入耗时      内存        实测误判率
+    RFPDupeFilter    109.8 us/个   21.07MB    0
+    BloomDupeFilter  160.0 us/个    0.79MB    0.000620（2 层，估计 0.000520）
+
+布隆过滤器写入时把 58 个新请求误判为重复（0.029%）。
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import redis
+from scrapy import Request
+from scrapy_redis.dupefilter import RFPDupeFilter
+
+from douban.dupefilter import BloomDupeFilter
+
+
+def memory_usage(server, keys):
+    return sum(server.memory_usage(key) or 0 for key in keys if server.exists(key))
+
+
+def bench(name, df, keys, seen_requests, probe_requests):
+    start = time.perf_counter()
+    duplicates = sum(df.request_seen(r) for r in seen_requests)
+    elapsed = time.perf_counter() - start
+
+    # 探测从未写入过的请求，被判为重复的比例即误判率
+    false_positives = sum(df.request_seen(r) for r in probe_requests)
+    memory = memory_usage(df.server, keys())
+    print(f'{name}:')
+    print(f'  写入 {len(seen_requests)} 个: {elapsed:.2f}s, {elapsed * 1e6 / len(seen_requests):.1f} us/个')
+    print(f'  写入时误判为重复: {duplicates}')
+    print(f'  内存: {memory / 1024 / 1024:.2f}MB ({memory / len(seen_requests):.1f} 字节/个)')
+    print(f'  实测误判率: {false_positives / len(probe_requests):.6f}')
+    return memory
+
+
+def main():
+    parser = argparse.ArgumentParser(description='去重过滤器基准')
+    parser.add_argument('-n', type=int, default=200000, help='写入数量')
+    parser.add_argument('--probe', type=int, default=50000, help='误判率探测数量')
+    parser.add_argument('--redis-url', default='redis://127.0.0.1:6379/15', help='使用独立的数据库')
+    parser.add_argument('--capacity', type=int, default=100000, help='布隆过滤器初始容量')
+    parser.add_argument('--error-rate', type=float, default=0.001, help='布隆过滤器目标误判率')
+    args = parser.parse_args()
+
+    server = redis.Redis.from_url(args.redis_url)
+    seen_requests = [Request(f'https://book.douban.com/subject/{i}/') for i in range(args.n)]
+    probe_requests = [Request(f'https://book.douban.com/subject/{i}/')
+                      for i in range(args.n, args.n + args.probe)]
+
+    set_df = RFPDupeFilter(server, 'bench:dupefilter')
+    bloom_df = BloomDupeFilter(server, 'bench:dupefilter:bloom', capacity=args.capacity,
+                               error_rate=args.error_rate)
+    set_df.clear()
+    bloom_df.clear()
+    try:
+        set_memory = bench('集合 (RFPDupeFilter)', set_df, lambda: ['bench:dupefilter'],
+                           seen_requests, probe_requests)
+        bloom_memory = bench(
+            '布隆过滤器 (BloomDupeFilter)', bloom_df,
+            lambda: ['bench:dupefilter:bloom:meta'] + [f'bench:dupefilter:bloom:{i}'
+                                                       for i in range(len(bloom_df.layers()))],
+            seen_requests, probe_requests)
+        report = bloom_df.report()
+        print(f'布隆过滤器层数: {len(report["layers"])}, 估计误判率: {report["fpr"]:.6f}')
+        print(f'内存节省: {set_memory / max(bloom_memory, 1):.1f}x')
+    finally:
+        set_df.clear()
+        bloom_df.clear()
+
+
+if __name__ == '__main__':
+    main()
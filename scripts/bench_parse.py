@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+"""详情页 div#info 解析基准
+
+对比旧的正则 + :contains() 选择器实现与 douban.extractors.extract_info 的
+耗时（毫秒/页）和输出是否一致。
+
+用法：
+    python scripts/bench_parse.py [保存的详情页.html 或目录 ...] [-n 重复次数]
+
+不指定文件时使用 tests/fixtures/detail 中的详情页。
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scrapy.http import HtmlResponse
+
+from douban.extractors import extract_info
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           'tests', 'fixtures', 'detail')
+
+FIELDS = ['author', 'translator', 'publisher', 'publish_date', 'pages', 'price',
+          'binding', 'isbn', 'subtitle', 'original_title', 'series']
+
+
+def legacy_extract(response):
+    """旧版 BookSpider.parse_detail 中 #info 部分的提取逻辑（原样保留，用于对照）"""
+    book = {}
+    info_text = ''.join(response.css('div#info').getall()) or ''
+
+    def safe_extract(pattern, text, default=''):
+        match = re.search(pattern, text, re.DOTALL)
+        return match.group(1).strip() if match else default
+
+    authors = []
+    author_links = response.css('span.pl:contains("作者") + a::text, span.pl:contains("作者") ~ a::text').getall()
+    if author_links:
+        authors = [a.strip() for a in author_links if a.strip()]
+    if not authors:
+        author_text = safe_extract(r'作者:</span>(.*?)(?:<br|<span class="pl">)', info_text, '')
+        if author_text:
+            authors = re.findall(r'<a[^>]*>(.*?)</a>', author_text)
+            if not authors:
+                authors = [re.sub(r'<[^>]+>', '', author_text).strip()]
+    authors = [a.replace('\n', '').replace(' ', '').strip() for a in authors if a.strip()]
+    book['author'] = ' / '.join(authors) if authors else '未知'
+
+    translators = []
+    translator_links = response.css('span.pl:contains("译者") + a::text, span.pl:contains("译者") ~ a::text').getall()
+    if translator_links:
+        translators = [t.strip() for t in translator_links if t.strip()]
+    if not translators:
+        translator_text = safe_extract(r'译者:</span>(.*?)(?:<br|<span class="pl">)', info_text, '')
+        if translator_text:
+            translators = re.findall(r'<a[^>]*>(.*?)</a>', translator_text)
+            if not translators:
+                translators = [re.sub(r'<[^>]+>', '', translator_text).strip()]
+    translators = [t.replace('\n', '').replace(' ', '').strip() for t in translators if t.strip()]
+    book['translator'] = ' / '.join(translators) if translators else ''
+
+    publisher_raw = safe_extract(r'出版社:</span>\s*(.*?)<br', info_text, '未知')
+    book['publisher'] = re.sub(r'<[^>]+>', '', publisher_raw).strip()
+    book['publish_date'] = safe_extract(r'出版年:</span>\s*(.*?)<br', info_text, '').strip()
+    book['pages'] = safe_extract(r'页数:</span>\s*(.*?)<br', info_text, '').strip()
+    book['price'] = safe_extract(r'定价:</span>\s*(.*?)<br', info_text, '').strip()
+    book['binding'] = safe_extract(r'装帧:</span>\s*(.*?)<br', info_text, '').strip()
+    book['isbn'] = safe_extract(r'ISBN:</span>\s*(.*?)(?:<br|</div>)', info_text, '').strip()
+    book['subtitle'] = safe_extract(r'副标题:</span>\s*(.*?)<br', info_text, '').strip()
+    book['original_title'] = safe_extract(r'原作名:</span>\s*(.*?)<br', info_text, '').strip()
+    series = safe_extract(r'丛书:</span>\s*<span[^>]*>(.*?)</span>', info_text, '')
+    if not series:
+        series = safe_extract(r'丛书:</span>\s*<a[^>]*>(.*?)</a>', info_text, '')
+    book['series'] = series.strip()
+    return book
+
+
+def current_extract(response):
+    """与 BookSpider.parse_detail 相同的单次遍历提取"""
+    info = {}
+    for node in response.css('div#info'):
+        for field, value in extract_info(node.root).items():
+            info.setdefault(field, value)
+    return {
+        'author': ' / '.join(info.get('author') or []) or '未知',
+        'translator': ' / '.join(info.get('translator') or []),
+        'publisher': info.get('publisher', '未知'),
+        'publish_date': info.get('publish_date', ''),
+        'pages': info.get('pages', ''),
+        'price': info.get('price', ''),
+        'binding': info.get('binding', ''),
+        'isbn': info.get('isbn', ''),
+        'subtitle': info.get('subtitle', ''),
+        'original_title': info.get('original_title', ''),
+        'series': info.get('series', ''),
+    }
+
+
+def load_pages(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                         if name.endswith('.html'))
+        else:
+            files.append(path)
+    pages = []
+    for i, path in enumerate(files):
+        with open(path, 'rb') as f:
+            pages.append((path, f.read()))
+    return pages
+
+
+def bench(func, pages, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for i, (_, body) in enumerate(pages):
+            # 每次都新建 Response，避免 parsel 缓存的选择器影响计时
+            response = HtmlResponse(url=f'https://book.douban.com/subject/{i + 1}/',
+                                    body=body, encoding='utf-8')
+            func(response)
+    return (time.perf_counter() - start) * 1000 / (repeat * len(pages))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='详情页 #info 解析基准')
+    parser.add_argument('paths', nargs='*', default=[FIXTURE_DIR], help='保存的详情页 HTML 文件或目录')
+    parser.add_argument('-n', '--repeat', type=int, default=50, help='重复次数')
+    args = parser.parse_args()
+
+    pages = load_pages(args.paths)
+    if not pages:
+        print('没有找到详情页文件')
+        return 1
+
+    mismatches = 0
+    for i, (path, body) in enumerate(pages):
+        response = HtmlResponse(url=f'https://book.douban.com/subject/{i + 1}/',
+                                body=body, encoding='utf-8')
+        old, new = legacy_extract(response), current_extract(response)
+        for field in FIELDS:
+            if old[field] != new[field]:
+                mismatches += 1
+                print(f'{path} {field}: 旧 {old[field]!r} / 新 {new[field]!r}')
+
+    legacy_ms = bench(legacy_extract, pages, args.repeat)
+    current_ms = bench(current_extract, pages, args.repeat)
+    print(f'页面数: {len(pages)}, 重复: {args.repeat}')
+    print(f'旧实现: {legacy_ms:.3f} ms/页')
+    print(f'新实现: {current_ms:.3f} ms/页 ({legacy_ms / current_ms:.1f}x)')
+    print(f'不一致字段: {mismatches}')
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
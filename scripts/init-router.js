@@ -7,11 +7,27 @@ sh.addShard("shardrs/mongodb-shard:27018");
 // 启用数据库分片
 sh.enableSharding("douban");
 
-// 创建索引
+// 创建索引（哈希分片键下，唯一约束建在非哈希的 book_id 上）
 db = db.getSiblingDB('douban');
 db.books.createIndex({ book_id: 1 }, { unique: true });
+db.books.createIndex({ book_id: "hashed" });
 
-// 对集合进行分片
-sh.shardCollection("douban.books", { book_id: 1 });
+// 按 book_id 哈希分片：连续的 ID 分散到各个 chunk，写入不再集中在当前 ID 区间所在的 chunk
+// 预先为每个分片切分 NUM_CHUNKS_PER_SHARD 个 chunk，空集合一开始就均匀分布
+const NUM_CHUNKS_PER_SHARD = 4;
+const numShards = db.getSiblingDB('config').shards.countDocuments({});
+const existing = db.getSiblingDB('config').collections.findOne({ _id: "douban.books" });
 
-print("MongoDB 路由器初始化完成");
\ No newline at end of file
+if (!existing || existing.dropped) {
+  sh.shardCollection("douban.books", { book_id: "hashed" }, false,
+                     { numInitialChunks: NUM_CHUNKS_PER_SHARD * Math.max(numShards, 1) });
+} else if (existing.key.book_id !== "hashed") {
+  // 已按范围分片的旧集合在线重新分片（MongoDB 5.0+）
+  db.adminCommand({
+    reshardCollection: "douban.books",
+    key: { book_id: "hashed" },
+    numInitialChunks: NUM_CHUNKS_PER_SHARD * Math.max(numShards, 1)
+  });
+}
+
+print("MongoDB 路由器初始化完成");
@@ -0,0 +1,24 @@
+import os
+
+import pytest
+
+
+@pytest.fixture
+def redis_server():
+    """每个测试独立的 Redis
+
+    默认用 fakeredis 的内存 Redis（Lua 脚本由 lupa 执行）；设置 TEST_REDIS_URL 时改用
+    真实的 redis-server，测试前后清空该数据库。
+    """
+    url = os.environ.get('TEST_REDIS_URL')
+    if url:
+        import redis
+
+        server = redis.Redis.from_url(url)
+        server.flushdb()
+        yield server
+        server.flushdb()
+        return
+    fakeredis = pytest.importorskip('fakeredis')
+    pytest.importorskip('lupa')
+    yield fakeredis.FakeRedis(server=fakeredis.FakeServer())
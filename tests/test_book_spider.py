@@ -0,0 +1,45 @@
+import time
+
+from douban.spiders.book_spider import BookSpider
+
+TAG_URL = 'https://book.douban.com/tag/小说'
+
+
+def make_spider(server, ttl=3600):
+    spider = BookSpider()
+    spider.server = server
+    spider.tag_exhausted_ttl = ttl
+    return spider
+
+
+def page(start):
+    return f'{TAG_URL}?start={start}&type=T'
+
+
+def test_tag_exhausted_is_shared_between_nodes(redis_server):
+    first, second = make_spider(redis_server), make_spider(redis_server)
+    assert second.tag_exhausted_at(page(0)) is None
+    second.tag_exhausted.clear()
+
+    first.mark_tag_exhausted(page(980))
+    assert second.tag_exhausted_at(page(1000)) == 980
+    # 更靠前的空页覆盖记录
+    first.mark_tag_exhausted(page(500))
+    second.tag_exhausted.clear()
+    assert second.tag_exhausted_at(page(1000)) == 500
+
+
+def test_tag_exhausted_expires_per_tag(redis_server):
+    spider = make_spider(redis_server)
+    spider.mark_tag_exhausted(page(980))
+    key = spider.tag_exhausted_key
+    # 标记其他标签不会延长或重置已有记录，也不设置整个哈希的 TTL
+    assert redis_server.ttl(key) == -1
+    expired = f'980|{int(time.time()) - 1}'
+    redis_server.hset(key, '小说', expired)
+    spider.mark_tag_exhausted('https://book.douban.com/tag/历史?start=40&type=T')
+    assert redis_server.hget(key, '小说') == expired.encode()
+
+    reader = make_spider(redis_server)
+    assert reader.tag_exhausted_at(page(1000)) is None
+    assert reader.tag_exhausted_at('https://book.douban.com/tag/历史?start=60&type=T') == 40
@@ -0,0 +1,83 @@
+import math
+
+from scrapy import Request
+
+from douban.dupefilter import BloomDupeFilter, fingerprint_hashes
+
+
+def detail(book_id, query=''):
+    return Request(f'https://book.douban.com/subject/{book_id}/{query}')
+
+
+def make_filter(server, **kwargs):
+    # lru_size=0 关闭本地缓存，每次都经过 Lua 脚本
+    kwargs.setdefault('lru_size', 0)
+    return BloomDupeFilter(server, 'test:dupefilter:bloom', **kwargs)
+
+
+def test_fingerprint_hashes_step_is_odd():
+    h1, h2 = fingerprint_hashes('00000000' + '00000002' + '0' * 24)
+    assert (h1, h2) == (0, 3)
+
+
+def test_seen_after_first_add(redis_server):
+    df = make_filter(redis_server, capacity=1000)
+    assert not df.request_seen(detail(1))
+    assert df.request_seen(detail(1))
+    # 同一本书的不同 URL 规范化为同一个键
+    assert df.request_seen(detail(1, '?from=tag_all'))
+    assert not df.request_seen(detail(2))
+
+
+def test_state_is_shared_between_instances(redis_server):
+    make_filter(redis_server, capacity=1000).request_seen(detail(1))
+    assert make_filter(redis_server, capacity=1000).request_seen(detail(1))
+
+
+def test_lru_answers_repeats_without_redis(redis_server):
+    df = make_filter(redis_server, capacity=1000, lru_size=10)
+    df.request_seen(detail(1))
+    redis_server.flushall()
+    assert df.request_seen(detail(1))
+
+
+def test_new_layer_when_full(redis_server):
+    df = make_filter(redis_server, capacity=100, error_rate=0.01, growth=2, tightening=0.5)
+    for i in range(250):
+        df.request_seen(detail(i))
+
+    layers = df.layers()
+    assert [layer['capacity'] for layer in layers] == [100, 200]
+    assert layers[0]['count'] == 100
+    # 写入时的误判不计数
+    assert 140 <= layers[1]['count'] <= 150
+
+    ln2 = math.log(2)
+    for i, layer in enumerate(layers):
+        error_rate = 0.01 * 0.5 * 0.5 ** i
+        m = math.ceil(-layer['capacity'] * math.log(error_rate) / ln2 ** 2)
+        assert layer['m'] == m
+        assert layer['k'] == math.ceil(m / layer['capacity'] * ln2)
+    for i in range(250):
+        assert df.request_seen(detail(i))
+
+
+def test_false_positive_rate_stays_under_target(redis_server):
+    df = make_filter(redis_server, capacity=300, error_rate=0.01)
+    for i in range(1000):
+        df.request_seen(detail(i))
+    probes = 2000
+    false_positives = sum(df.request_seen(detail(i)) for i in range(10 ** 6, 10 ** 6 + probes))
+    # 2000 次探测的抽样误差约 0.002，实测值留出余量
+    assert false_positives / probes < 0.015
+    assert df.report()['fpr'] < 0.01
+
+
+def test_clear_removes_all_layers(redis_server):
+    df = make_filter(redis_server, capacity=10)
+    for i in range(30):
+        df.request_seen(detail(i))
+    assert len(df.layers()) > 1
+    df.clear()
+    assert redis_server.keys('test:dupefilter:bloom*') == []
+    assert not df.request_seen(detail(1))
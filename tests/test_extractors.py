@@ -0,0 +1,105 @@
+import os
+
+import pytest
+from scrapy.http import HtmlResponse
+
+from douban.extractors import extract_info
+from scripts.bench_parse import FIELDS, current_extract, legacy_extract, load_pages
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), 'fixtures', 'detail')
+
+EXPECTED = {
+    '6082808': {
+        'author': ['[哥伦比亚]加西亚·马尔克斯'],
+        'translator': ['范晔'],
+        'publisher': '南海出版公司',
+        'original_title': 'Cien años de soledad',
+        'publish_date': '2011-6',
+        'pages': '360',
+        'price': '39.50元',
+        'binding': '精装',
+        'series': '新经典文库：加西亚·马尔克斯作品',
+        'isbn': '9787544253994',
+    },
+    '4913064': {
+        'author': ['余华'],
+        'publisher': '作家出版社',
+        'publish_date': '2012-8-1',
+        'pages': '191',
+        'price': '20.00元',
+        'binding': '平装',
+        'series': '余华作品（2012版）',
+        'isbn': '9787506365437',
+    },
+    '1770782': {
+        'author': ['[美]卡勒德·胡赛尼'],
+        'translator': ['李继宏'],
+        'publisher': '上海人民出版社',
+        'original_title': 'The Kite Runner',
+        'publish_date': '2006-5',
+        'pages': '362',
+        'price': '29.00元',
+        'binding': '平装',
+        'isbn': '9787208061644',
+    },
+    '26340138': {
+        'author': ['[美]伊恩·古德费洛', '[加]约书亚·本吉奥', '[加]亚伦·库维尔'],
+        'translator': ['赵申剑', '黎彧君', '符天凡', '李凯'],
+        'publisher': '人民邮电出版社',
+        'subtitle': '英文版',
+        'original_title': 'Deep Learning: Adaptive Computation & Machine Learning',
+        'publish_date': '2017-8-1',
+        'pages': '500',
+        'price': 'CNY 168.00',
+        'binding': '平装',
+        'series': '图灵程序设计丛书',
+        'isbn': '9787115461476',
+    },
+}
+
+# 旧实现的正则把标记原样带进了结果，新实现输出纯文本
+LEGACY_MARKUP_LEAKS = {
+    ('26340138', 'original_title'): 'Deep Learning: Adaptive Computation &amp; Machine Learning',
+    ('26340138', 'series'): '<a href="https://book.douban.com/series/37373">图灵程序设计丛书</a>',
+}
+
+
+def load_response(book_id):
+    with open(os.path.join(FIXTURE_DIR, f'{book_id}.html'), 'rb') as f:
+        body = f.read()
+    return HtmlResponse(url=f'https://book.douban.com/subject/{book_id}/', body=body, encoding='utf-8')
+
+
+@pytest.mark.parametrize('book_id', sorted(EXPECTED))
+def test_extract_info(book_id):
+    response = load_response(book_id)
+    assert extract_info(response.css('div#info')[0].root) == EXPECTED[book_id]
+
+
+def test_fixture_corpus_is_complete():
+    names = {os.path.splitext(os.path.basename(path))[0] for path, _ in load_pages([FIXTURE_DIR])}
+    assert names == set(EXPECTED)
+
+
+@pytest.mark.parametrize('book_id', sorted(EXPECTED))
+def test_matches_legacy_extraction(book_id):
+    response = load_response(book_id)
+    old, new = legacy_extract(response), current_extract(response)
+    for field in FIELDS:
+        assert old[field] == LEGACY_MARKUP_LEAKS.get((book_id, field), new[field]), field
+
+
+def test_missing_fields_use_spider_defaults():
+    response = HtmlResponse(url='https://book.douban.com/subject/1/', encoding='utf-8',
+                            body='<div id="info"><span class="pl">ISBN:</span> 9787000000000</div>'.encode())
+    book = current_extract(response)
+    assert book['isbn'] == '9787000000000'
+    assert book['author'] == '未知'
+    assert book['publisher'] == '未知'
+    assert book['translator'] == ''
+
+
+def test_plain_text_author_without_link():
+    response = HtmlResponse(url='https://book.douban.com/subject/1/', encoding='utf-8',
+                            body='<div id="info"><span class="pl">作者:</span> 佚 名<br/></div>'.encode())
+    assert extract_info(response.css('div#info')[0].root) == {'author': ['佚名']}
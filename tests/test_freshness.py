@@ -0,0 +1,26 @@
+import time
+
+from douban.freshness import FreshnessIndex
+
+KEY = 'test:freshness'
+
+
+def test_stale_without_load_only_queries_requested_books(redis_server, monkeypatch):
+    now = int(time.time())
+    redis_server.hset(KEY, mapping={
+        '1': f'{now},50000,abc,{now}',
+        '2': f'{now - 90 * 86400},50000,abc,{now - 90 * 86400}',
+        '3': f'{now},10,abc,{now}',
+    })
+    index = FreshnessIndex(redis_server, key=KEY)
+
+    # 解析进程收不到 spider_opened，不能每个进程都全量 HSCAN
+    def no_scan(*args, **kwargs):
+        raise AssertionError('stale() must not scan the whole index')
+    monkeypatch.setattr(redis_server, 'hscan_iter', no_scan)
+
+    assert index.stale(['1', '2', '4']) == {'2', '4'}
+    assert not index.loaded
+    assert len(index) == 2
+    # 查到过的图书留在本地，抓取过但已过期的才需要绕过去重
+    assert '2' in index and '4' not in index
@@ -0,0 +1,115 @@
+import copy
+from datetime import datetime
+
+import pytest
+
+from douban.normalize import (INDEXES, ensure_indexes, normalize_batch, normalize_item, parse_pages,
+                              parse_price, parse_publish_date, parse_rating)
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('59.00元', (59.0, 'CNY')),
+    ('CNY 168.00', (168.0, 'CNY')),
+    ('¥ 45', (45.0, 'CNY')),
+    ('1,280.00元', (1280.0, 'CNY')),
+    ('USD 24.95', (24.95, 'USD')),
+    ('$24.95', (24.95, 'USD')),
+    ('NT$ 350', (350.0, 'TWD')),
+    ('HK$120', (120.0, 'HKD')),
+    ('2000円', (2000.0, 'JPY')),
+    ('12,50 €', (12.5, 'EUR')),
+    ('1.234,00 €', (1234.0, 'EUR')),
+    ('1.234.567円', (1234567.0, 'JPY')),
+    ('港元120', (120.0, 'HKD')),
+    ('澳门元 98', (98.0, 'MOP')),
+    ('澳元 29.99', (29.99, 'AUD')),
+    ('39.5', (39.5, 'CNY')),
+])
+def test_parse_price(text, expected):
+    amount, currency = expected
+    assert parse_price(text) == {'amount': amount, 'currency': currency}
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('2019-5', datetime(2019, 5, 1)),
+    ('2019年5月', datetime(2019, 5, 1)),
+    ('2019/05/01', datetime(2019, 5, 1)),
+    ('2017-8-1', datetime(2017, 8, 1)),
+    ('2019', datetime(2019, 1, 1)),
+    # 月或日超出范围时只保留能确定的部分
+    ('2019-2-30', datetime(2019, 2, 1)),
+    ('2019-13', datetime(2019, 1, 1)),
+    ('二〇一九', None),
+    # 年份超出 datetime 的范围
+    ('0000', None),
+    ('0000-5', None),
+])
+def test_parse_publish_date(text, expected):
+    assert parse_publish_date(text) == expected
+
+
+def test_parse_numbers():
+    assert parse_pages('320') == 320
+    assert parse_pages('320页') == 320
+    assert parse_pages('约 300 页') == 300
+    assert parse_pages('未知') is None
+    assert parse_rating(' 8.9 ') == 8.9
+    assert parse_rating('') is None
+    assert parse_price('免费') is None
+
+
+def test_normalize_item_keeps_raw_text():
+    item = {
+        'book_id': '6082808',
+        'rating_score': '9.3',
+        'pages': '360',
+        'price': '39.50元',
+        'publish_date': '2011-6',
+        'crawl_time': '2024-03-01 12:30:00',
+        'title': '百年孤独',
+    }
+    normalize_item(item)
+    assert item == {
+        'book_id': '6082808',
+        'rating_score': 9.3,
+        'pages': 360,
+        'price': {'amount': 39.5, 'currency': 'CNY'},
+        'publish_date': datetime(2011, 6, 1),
+        'crawl_time': datetime(2024, 3, 1, 12, 30),
+        'title': '百年孤独',
+        'raw': {'rating_score': '9.3', 'pages': '360', 'price': '39.50元', 'publish_date': '2011-6'},
+    }
+
+
+def test_normalize_item_is_idempotent():
+    item = normalize_item({'rating_score': '8.8', 'pages': '500', 'price': 'CNY 168.00',
+                           'publish_date': '2017-8-1', 'last_seen': '2024-03-01 12:30:00'})
+    again = normalize_item(copy.deepcopy(item))
+    assert again == item
+
+
+def test_blank_and_unparseable_values_become_none():
+    item = normalize_item({'rating_score': '', 'pages': '未知', 'price': ' ', 'crawl_time': 'yesterday'})
+    assert item['rating_score'] is None
+    assert item['pages'] is None
+    assert item['price'] is None
+    assert item['crawl_time'] is None
+    assert item['raw'] == {'rating_score': '', 'pages': '未知', 'price': ' '}
+
+
+def test_normalize_batch_and_missing_fields():
+    batch = [{'book_id': '1'}, {'book_id': '2', 'pages': '10'}]
+    assert normalize_batch(batch) is batch
+    assert batch == [{'book_id': '1'}, {'book_id': '2', 'pages': 10, 'raw': {'pages': '10'}}]
+
+
+def test_ensure_indexes():
+    created = []
+
+    class FakeCollection:
+        def create_index(self, keys, **options):
+            created.append((keys, options))
+
+    ensure_indexes(FakeCollection())
+    assert [keys for keys, _ in created] == [keys for keys, _ in INDEXES]
+    assert all(options.get('background') for _, options in created)
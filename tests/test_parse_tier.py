@@ -0,0 +1,93 @@
+import pytest
+from scrapy import Request, Spider
+from scrapy.http import HtmlResponse
+
+from douban import parse_tier
+from douban.parse_tier import ParseService, decode_page, encode_page, parse_page
+
+
+class DetailSpider(Spider):
+    name = 'test'
+
+    def parse_detail(self, response):
+        yield {'url': response.url, 'book_id': response.meta['book_id']}
+        yield Request('https://book.douban.com/subject/2/', callback=self.parse_detail)
+
+
+@pytest.fixture
+def worker_spider(monkeypatch):
+    monkeypatch.setattr(parse_tier, '_worker_spider', DetailSpider())
+
+
+def make_fields(url='https://book.douban.com/subject/1/', body=b'<html></html>'):
+    request = Request(url, meta={'book_id': '1', 'download_slot': 'book.douban.com', 'proxy': 'http://p'})
+    response = HtmlResponse(url=url, body=body, encoding='utf-8', request=request)
+    return {key.encode(): value.encode() if isinstance(value, str) else value
+            for key, value in encode_page(response, 'parse_detail').items()}
+
+
+def test_encode_decode_round_trip():
+    callback, response = decode_page(make_fields(body='<p>活着</p>'.encode()))
+    assert callback == 'parse_detail'
+    assert response.text == '<p>活着</p>'
+    # 下载过程内部使用的 meta 不随页面传递
+    assert response.meta == {'book_id': '1'}
+
+
+def test_parse_page_runs_callback(worker_spider):
+    outputs = parse_page(make_fields())
+    assert outputs[0] == ('item', {'url': 'https://book.douban.com/subject/1/', 'book_id': '1'})
+    assert outputs[1][0] == 'request'
+    assert outputs[1][1]['callback'] == 'parse_detail'
+
+
+def test_parse_page_returns_error_instead_of_raising(worker_spider):
+    fields = make_fields()
+    fields[b'body'] = b'not zlib'
+    assert parse_page(fields)[0][0] == 'error'
+
+    fields = make_fields()
+    fields[b'callback'] = b'parse_missing'
+    kind, message = parse_page(fields)[0]
+    assert kind == 'error' and 'AttributeError' in message
+
+
+def make_service(server, max_deliveries=3):
+    service = ParseService.__new__(ParseService)
+    service.server = server
+    service.stream = 'book:raw_pages'
+    service.group = 'parsers'
+    service.max_deliveries = max_deliveries
+    service.dead_stream = 'book:raw_pages:dead'
+    service.dead_maxlen = 100
+    server.xgroup_create(service.stream, service.group, id='0', mkstream=True)
+    return service
+
+
+def deliver(service):
+    entries = service.server.xreadgroup(service.group, 'c1', {service.stream: '>'}, count=10)
+    if entries:
+        return entries[0][1]
+    # 重新投递仍未确认的消息
+    return service.server.xautoclaim(service.stream, service.group, 'c1', min_idle_time=0, count=10)[1]
+
+
+def test_failed_entry_moves_to_dead_stream_after_max_deliveries(redis_server):
+    service = make_service(redis_server, max_deliveries=2)
+    entry_id = redis_server.xadd(service.stream, {b'url': b'https://book.douban.com/subject/1/', b'body': b'x'})
+
+    [(delivered, fields)] = deliver(service)
+    assert delivered == entry_id
+    assert service._handle_failed([(entry_id, fields, 'error: bad')]) == 0
+    # 未达到上限，消息保持未确认
+    assert redis_server.xpending(service.stream, service.group)['pending'] == 1
+    assert redis_server.xlen(service.dead_stream) == 0
+
+    [(_, fields)] = deliver(service)
+    assert service._handle_failed([(entry_id, fields, 'error: bad')]) == 1
+    assert redis_server.xpending(service.stream, service.group)['pending'] == 0
+    assert redis_server.xlen(service.stream) == 0
+    [(_, dead_fields)] = redis_server.xrange(service.dead_stream)
+    assert dead_fields[b'url'] == b'https://book.douban.com/subject/1/'
+    assert dead_fields[b'error'] == b'error: bad'
+    assert dead_fields[b'deliveries'] == b'2'
@@ -0,0 +1,129 @@
+import json
+from queue import Empty
+
+import pytest
+from scrapy import Request, Spider
+from scrapy.exceptions import IgnoreRequest
+from scrapy.utils.request import request_from_dict
+
+from douban import serializers
+from douban.middlewares import DrissionPageMiddleware
+from douban.retry import RetryQueue
+
+QUEUE_KEY = 'test:requests'
+
+
+class DummySpider(Spider):
+    name = 'test'
+
+    def parse_detail(self, response):
+        pass
+
+
+SPIDER = DummySpider()
+
+
+def make_queue(server, **kwargs):
+    kwargs.setdefault('serializer', serializers)
+    return RetryQueue(server, 'test:retry', 'test:retry:dead', **kwargs)
+
+
+def detail(book_id, **kwargs):
+    return Request(f'https://book.douban.com/subject/{book_id}/', callback=SPIDER.parse_detail, **kwargs)
+
+
+def test_backoff_grows_exponentially_with_cap(redis_server):
+    queue = make_queue(redis_server, base_delay=10, max_delay=60)
+    for attempt, cap in ((1, 10), (2, 20), (3, 40), (4, 60), (10, 60)):
+        for _ in range(20):
+            assert cap / 2 <= queue.backoff(attempt) <= cap
+
+
+def test_schedule_stores_priority_and_attempt(redis_server):
+    queue = make_queue(redis_server)
+    assert queue.schedule(detail(1, priority=5), 'captcha', spider=SPIDER, proxy_banned=True)
+
+    [(member, due)] = redis_server.zrange('test:retry', 0, -1, withscores=True)
+    score, data = member.split(b'|', 1)
+    assert score == b'-5'
+    request = request_from_dict(serializers.loads(data), spider=SPIDER)
+    assert request.dont_filter
+    assert request.callback == SPIDER.parse_detail
+    assert request.meta['retry_attempt'] == 1
+    assert request.meta['retry_reason'] == 'captcha'
+    assert request.meta['proxy_banned'] is True
+
+
+def test_dead_letter_after_max_attempts(redis_server):
+    queue = make_queue(redis_server, max_attempts=2, dead_maxlen=2)
+    assert not queue.schedule(detail(1, meta={'retry_attempt': 2}), 'http_403', spider=SPIDER)
+    assert len(queue) == 0
+
+    record = json.loads(redis_server.lindex('test:retry:dead', 0))
+    assert record['url'] == 'https://book.douban.com/subject/1/'
+    assert record['callback'] == 'parse_detail'
+    assert record['reason'] == 'http_403'
+    assert record['attempts'] == 2
+
+    for book_id in (2, 3):
+        queue.schedule(detail(book_id, meta={'retry_attempt': 2}), 'http_403', spider=SPIDER)
+    assert redis_server.llen('test:retry:dead') == 2
+
+
+def test_release_due_moves_only_due_requests(redis_server):
+    queue = make_queue(redis_server)
+    queue.schedule(detail(1, priority=3), 'captcha', spider=SPIDER)
+    queue.schedule(detail(2, priority=1), 'captcha', spider=SPIDER)
+    queue.schedule(detail(3), 'captcha', spider=SPIDER)
+    # 优先级为 3 和 1 的已到期，优先级为 0 的还要等很久
+    redis_server.zadd('test:retry', {member: 10 ** 12 if member.startswith(b'0|') else 0
+                                     for member in redis_server.zrange('test:retry', 0, -1)})
+
+    assert queue.release_due(QUEUE_KEY, limit=10) == 2
+    assert len(queue) == 1
+    released = redis_server.zrange(QUEUE_KEY, 0, -1, withscores=True)
+    assert sorted(score for _, score in released) == [-3, -1]
+    urls = {request_from_dict(serializers.loads(data), spider=SPIDER).url for data, _ in released}
+    assert urls == {'https://book.douban.com/subject/1/', 'https://book.douban.com/subject/2/'}
+
+
+def test_release_due_respects_limit(redis_server):
+    queue = make_queue(redis_server)
+    for book_id in range(5):
+        queue.schedule(detail(book_id), 'captcha', spider=SPIDER)
+    redis_server.zadd('test:retry', {member: 0 for member in redis_server.zrange('test:retry', 0, -1)})
+
+    assert queue.release_due(QUEUE_KEY, limit=3) == 3
+    assert queue.release_due(QUEUE_KEY, limit=3) == 2
+    assert queue.release_due(QUEUE_KEY, limit=3) == 0
+    assert redis_server.zcard(QUEUE_KEY) == 5
+
+
+class UnavailableBrowser:
+    def __init__(self, error):
+        self.error = error
+
+    def acquire(self, timeout=None, identity=None, cookies=None):
+        raise self.error
+
+
+@pytest.mark.parametrize('error, reason', [(Empty(), 'tab_timeout'),
+                                           (RuntimeError('chrome crashed'), 'browser_unavailable')])
+def test_browser_failure_goes_to_retry_queue(redis_server, error, reason):
+    # 不启动真实浏览器，只替换 browser_manager
+    middleware = DrissionPageMiddleware.__new__(DrissionPageMiddleware)
+    middleware.stats = None
+    middleware.acquire_timeout = 1
+    middleware.browser_manager = UnavailableBrowser(error)
+    SPIDER.retry_queue = make_queue(redis_server)
+    request = detail(1, meta={'use_drissionpage': True})
+    try:
+        with pytest.raises(IgnoreRequest):
+            middleware._fetch_page(request, SPIDER)
+    finally:
+        del SPIDER.retry_queue
+
+    [member] = redis_server.zrange('test:retry', 0, -1)
+    retried = request_from_dict(serializers.loads(member.split(b'|', 1)[1]), spider=SPIDER)
+    assert retried.url == request.url
+    assert retried.meta['retry_reason'] == reason
@@ -0,0 +1,229 @@
+import os
+
+import pytest
+from scrapy import Request, Spider
+from scrapy.settings import Settings
+
+from douban import dupefilter
+from douban.scheduler import (LEASE_META_KEY, BatchedScheduler, BatchPriorityQueue, requeue_expired_leases,
+                              requeue_leases, worker_token)
+
+QUEUE_KEY = 'test:requests'
+
+
+class DummySpider(Spider):
+    name = 'test'
+
+
+@pytest.fixture
+def spider():
+    spider = DummySpider()
+    spider.settings = Settings()
+    return spider
+
+
+@pytest.fixture
+def make_scheduler(redis_server, spider, monkeypatch):
+    monkeypatch.setattr(dupefilter, 'get_redis_from_settings', lambda settings: redis_server)
+    opened = []
+
+    def make(**kwargs):
+        kwargs.setdefault('flush_interval', 0)
+        kwargs.setdefault('retry_poll_interval', 0)
+        scheduler = BatchedScheduler(redis_server, persist=True, queue_key=QUEUE_KEY,
+                                     queue_cls='douban.scheduler.BatchPriorityQueue',
+                                     dupefilter_cls='douban.dupefilter.BloomDupeFilter', **kwargs)
+        scheduler.open(spider)
+        opened.append(scheduler)
+        return scheduler
+
+    yield make
+    for scheduler in opened:
+        for loop in (scheduler._flush_task, scheduler._heartbeat_task, scheduler._retry_task):
+            if loop is not None and loop.running:
+                loop.stop()
+
+
+def detail(book_id, priority=0):
+    return Request(f'https://book.douban.com/subject/{book_id}/', priority=priority)
+
+
+def test_push_many_and_pop_many_by_priority(redis_server, spider):
+    queue = BatchPriorityQueue(redis_server, spider, QUEUE_KEY)
+    queue.push_many([detail(1, priority=0), detail(2, priority=5), detail(3, priority=1)])
+    assert len(queue) == 3
+
+    assert [r.url for r in queue.pop_many(2)] == [detail(2).url, detail(3).url]
+    assert len(queue) == 1
+    assert [r.url for r in queue.pop_many(10)] == [detail(1).url]
+    assert queue.pop_many(10) == []
+
+
+def test_single_pop_compatible_with_parent(redis_server, spider):
+    queue = BatchPriorityQueue(redis_server, spider, QUEUE_KEY)
+    queue.push_many([detail(1), detail(2, priority=3)])
+    assert queue.pop().url == detail(2).url
+
+
+def test_enqueue_is_buffered_until_batch_is_full(make_scheduler):
+    scheduler = make_scheduler(enqueue_batch=3, lease_ttl=0)
+    scheduler.enqueue_request(detail(1))
+    scheduler.enqueue_request(detail(2))
+    assert len(scheduler.queue) == 0
+    assert scheduler.has_pending_requests()
+
+    scheduler.enqueue_request(detail(3))
+    assert len(scheduler.queue) == 3
+
+
+def test_next_request_flushes_and_prefetches(make_scheduler):
+    scheduler = make_scheduler(enqueue_batch=50, prefetch=2, lease_ttl=0)
+    for i in range(5):
+        scheduler.enqueue_request(detail(i, priority=i))
+
+    assert scheduler.next_request().url == detail(4).url
+    # 一次取出 prefetch 个，其余留在 Redis
+    assert len(scheduler.queue) == 3
+    assert scheduler.next_request().url == detail(3).url
+    assert len(scheduler.queue) == 3
+
+
+def test_close_returns_prefetched_requests(make_scheduler):
+    scheduler = make_scheduler(prefetch=4, lease_ttl=0)
+    for i in range(5):
+        scheduler.enqueue_request(detail(i))
+    scheduler.next_request()
+    scheduler.close('finished')
+    assert len(scheduler.queue) == 4
+
+
+def test_duplicates_are_filtered_before_buffering(make_scheduler):
+    scheduler = make_scheduler(lease_ttl=0)
+    assert scheduler.enqueue_request(detail(1))
+    assert not scheduler.enqueue_request(detail(1))
+    assert scheduler.enqueue_request(detail(1).replace(dont_filter=True))
+    assert len(scheduler) == 2
+
+
+# ---------------------------------------------------------------------------
+# 租约
+# ---------------------------------------------------------------------------
+
+def test_worker_token_is_unique_per_process():
+    token = worker_token('worker1')
+    assert token.startswith('worker1-')
+    assert str(os.getpid()) in token.split('-')
+
+
+def test_pop_leased_moves_requests_to_inflight(redis_server, spider):
+    queue = BatchPriorityQueue(redis_server, spider, QUEUE_KEY)
+    queue.push_many([detail(1, priority=1), detail(2, priority=2), detail(3)])
+
+    leased = queue.pop_leased(2, 'test:inflight', 1000)
+    assert [r.url for _, r in leased] == [detail(2).url, detail(1).url]
+    assert len(queue) == 1
+    # 成员前缀为原优先级分数
+    assert [member.split(b'|', 1)[0] for member, _ in leased] == [b'-2', b'-1']
+    assert redis_server.zrange('test:inflight', 0, -1, withscores=True) == [
+        (member, 1000.0) for member in sorted(member for member, _ in leased)]
+
+    # 已确认的租约在下一次出队时删除
+    leased_again = queue.pop_leased(2, 'test:inflight', 2000, acked=[leased[0][0]])
+    assert [r.url for _, r in leased_again] == [detail(3).url]
+    assert redis_server.zcard('test:inflight') == 2
+
+
+def test_requeue_leases_restores_priority(redis_server, spider):
+    queue = BatchPriorityQueue(redis_server, spider, QUEUE_KEY)
+    queue.push_many([detail(1, priority=1), detail(2, priority=2)])
+    queue.pop_leased(1, f'{QUEUE_KEY}:inflight:a', 100)
+    queue.pop_leased(1, f'{QUEUE_KEY}:inflight:b', 10 ** 12)
+
+    # 只有过期的租约被放回
+    assert requeue_expired_leases(redis_server) == {f'{QUEUE_KEY}:inflight:a': 1}
+    assert [r.url for r in queue.pop_many(10)] == [detail(2).url]
+
+    assert requeue_leases(redis_server, f'{QUEUE_KEY}:inflight:b') == 1
+    assert redis_server.zscore(QUEUE_KEY, redis_server.zrange(QUEUE_KEY, 0, 0)[0]) == -1
+    assert not redis_server.exists(f'{QUEUE_KEY}:inflight:b')
+
+
+def test_scheduler_leases_and_acks(make_scheduler, redis_server):
+    scheduler = make_scheduler(prefetch=2, lease_ttl=60)
+    assert scheduler.inflight_key == f'{QUEUE_KEY}:inflight:{scheduler.worker_id}'
+    for i in range(3):
+        scheduler.enqueue_request(detail(i))
+
+    first = scheduler.next_request()
+    second = scheduler.next_request()
+    assert redis_server.zcard(scheduler.inflight_key) == 2
+    scheduler.ack(first)
+    scheduler.next_request()
+    # 确认随下一次出队删除
+    assert redis_server.zcard(scheduler.inflight_key) == 2
+
+    scheduler.ack(second)
+    scheduler.heartbeat()
+    assert redis_server.zcard(scheduler.inflight_key) == 1
+    assert redis_server.exists(scheduler.heartbeat_key)
+
+
+def test_heartbeat_renews_and_drops_stale_leases(make_scheduler, redis_server):
+    scheduler = make_scheduler(prefetch=2, lease_ttl=60, lease_max_age=100)
+    scheduler.enqueue_request(detail(1))
+    scheduler.enqueue_request(detail(2))
+    fresh, stale = scheduler.next_request(), scheduler.next_request()
+    fresh_member, _ = scheduler._leases[fresh.meta[LEASE_META_KEY]]
+    stale_member, leased_at = scheduler._leases[stale.meta[LEASE_META_KEY]]
+    scheduler._leases[stale.meta[LEASE_META_KEY]] = (stale_member, leased_at - 1000)
+    redis_server.zadd(scheduler.inflight_key, {fresh_member: 1, stale_member: 1})
+
+    scheduler.heartbeat()
+    assert redis_server.zscore(scheduler.inflight_key, fresh_member) > 1
+    # 超过 lease_max_age 的租约不再续约，过期后由主控节点放回
+    assert redis_server.zscore(scheduler.inflight_key, stale_member) == 1
+    assert stale.meta[LEASE_META_KEY] not in scheduler._leases
+
+
+def test_ack_follows_lease_token_not_request_identity(make_scheduler, redis_server):
+    scheduler = make_scheduler(prefetch=2, lease_ttl=60)
+    scheduler.enqueue_request(detail(1))
+    scheduler.enqueue_request(detail(2))
+    first, second = scheduler.next_request(), scheduler.next_request()
+
+    # 重定向等中间件替换出的新请求对象仍能确认原租约，且只确认一次
+    scheduler.ack(first.replace(url='https://book.douban.com/subject/1/?r=1'))
+    scheduler.ack(first)
+    assert len(scheduler._leases) == 1
+    # 未出队过的请求不会误确认别人的租约
+    scheduler.ack(detail(3))
+    scheduler.heartbeat()
+    assert redis_server.zcard(scheduler.inflight_key) == 1
+    scheduler.ack(second)
+    scheduler.heartbeat()
+    assert redis_server.zcard(scheduler.inflight_key) == 0
+
+
+def test_processes_sharing_node_id_do_not_touch_each_others_leases(make_scheduler, redis_server):
+    first = make_scheduler(prefetch=1, lease_ttl=60, worker_id='worker1-host-1-1')
+    first.enqueue_request(detail(1))
+    first.next_request()
+
+    # 同一 NODE_ID 的另一个进程启动时不收回别人的租约
+    second = make_scheduler(prefetch=1, lease_ttl=60, worker_id='worker1-host-2-1')
+    assert second.next_request() is None
+    assert redis_server.zcard(first.inflight_key) == 1
+
+
+def test_close_returns_unacked_leases(make_scheduler, redis_server):
+    scheduler = make_scheduler(prefetch=3, lease_ttl=60)
+    for i in range(3):
+        scheduler.enqueue_request(detail(i))
+    done = scheduler.next_request()
+    scheduler.next_request()
+    scheduler.ack(done)
+    scheduler.close('finished')
+
+    assert not redis_server.exists(scheduler.inflight_key)
+    assert not redis_server.exists(scheduler.heartbeat_key)
+    assert len(scheduler.queue) == 2
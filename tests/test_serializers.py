@@ -0,0 +1,106 @@
+from datetime import datetime
+
+from scrapy import Request, Spider
+from scrapy.utils.request import request_from_dict
+
+from douban import serializers
+from douban.serializers import COMPACT_MARKER, REBUILD_META_KEY
+
+
+class DummySpider(Spider):
+    name = 'test'
+
+    def parse_tag_list(self, response):
+        pass
+
+    def parse_detail(self, response):
+        pass
+
+    def parse_other(self, response):
+        pass
+
+    def errback_handler(self, failure):
+        pass
+
+
+SPIDER = DummySpider()
+URL = 'https://book.douban.com/subject/1007305/'
+
+
+def round_trip(request):
+    data = serializers.dumps(request.to_dict(spider=SPIDER))
+    return data, request_from_dict(serializers.loads(data), spider=SPIDER)
+
+
+def detail_request(**meta):
+    return Request(URL, callback=SPIDER.parse_detail, errback=SPIDER.errback_handler, priority=10,
+                   headers={'User-Agent': 'Mozilla/5.0', 'Referer': 'https://book.douban.com/'},
+                   cookies={'bid': 'abcdefghijk'},
+                   meta=dict({'book_url': URL, 'dont_merge_cookies': True,
+                              'handle_httpstatus_list': [403, 404, 429], 'download_timeout': 20}, **meta))
+
+
+def test_default_detail_request_is_compact():
+    data, restored = round_trip(detail_request())
+    assert data.startswith(COMPACT_MARKER)
+    assert len(data) < 80
+    assert restored.url == URL
+    assert restored.callback == SPIDER.parse_detail
+    assert restored.errback == SPIDER.errback_handler
+    assert restored.priority == 10
+    assert not restored.dont_filter
+    assert restored.meta == {'book_url': URL, 'dont_merge_cookies': True,
+                             'handle_httpstatus_list': [403, 404, 429], 'download_timeout': 20,
+                             REBUILD_META_KEY: True}
+    # 请求头和 Cookie 出队后由 SessionRebuildMiddleware 重建
+    assert not restored.headers
+    assert restored.cookies == {}
+
+
+def test_meta_differences_and_missing_defaults_survive():
+    request = detail_request(retry_attempt=2, tag='小说')
+    del request.meta['download_timeout']
+    request.meta['download_timeout'] = 45
+    del request.meta['book_url']
+    data, restored = round_trip(request.replace(dont_filter=True))
+    assert data.startswith(COMPACT_MARKER)
+    assert restored.dont_filter
+    assert restored.meta == {'dont_merge_cookies': True, 'handle_httpstatus_list': [403, 404, 429],
+                             'download_timeout': 45, 'retry_attempt': 2, 'tag': '小说',
+                             REBUILD_META_KEY: True}
+
+
+def test_decoded_default_lists_are_not_shared():
+    _, first = round_trip(detail_request())
+    first.meta['handle_httpstatus_list'].append(500)
+    _, second = round_trip(detail_request())
+    assert second.meta['handle_httpstatus_list'] == [403, 404, 429]
+
+
+def test_tag_list_request_and_unknown_callback():
+    request = Request('https://book.douban.com/tag/小说?start=20&type=T', callback=SPIDER.parse_tag_list,
+                      meta={'dont_redirect': True, 'handle_httpstatus_list': [302, 403, 404, 429],
+                            'download_timeout': 30})
+    _, restored = round_trip(request)
+    assert restored.url == request.url
+    assert restored.callback == SPIDER.parse_tag_list
+
+    # 不在 CALLBACKS 中的回调按名字保存
+    data, restored = round_trip(Request(URL, callback=SPIDER.parse_other))
+    assert data.startswith(COMPACT_MARKER)
+    assert restored.callback == SPIDER.parse_other
+
+
+def test_requests_that_cannot_be_compacted_use_pickle():
+    for request in (
+        Request(URL, method='POST', body=b'a=1', callback=SPIDER.parse_detail),
+        Request(URL, callback=SPIDER.parse_detail, cb_kwargs={'page': 2}),
+        Request(URL, callback=SPIDER.parse_detail, meta={'started': datetime(2024, 1, 1)}),
+    ):
+        data, restored = round_trip(request)
+        assert not data.startswith(COMPACT_MARKER)
+        assert restored.url == request.url
+        assert restored.method == request.method
+        assert restored.body == request.body
+        assert restored.cb_kwargs == request.cb_kwargs
+        assert REBUILD_META_KEY not in restored.meta
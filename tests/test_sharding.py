@@ -0,0 +1,92 @@
+import pytest
+
+from douban.sharding import ShardRouter, hashed_shard_key
+
+
+@pytest.mark.parametrize('value, expected', [
+    # convertShardKeyToHashed(1)
+    (1, 5902408780260971510),
+    # MongoDB src/mongo/db/hasher_test.cpp
+    (42, -944302157085130861),
+    ('abc', 8478485326885698097),
+])
+def test_hashed_shard_key_matches_mongodb(value, expected):
+    assert hashed_shard_key(value) == expected
+
+
+def test_numbers_hash_as_truncated_int64():
+    assert hashed_shard_key(42.0) == hashed_shard_key(42.123) == hashed_shard_key(42)
+    assert hashed_shard_key('42') != hashed_shard_key(42)
+
+
+def test_unsupported_values():
+    for value in (True, float('nan'), float('inf')):
+        with pytest.raises(TypeError):
+            hashed_shard_key(value)
+
+
+class FakeCursor(list):
+    def sort(self, field, direction):
+        return FakeCursor(sorted(self, key=lambda doc: list(doc[field].values()), reverse=direction < 0))
+
+
+class FakeCollection:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def _match(self, doc, query):
+        return all(doc.get(key) == value for key, value in query.items())
+
+    def find_one(self, query):
+        return next((doc for doc in self.docs if self._match(doc, query)), None)
+
+    def find(self, query, projection=None):
+        return FakeCursor(doc for doc in self.docs if self._match(doc, query))
+
+
+def make_client(key, chunks, uuid=True):
+    collection = {'_id': 'douban.books', 'key': key}
+    if uuid:
+        collection['uuid'] = 'u1'
+        chunks = [dict(chunk, uuid='u1') for chunk in chunks]
+    else:
+        chunks = [dict(chunk, ns='douban.books') for chunk in chunks]
+    return {'config': {'collections': FakeCollection([collection]), 'chunks': FakeCollection(chunks)}}
+
+
+def test_hashed_router_partitions_by_chunk_bounds():
+    # 最小值用一个比所有 64 位哈希都小的数代替 MinKey，排序时在最前
+    chunks = [
+        {'min': {'book_id': 0}, 'shard': 'shard2'},
+        {'min': {'book_id': -2 ** 64}, 'shard': 'shard1'},
+    ]
+    router = ShardRouter(make_client({'book_id': 'hashed'}, chunks), 'douban.books')
+    items = [{'book_id': str(i)} for i in range(50)]
+    groups = router.partition(items)
+
+    assert router.hashed and router.field == 'book_id'
+    assert set(groups) == {'shard1', 'shard2'}
+    for shard, group in groups.items():
+        for item in group:
+            negative = hashed_shard_key(item['book_id']) < 0
+            assert shard == ('shard1' if negative else 'shard2')
+    assert sum(len(group) for group in groups.values()) == 50
+
+
+def test_range_router_without_uuid():
+    chunks = [
+        {'min': {'book_id': ''}, 'shard': 'shard1'},
+        {'min': {'book_id': '5'}, 'shard': 'shard2'},
+    ]
+    router = ShardRouter(make_client({'book_id': 1}, chunks, uuid=False), 'douban.books')
+    groups = router.partition([{'book_id': '1'}, {'book_id': '7'}, {'book_id': None}])
+    assert [item['book_id'] for item in groups['shard1']] == ['1']
+    assert [item['book_id'] for item in groups['shard2']] == ['7']
+    # 与边界类型不可比较的值交给 mongos
+    assert [item['book_id'] for item in groups[None]] == [None]
+
+
+def test_unsharded_collection_is_not_split():
+    client = {'config': {'collections': FakeCollection([]), 'chunks': FakeCollection([])}}
+    items = [{'book_id': '1'}, {'book_id': '2'}]
+    assert ShardRouter(client, 'douban.books').partition(items, key='book_id') == {None: items}
@@ -0,0 +1,237 @@
+import logging
+
+import pytest
+from scrapy import Request
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.utils.test import get_crawler
+from twisted.internet.task import Clock
+
+from douban.middlewares import BlockRateMiddleware, GlobalRateLimitMiddleware
+from douban.throttle import (TOKEN_BUCKET_SCRIPT, AIMDController, GlobalRateLimiter, SlotConcurrencyLimiter,
+                             SlotDelayScheduler)
+
+SLOT = ('book.douban.com', 'http://10.0.0.1:8080', 'anonymous')
+
+
+def take(server, interval=1000, burst=1, max_wait=30000, key='throttle:test'):
+    return int(server.eval(TOKEN_BUCKET_SCRIPT, 1, key, interval, burst, max_wait))
+
+
+def test_token_bucket_allows_burst_then_spaces_requests(redis_server):
+    waits = [take(redis_server, burst=3) for _ in range(5)]
+    assert waits[:3] == [0, 0, 0]
+    # 之后每个令牌间隔 interval，测试本身的耗时只会让等待变短
+    assert 900 < waits[3] <= 1000
+    assert 1900 < waits[4] <= 2000
+
+
+def test_token_bucket_refuses_beyond_max_wait_without_reserving(redis_server):
+    assert take(redis_server, max_wait=1500) == 0
+    assert 900 < take(redis_server, max_wait=1500) <= 1000
+    refused = take(redis_server, max_wait=1500)
+    assert -2000 <= refused < -1900
+    # 被拒绝的请求不占用令牌，下一个请求仍排在同一位置
+    assert -2000 <= take(redis_server, max_wait=1500) < -1900
+
+
+def test_token_bucket_key_expires_when_idle(redis_server):
+    take(redis_server, interval=1000, burst=2)
+    ttl = redis_server.pttl('throttle:test')
+    assert 2000 < ttl <= 3000
+
+
+def test_buckets_are_independent(redis_server):
+    assert take(redis_server, key='throttle:a') == 0
+    assert take(redis_server, key='throttle:b') == 0
+    assert take(redis_server, key='throttle:a') > 0
+
+
+def test_bucket_key_scope(redis_server):
+    limiter = GlobalRateLimiter(redis_server, rate=1, scope=('domain', 'identity'), clock=Clock())
+    assert limiter.bucket_key(SLOT) == 'throttle:book.douban.com:anonymous'
+    assert limiter.bucket_key(('book.douban.com', None, '')) == 'throttle:book.douban.com:-'
+
+
+def test_acquire_waits_on_clock(redis_server):
+    clock = Clock()
+    limiter = GlobalRateLimiter(redis_server, rate=1, burst=1, clock=clock)
+    fired = []
+    limiter.acquire(SLOT).addCallback(fired.append)
+    limiter.acquire(SLOT).addCallback(fired.append)
+    clock.advance(0)
+    assert len(fired) == 1
+    clock.advance(1)
+    assert len(fired) == 2
+
+
+def test_acquire_retries_after_max_wait(redis_server):
+    clock = Clock()
+    limiter = GlobalRateLimiter(redis_server, rate=1, burst=1, max_wait=0.5, clock=clock)
+    limiter.acquire(SLOT)
+    fired = []
+    limiter.acquire(SLOT).addCallback(fired.append)
+    # 需要等待约 1 秒，超过 max_wait，先等 max_wait 再重新领取
+    assert not fired
+    assert [round(call.getTime(), 1) for call in clock.getDelayedCalls()] == [0.0, 0.5]
+
+
+def test_acquire_passes_when_redis_fails(redis_server):
+    clock = Clock()
+    limiter = GlobalRateLimiter(redis_server, rate=1, clock=clock)
+
+    def broken(*args, **kwargs):
+        raise ConnectionError('down')
+
+    limiter.script = broken
+    fired = []
+    limiter.acquire(SLOT).addCallback(fired.append)
+    clock.advance(0)
+    assert fired == [None]
+
+
+def test_rate_limit_disabled_when_rate_is_not_positive(redis_server):
+    for rate in (0, -1):
+        crawler = get_crawler(settings_dict={'GLOBAL_RATE_LIMIT_ENABLED': True, 'GLOBAL_RATE_LIMIT': rate})
+        with pytest.raises(NotConfigured):
+            GlobalRateLimitMiddleware.from_crawler(crawler)
+        with pytest.raises(ValueError):
+            GlobalRateLimiter(redis_server, rate=rate, clock=Clock())
+
+
+# ---------------------------------------------------------------------------
+# 按代理、会话生效的 AIMD 间隔与并发
+# ---------------------------------------------------------------------------
+
+PROXY = 'http://10.0.0.1:8080'
+
+
+class FakeRetryQueue:
+    def __init__(self):
+        self.scheduled = []
+
+    def schedule(self, request, reason, spider=None, **meta):
+        self.scheduled.append((request.url, reason))
+        return True
+
+
+class FakeSpider:
+    def __init__(self):
+        self.logger = logging.getLogger('test')
+        self.retry_queue = FakeRetryQueue()
+
+
+def identity_request(url, identity):
+    return Request(url, meta={'proxy': PROXY}, cookies={'user_id': identity})
+
+
+def make_controller(clock, **kwargs):
+    kwargs.setdefault('start_delay', 10)
+    return AIMDController(clock=clock, **kwargs)
+
+
+def test_limiter_takes_all_keys_or_none():
+    limiter = SlotConcurrencyLimiter()
+    limits = {('proxy', 'p'): 1, ('session', 'a'): 2, ('session', 'b'): 2}
+    assert limiter.try_acquire([('proxy', 'p'), ('session', 'a')], limits.get)
+    # 代理已满，会话 b 的名额也不会被占用
+    assert not limiter.try_acquire([('proxy', 'p'), ('session', 'b')], limits.get)
+    assert limiter.active(('session', 'b')) == 0
+
+    limiter.release([('proxy', 'p'), ('session', 'a')])
+    assert limiter.try_acquire([('proxy', 'p'), ('session', 'b')], limits.get)
+
+
+def test_limiter_blocking_acquire_times_out():
+    limiter = SlotConcurrencyLimiter()
+    assert limiter.acquire(['k'], lambda key: 1, timeout=0.1)
+    assert not limiter.acquire(['k'], lambda key: 1, timeout=0.1)
+
+
+def test_limiter_acquire_later_waits_for_release():
+    clock = Clock()
+    limiter = SlotConcurrencyLimiter()
+    limiter.try_acquire(['k'], lambda key: 1)
+    results = []
+    limiter.acquire_later(['k'], lambda key: 1, timeout=5, clock=clock).addCallback(results.append)
+    clock.advance(1)
+    assert results == []
+    limiter.release(['k'])
+    clock.advance(0.2)
+    assert results == [True]
+
+    limiter.acquire_later(['k'], lambda key: 1, timeout=1, clock=clock).addCallback(results.append)
+    clock.pump([0.2] * 10)
+    assert results == [True, False]
+
+
+def test_delay_is_spaced_per_proxy_across_identities():
+    clock = Clock()
+    scheduler = SlotDelayScheduler(clock=clock)
+    fired = []
+    # 两个身份共用一个代理：第二个请求要等代理的间隔，而不是各自独立放行
+    scheduler.wait_all([(('proxy', 'p'), 10), (('session', 'a'), 3)]).addCallback(fired.append)
+    scheduler.wait_all([(('proxy', 'p'), 10), (('session', 'b'), 3)]).addCallback(fired.append)
+    # 同一会话换了代理，只需等会话的间隔
+    scheduler.wait_all([(('proxy', 'q'), 10), (('session', 'a'), 3)]).addCallback(fired.append)
+    clock.advance(0)
+    assert len(fired) == 1
+    clock.advance(3)
+    assert len(fired) == 2
+    clock.advance(6)
+    assert len(fired) == 2
+    clock.advance(1)
+    assert len(fired) == 3
+
+
+def test_controller_limits_are_per_key():
+    controller = make_controller(Clock(), min_concurrency=1, max_concurrency=4)
+    slot_a = ('book.douban.com', PROXY, 'a')
+    for _ in range(20):
+        controller.record(slot_a)
+    assert controller.key_concurrency(('proxy', PROXY)) == 4
+    # 新会话从最小并发开始，请求取两者中较小的
+    assert controller.key_concurrency(('session', 'b')) == 1
+    assert controller.concurrency_for(('book.douban.com', PROXY, 'b')) == 1
+
+    controller.record(slot_a, 'http_403')
+    assert controller.key_concurrency(('proxy', PROXY)) == 2
+    assert controller.key_delay(('proxy', PROXY)) > controller.key_delay(('session', 'c'))
+
+
+def test_http_requests_share_proxy_concurrency_across_identities():
+    clock = Clock()
+    controller = make_controller(clock, concurrency_timeout=5)
+    middleware = BlockRateMiddleware(get_crawler(settings_dict={'AIMD_ENABLED': True}), controller, clock=clock)
+    spider = FakeSpider()
+
+    first = identity_request('https://book.douban.com/subject/1/', 'a')
+    second = identity_request('https://book.douban.com/subject/2/', 'b')
+    results = []
+    middleware.process_request(first, spider).addCallback(results.append)
+    middleware.process_request(second, spider).addCallback(results.append)
+    clock.advance(0)
+    # 代理并发为 1，另一个身份的请求要等第一个请求返回
+    assert results == [None]
+    assert controller.limiter.active(('proxy', PROXY)) == 1
+
+    middleware.process_exception(first, ConnectionError(), spider)
+    clock.advance(0.2)
+    assert results == [None, None]
+    assert controller.limiter.active(('session', 'b')) == 1
+
+
+def test_http_request_goes_to_retry_queue_on_concurrency_timeout():
+    clock = Clock()
+    controller = make_controller(clock, concurrency_timeout=1)
+    middleware = BlockRateMiddleware(get_crawler(settings_dict={'AIMD_ENABLED': True}), controller, clock=clock)
+    spider = FakeSpider()
+    middleware.process_request(identity_request('https://book.douban.com/subject/1/', 'a'), spider)
+    clock.advance(0)
+
+    failures = []
+    request = identity_request('https://book.douban.com/subject/2/', 'b')
+    middleware.process_request(request, spider).addErrback(failures.append)
+    clock.pump([0.2] * 10)
+    assert failures and failures[0].check(IgnoreRequest)
+    assert spider.retry_queue.scheduled == [(request.url, 'concurrency_timeout')]
+    assert '_aimd_permit' not in request.meta